@@ -1,42 +1,45 @@
 import pandas as pd
-from datas.query_stock import query_latest_bars, query_all_stock_code_list
+from datas.query_stock import query_panel, query_recent_trade_dates, query_all_stock_code_list
 from datas.stock_index_list import hs300_code_list
 
-def calculate_ma_status(df: pd.DataFrame, window: int = 60) -> pd.DataFrame:
-    if df.empty or 'close' not in df.columns or len(df) < window:
-        return pd.DataFrame(columns=['date', 'above_ma'])
-    
-    ma = df['close'].rolling(window=window).mean()
-    df['above_ma'] = (df['close'] > ma).astype(int)
-    
-    return df[['date', 'above_ma']].dropna()
+def calculate_ma_status(close: pd.DataFrame, window: int = 60) -> pd.DataFrame:
+    """
+    Mark whether each stock closes above its moving average.
+
+    The average of each stock is taken over its own last `window` bars, suspended days
+    (NaN) are skipped instead of breaking the window.
+
+    Args:
+        close: wide close panel, indexed by date with one column per code
+
+    Returns:
+        pd.DataFrame of 1/0 with the same shape, NaN where the stock has no bar
+    """
+    ma = close.apply(lambda s: s.dropna().rolling(window=window).mean()).reindex(close.index)
+    above = (close > ma).astype(float)
+    return above.where(close.notna())
 
 def analyse_ma_breadth(stock_codes: pd.Series, window: int = 60, days: int = 365) -> pd.DataFrame:
-    all_dfs = []
     # We need to fetch enough data to calculate MA. 
     # If we want 'days' of result, we need days + window data.
     fetch_days = days + window + 20 
     
-    for code in stock_codes:
-        df = query_latest_bars(code, fetch_days)
-        if df.empty:
-            continue
-        
-        ma_df = calculate_ma_status(df, window)
-        if not ma_df.empty:
-            all_dfs.append(ma_df)
-
-    if not all_dfs:
+    trade_dates = query_recent_trade_dates(fetch_days)
+    if not trade_dates:
+        return pd.DataFrame(columns=['date', 'count_above_ma', 'total_stocks', 'percent_above_ma'])
+
+    close = query_panel(stock_codes, ['close'], from_date=trade_dates[0].strftime("%Y%m%d"))['close']
+    if close.empty or len(close) < window:
         return pd.DataFrame(columns=['date', 'count_above_ma', 'total_stocks', 'percent_above_ma'])
     
-    combined_df = pd.concat(all_dfs, ignore_index=True)
-    
-    result = (
-        combined_df.groupby('date')['above_ma']
-        .agg(['sum', 'count'])
-        .reset_index()
-        .rename(columns={'sum': 'count_above_ma', 'count': 'total_stocks'})
-    )
+    above = calculate_ma_status(close, window)
+
+    result = pd.DataFrame({
+        'count_above_ma': above.sum(axis=1).astype(int),
+        'total_stocks': above.count(axis=1),
+    })
+    result.index.name = 'date'
+    result = result[result['total_stocks'] > 0].reset_index()
     
     result['percent_above_ma'] = (result['count_above_ma'] / result['total_stocks'] * 100).round(2)
     
@@ -1,40 +1,36 @@
-import akshare as ak
-import sqlite3
 import pandas as pd
-from pathlib import Path
-from datas.query_stock import query_latest_bars
+from datas.query_stock import query_panel, query_recent_trade_dates
 from datas.stock_index_list import hs300_code_list, csi500_code_list, csi2000_code_list
 
-def close_at_20_high_serise(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty or 'close' not in df.columns:
-        return pd.DataFrame(columns=['date', 'close_at_20_high'])
-    
-    rolling_max = df['close'].rolling(window=20, min_periods=1).max()
-    df['close_at_20_high'] = (df['close'] >= rolling_max).astype(int)
+def close_at_20_high_serise(close: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mark whether each stock closes at its 20-bar high.
 
-    high_df = df[['date', 'close_at_20_high']]
-    
-    return high_df
+    Args:
+        close: wide close panel, indexed by date with one column per code
+
+    Returns:
+        pd.DataFrame of 1/0 with the same shape
+    """
+    rolling_max = close.rolling(window=20, min_periods=1).max()
+    return (close >= rolling_max).astype(int)
 
 
 def analyse_close_20_high_count(stock_codes: pd.Series, days: int = 365) -> pd.DataFrame:
-    all_high_dfs = []
-    for code in stock_codes:
-        df = query_latest_bars(code, days)
-        if df.empty:
-            continue
-        high_df = close_at_20_high_serise(df)
-        all_high_dfs.append(high_df)
-
-    if not all_high_dfs:
+    trade_dates = query_recent_trade_dates(days)
+    if not trade_dates:
+        return pd.DataFrame(columns=['date', 'close_at_20_high_count'])
+
+    close = query_panel(stock_codes, ['close'], from_date=trade_dates[0].strftime("%Y%m%d"))['close']
+    if close.empty:
         return pd.DataFrame(columns=['date', 'close_at_20_high_count'])
     
-    combined_df = pd.concat(all_high_dfs, ignore_index=True)
+    high = close_at_20_high_serise(close)
     result = (
-        combined_df.groupby('date')['close_at_20_high']
-        .sum()
+        high.sum(axis=1)
+        .rename('close_at_20_high_count')
+        .rename_axis('date')
         .reset_index()
-        .rename(columns={'close_at_20_high': 'close_at_20_high_count'})
     )
 
     return result.tail(days).reset_index(drop=True)
@@ -45,4 +41,4 @@ if __name__ == "__main__":
     print(result_df)
     date_2024_09_24 = result_df[result_df['date'] == '2024-09-24']
     count = date_2024_09_24.iloc[0]['close_at_20_high_count'] if not date_2024_09_24.empty else 0
-    print(f"20_high at 2024-09-24: {count}")
\ No newline at end of file
+    print(f"20_high at 2024-09-24: {count}")
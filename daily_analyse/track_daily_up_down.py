@@ -1,36 +1,38 @@
 import pandas as pd
-from datas.query_stock import query_latest_bars, query_all_stock_code_list
+from datas.query_stock import query_panel, query_recent_trade_dates, query_all_stock_code_list
 
-def mark_close_not_lower_than_previous(df: pd.DataFrame) -> pd.DataFrame:
-    
-    df['prev_close'] = df['close'].shift(1)
-    df['is_up'] = (df['close'] > df['prev_close']).fillna(False).astype(int)
-    df['is_down'] = (df['close'] < df['prev_close']).fillna(False).astype(int)
+def mark_close_not_lower_than_previous(close: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compare each close with the stock's previous available close (suspended days are skipped).
+
+    Args:
+        close: wide close panel, indexed by date with one column per code
+
+    Returns:
+        (is_up, is_down) boolean panels with the same shape
+    """
+    prev_close = close.ffill().shift(1)
+    is_up = close > prev_close
+    is_down = close < prev_close
     
-    return df[['date', 'is_up', 'is_down']]
+    return is_up, is_down
 
 
 def count_stocks_with_price_not_lower(stock_codes: pd.Series, days: int = 365) -> pd.DataFrame:
-    daily_signals = []
-
-    for code in stock_codes:
-        price_df = query_latest_bars(code, days)
-        if price_df.empty:
-            continue
-        signal_df = mark_close_not_lower_than_previous(price_df)
-        daily_signals.append(signal_df)
+    trade_dates = query_recent_trade_dates(days)
+    if not trade_dates:
+        return pd.DataFrame(columns=['date', 'up_count', 'down_count'])
 
-    if not daily_signals:
+    close = query_panel(stock_codes, ['close'], from_date=trade_dates[0].strftime("%Y%m%d"))['close']
+    if close.empty:
         return pd.DataFrame(columns=['date', 'up_count', 'down_count'])
 
-    all_signals = pd.concat(daily_signals, ignore_index=True)
+    is_up, is_down = mark_close_not_lower_than_previous(close)
 
-    summary = (
-        all_signals.groupby('date')[['is_up', 'is_down']]
-        .sum()
-        .reset_index()
-        .rename(columns={'is_up': 'up_count', 'is_down': 'down_count'})
-    )
+    summary = pd.DataFrame({
+        'up_count': is_up.sum(axis=1),
+        'down_count': is_down.sum(axis=1),
+    }).rename_axis('date').reset_index()
 
     return summary.tail(days).reset_index(drop=True)
 
@@ -43,4 +45,4 @@ if __name__ == "__main__":
     # target_date = "2024-09-24"
     # row = result_df[result_df['date'] == target_date]
     # count = row['up_count'].iloc[0] if not row.empty else 0
-    # print(f"Number of stocks with close > previous day on {target_date}: {count}")
\ No newline at end of file
+    # print(f"Number of stocks with close > previous day on {target_date}: {count}")
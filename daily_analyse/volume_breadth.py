@@ -1,49 +1,49 @@
+import numpy as np
 import pandas as pd
-from datas.query_stock import query_latest_bars, query_all_stock_code_list
+from datas.query_stock import query_panel, query_recent_trade_dates, query_all_stock_code_list
 
-def calculate_volume_flow(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty or 'close' not in df.columns or 'volume' not in df.columns:
-        return pd.DataFrame(columns=['date', 'up_vol', 'down_vol'])
-    
-    df['prev_close'] = df['close'].shift(1)
+def calculate_volume_flow(close: pd.DataFrame, volume: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split each stock's volume into up volume and down volume.
+
+    Args:
+        close: wide close panel, indexed by date with one column per code
+        volume: wide volume panel aligned with close
+
+    Returns:
+        (up_vol, down_vol) panels with the same shape
+    """
+    prev_close = close.ffill().shift(1)
     
     # Up volume: Close > Prev Close
-    df['up_vol'] = df.apply(lambda x: x['volume'] if x['close'] > x['prev_close'] else 0, axis=1)
+    up_vol = volume.where(close > prev_close, 0)
     
     # Down volume: Close < Prev Close
-    df['down_vol'] = df.apply(lambda x: x['volume'] if x['close'] < x['prev_close'] else 0, axis=1)
+    down_vol = volume.where(close < prev_close, 0)
     
-    return df[['date', 'up_vol', 'down_vol']].dropna()
+    return up_vol, down_vol
 
 def analyse_volume_breadth(stock_codes: pd.Series, days: int = 365) -> pd.DataFrame:
-    all_dfs = []
-    
-    for code in stock_codes:
-        df = query_latest_bars(code, days + 1) # +1 for prev_close
-        if df.empty:
-            continue
-        
-        vol_df = calculate_volume_flow(df)
-        if not vol_df.empty:
-            all_dfs.append(vol_df)
+    trade_dates = query_recent_trade_dates(days + 1) # +1 for prev_close
+    if not trade_dates:
+        return pd.DataFrame(columns=['date', 'total_up_vol', 'total_down_vol', 'vol_ratio'])
 
-    if not all_dfs:
+    panel = query_panel(stock_codes, ['close', 'volume'], from_date=trade_dates[0].strftime("%Y%m%d"))
+    if panel['close'].empty:
         return pd.DataFrame(columns=['date', 'total_up_vol', 'total_down_vol', 'vol_ratio'])
     
-    combined_df = pd.concat(all_dfs, ignore_index=True)
-    
-    result = (
-        combined_df.groupby('date')[['up_vol', 'down_vol']]
-        .sum()
-        .reset_index()
-        .rename(columns={'up_vol': 'total_up_vol', 'down_vol': 'total_down_vol'})
-    )
+    up_vol, down_vol = calculate_volume_flow(panel['close'], panel['volume'])
+
+    # first date has no prev_close
+    result = pd.DataFrame({
+        'total_up_vol': up_vol.sum(axis=1).astype('int64'),
+        'total_down_vol': down_vol.sum(axis=1).astype('int64'),
+    }).iloc[1:].rename_axis('date').reset_index()
     
     # Avoid division by zero
-    result['vol_ratio'] = result.apply(
-        lambda x: x['total_up_vol'] / x['total_down_vol'] if x['total_down_vol'] > 0 else 100.0, 
-        axis=1
-    ).round(2)
+    total_down = result['total_down_vol'].to_numpy(dtype=float)
+    ratio = np.divide(result['total_up_vol'].to_numpy(dtype=float), total_down, out=np.full(len(result), 100.0), where=total_down > 0)
+    result['vol_ratio'] = pd.Series(ratio, index=result.index).round(2)
     
     return result.tail(days).reset_index(drop=True)
 
@@ -0,0 +1,300 @@
+import time
+import datetime
+import numpy as np
+import pandas as pd
+from typing import Iterable, Iterator, Optional
+from tools.log import get_fetch_logger
+from tools.times import datetime_to_int_dates, int_dates_to_datetime
+from datas.bar_store import get_bar_store
+from datas.trade_calendar import get_trade_calendar
+from datas.create_database import DAILY_BAR_TABLE, BAR_QUALITY_TABLE, get_db_connection, get_read_connection, create_bar_quality_table
+
+logger = get_fetch_logger()
+
+# kinds of findings
+QUALITY_CHECKS = (
+    "gap",          # trading days without a bar between a code's first and last bar
+    "ohlc",         # high below / low above open, close or each other
+    "bad_price",    # zero, negative or missing price
+    "volume_unit",  # amount/volume off by powers of ten against the rest of the code (lots vs shares, 千元 vs 元)
+    "price_jump",   # close-to-close return that disagrees with the source's change_pct (broken qfq)
+)
+# kinds claim_bar_repairs() hands to the refresh planner. Gaps are mostly suspensions the
+# source has no bars for either, re-fetching them would repeat every run; they are kept
+# as findings only.
+REPAIRABLE_CHECKS = ("ohlc", "bad_price", "volume_unit", "price_jump")
+
+_SCAN_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount', 'change_pct']
+
+# bars of a new listing without price limits
+_IPO_FREE_BARS = 5
+
+def _price_limits(codes: np.ndarray) -> np.ndarray:
+    """Daily limit of each code's board, for rows without the source's change_pct."""
+    prefix2 = codes.astype('U2')
+    limits = np.full(len(codes), 0.10)
+    limits[np.isin(prefix2, ('30', '68'))] = 0.20
+    limits[np.isin(prefix2, ('43', '83', '87', '88', '92'))] = 0.30
+    return limits
+
+def _ranges(kind: str, flags: np.ndarray, code_ids: np.ndarray, codes: np.ndarray, dates: np.ndarray, detail) -> list[tuple]:
+    """Runs of consecutive flagged rows of the same code as findings, detail(row) of the run's first row."""
+    rows = np.flatnonzero(flags)
+    if not len(rows):
+        return []
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (np.diff(rows) != 1) | (code_ids[rows[1:]] != code_ids[rows[:-1]])
+    first = np.flatnonzero(starts)
+    last = np.r_[first[1:], len(rows)] - 1
+    return [
+        (str(codes[code_ids[rows[f]]]), kind, int(dates[rows[f]]), int(dates[rows[l]]), int(l - f + 1), detail(rows[f]))
+        for f, l in zip(first, last)
+    ]
+
+def check_bar_chunk(codes: np.ndarray, lengths: np.ndarray, dates: np.ndarray, cols: dict[str, np.ndarray], calendar_dates: np.ndarray) -> list[tuple]:
+    """
+    Run every check of QUALITY_CHECKS over the bars of a chunk of codes.
+
+    All checks are vectorized over the whole chunk, rows of consecutive codes are told
+    apart by `lengths`.
+
+    Args:
+        codes: codes of the chunk, in row order
+        lengths: number of bars of each code
+        dates: yyyymmdd of every row, ascending within each code
+        cols: _SCAN_COLUMNS arrays aligned with dates
+        calendar_dates: ascending trading days as yyyymmdd
+
+    Returns:
+        list of (code, kind, from_date, to_date, bar_count, detail), bar_count is the
+        number of flagged bars (missing trading days for gaps)
+    """
+    n = len(dates)
+    if n == 0:
+        return []
+    codes, lengths = codes[lengths > 0], lengths[lengths > 0]
+    code_ids = np.repeat(np.arange(len(codes)), lengths)
+    code_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    first = np.zeros(n, dtype=bool)
+    first[code_starts] = True
+    has_prev = ~first
+    prev = np.maximum(np.arange(n) - 1, 0)
+
+    o, h, l, c = (np.asarray(cols[k], dtype='float64') for k in ('open', 'high', 'low', 'close'))
+    volume = np.asarray(cols['volume'], dtype='float64')
+    amount = np.asarray(cols['amount'], dtype='float64')
+    change_pct = np.asarray(cols['change_pct'], dtype='float64')
+    findings = []
+
+    # gaps: trading days strictly between a bar and the one before it
+    left = np.searchsorted(calendar_dates, dates, side='left')
+    right = np.searchsorted(calendar_dates, dates, side='right')
+    missing = np.where(has_prev, left - right[prev], 0)
+    for i in np.flatnonzero(missing > 0):
+        findings.append((
+            str(codes[code_ids[i]]), "gap", int(calendar_dates[right[i - 1]]), int(calendar_dates[left[i] - 1]),
+            int(missing[i]), f"{missing[i]} trading days without bars"
+        ))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bad_price = ~((o > 0) & (h > 0) & (l > 0) & (c > 0))
+        findings += _ranges("bad_price", bad_price, code_ids, codes, dates,
+                            lambda i: f"open={o[i]} high={h[i]} low={l[i]} close={c[i]}")
+
+        eps = 1e-6
+        ohlc = ~bad_price & (
+            (h + eps < np.maximum(np.maximum(o, c), l)) | (l - eps > np.minimum(np.minimum(o, c), h))
+        )
+        findings += _ranges("ohlc", ohlc, code_ids, codes, dates,
+                            lambda i: f"open={o[i]} high={h[i]} low={l[i]} close={c[i]}")
+
+        # units: log10(amount / (volume * close)) only drifts with prices and adj factors,
+        # a step of a whole order of magnitude between two bars is a unit switch
+        ratio = np.log10(amount / (volume * c))
+        ratio[~np.isfinite(ratio)] = np.nan
+        ratio = pd.Series(ratio).groupby(code_ids).ffill().to_numpy()
+        step = np.where(has_prev, ratio - ratio[prev], 0.0)
+        step = np.where(np.abs(step) > 0.8, np.rint(step), 0.0)
+        step[~np.isfinite(step)] = 0.0
+        if step.any():
+            level = np.cumsum(step)
+            level -= np.repeat(level[code_starts], lengths)
+            shifted = np.unique(code_ids[step != 0])
+            in_shifted = np.isin(code_ids, shifted)
+            counts = pd.DataFrame({'code': code_ids[in_shifted], 'level': level[in_shifted]}).value_counts()
+            usual = counts.reset_index().drop_duplicates('code').set_index('code')['level']
+            off = np.zeros(n, dtype=bool)
+            off[in_shifted] = level[in_shifted] != usual.reindex(code_ids[in_shifted]).to_numpy()
+            findings += _ranges("volume_unit", off, code_ids, codes, dates,
+                                lambda i: f"amount/volume x10^{int(level[i] - usual[code_ids[i]])} against the code's other bars")
+
+        # discontinuities, only between bars of consecutive trading days
+        ret = np.where(has_prev, c / c[prev] - 1, np.nan)
+        consecutive = has_prev & (missing == 0) & ~bad_price & ~bad_price[prev]
+        rounding = 0.01 / c[prev]
+        known = np.isfinite(change_pct)
+        jump_vs_source = known & (np.abs(100 * ret - change_pct) > 0.6 + 100 * rounding)
+        bar_no = np.arange(n) - np.repeat(code_starts, lengths)
+        limits = _price_limits(codes)[code_ids]
+        jump_vs_limit = ~known & (bar_no >= _IPO_FREE_BARS) & (np.abs(ret) > limits + 0.015 + rounding)
+        jump = consecutive & (jump_vs_source | jump_vs_limit)
+        findings += _ranges("price_jump", jump, code_ids, codes, dates,
+                            lambda i: f"close {c[prev[i]]} -> {c[i]} ({ret[i]:+.2%}), source change_pct={change_pct[i]}")
+
+    return findings
+
+def _chunks_from_store(store, codes: Optional[list[str]], chunk_codes: int) -> Iterator[tuple]:
+    selected = list(store.index) if codes is None else [code for code in codes if code in store]
+    for i in range(0, len(selected), chunk_codes):
+        chunk = selected[i:i + chunk_codes]
+        spans = [store.index[code] for code in chunk]
+        lengths = np.array([hi - lo for lo, hi in spans], dtype='int64')
+        lo, hi = spans[0][0], spans[-1][1]
+        if hi - lo == lengths.sum():
+            take = slice(lo, hi)
+        else:
+            take = np.concatenate([np.arange(lo, hi) for lo, hi in spans])
+        dates = datetime_to_int_dates(np.asarray(store.dates[take]))
+        cols = {col: np.asarray(store.columns[col][take]) for col in _SCAN_COLUMNS}
+        yield np.array(chunk), lengths, dates, cols
+
+def _chunks_from_sqlite(codes: Optional[list[str]], chunk_codes: int) -> Iterator[tuple]:
+    conn = get_read_connection()
+    if codes is None:
+        codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE} ORDER BY code")]
+    for i in range(0, len(codes), chunk_codes):
+        chunk = codes[i:i + chunk_codes]
+        placeholders = ','.join('?' for _ in chunk)
+        df = pd.DataFrame.from_records(
+            conn.execute(
+                f"SELECT code, date, {', '.join(_SCAN_COLUMNS)} FROM {DAILY_BAR_TABLE} WHERE code IN ({placeholders}) ORDER BY code, date",
+                chunk
+            ).fetchall(),
+            columns=['code', 'date', *_SCAN_COLUMNS]
+        )
+        if df.empty:
+            continue
+        present = df['code'].drop_duplicates()
+        lengths = np.diff(np.r_[present.index.to_numpy(), len(df)])
+        cols = {col: pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64') for col in _SCAN_COLUMNS}
+        yield present.to_numpy(dtype=str), lengths, df['date'].to_numpy(dtype='int64'), cols
+
+def scan_bar_quality(codes: Optional[Iterable[str]] = None, chunk_codes: int = 500) -> dict[str, int]:
+    """
+    Validate the stored daily bars and record what is broken in BAR_QUALITY_TABLE.
+
+    Reads the columnar bar store when it is fresh (SQLite otherwise) a chunk of codes at a
+    time and runs check_bar_chunk on each chunk. The findings of the scanned codes replace
+    their previous ones; findings that were already handed to the refresh planner keep
+    their repair_planned_at, so a range that a re-fetch could not fix is not re-fetched
+    again and again.
+
+    Args:
+        codes: codes to scan, None scans the whole table
+        chunk_codes: codes checked per chunk
+
+    Returns:
+        dict: number of findings by kind
+    """
+    start = time.time()
+    codes = sorted(set(codes)) if codes is not None else None
+    calendar = get_trade_calendar()
+    calendar.is_trading_day(datetime.date.today())  # cover up to today
+    store = get_bar_store()
+    chunks = _chunks_from_store(store, codes, chunk_codes) if store is not None else _chunks_from_sqlite(codes, chunk_codes)
+
+    findings, rows, scanned = [], 0, []
+    for chunk_codes_, lengths, dates, cols in chunks:
+        findings += check_bar_chunk(chunk_codes_, lengths, dates, cols, calendar.dates)
+        rows += len(dates)
+        scanned += chunk_codes_.tolist()
+
+    save_quality_findings(findings, scanned if codes is not None else None)
+    counts = dict.fromkeys(QUALITY_CHECKS, 0)
+    for finding in findings:
+        counts[finding[1]] += 1
+    logger.info(
+        f"🩺 Checked {rows} bars of {len(scanned)} codes from {'bar store' if store is not None else 'SQLite'} "
+        f"in {time.time() - start:.1f}s: {counts}"
+    )
+    return counts
+
+def save_quality_findings(findings: list[tuple], codes: Optional[list[str]] = None):
+    """
+    Replace the findings of `codes` (all codes if None) with `findings` in one transaction.
+
+    Args:
+        findings: (code, kind, from_date, to_date, bar_count, detail) tuples
+        codes: the codes that were scanned
+    """
+    create_bar_quality_table()
+    found_at = datetime.datetime.now().isoformat(timespec='seconds')
+    with get_db_connection() as conn:
+        planned = {
+            (code, kind, from_date, to_date): planned_at
+            for code, kind, from_date, to_date, planned_at in conn.execute(
+                f"SELECT code, kind, from_date, to_date, repair_planned_at FROM {BAR_QUALITY_TABLE} WHERE repair_planned_at IS NOT NULL"
+            )
+        }
+        if codes is None:
+            conn.execute(f"DELETE FROM {BAR_QUALITY_TABLE}")
+        else:
+            conn.executemany(f"DELETE FROM {BAR_QUALITY_TABLE} WHERE code = ?", [(code,) for code in codes])
+        conn.executemany(
+            f"""
+            INSERT OR REPLACE INTO {BAR_QUALITY_TABLE} (code, kind, from_date, to_date, bar_count, detail, found_at, repair_planned_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(*finding, found_at, planned.get(finding[:4])) for finding in findings]
+        )
+        conn.commit()
+
+def query_quality_findings(codes: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Stored findings, optionally of some codes only, ordered by code, kind and date."""
+    create_bar_quality_table()
+    with get_db_connection() as conn:
+        df = pd.read_sql_query(f"SELECT * FROM {BAR_QUALITY_TABLE} ORDER BY code, kind, from_date", conn)
+    if codes is not None:
+        df = df[df['code'].isin(set(codes))].reset_index(drop=True)
+    return df
+
+def claim_bar_repairs(codes: Optional[Iterable[str]] = None, margin_days: int = 10) -> dict[str, pd.Timestamp]:
+    """
+    Hand the unplanned findings of REPAIRABLE_CHECKS to the refresh planner:
+    {code: date to re-fetch from}.
+
+    The date is `margin_days` before the code's earliest broken range, so the bar before a
+    discontinuity is rewritten as well. Claimed findings are stamped with
+    repair_planned_at and are not claimed again until a scan finds a different range.
+
+    Args:
+        codes: only claim findings of these codes
+        margin_days: calendar days re-fetched before each broken range
+    """
+    create_bar_quality_table()
+    wanted = set(codes) if codes is not None else None
+    kinds = ','.join('?' for _ in REPAIRABLE_CHECKS)
+    with get_db_connection() as conn:
+        rows = [
+            (code, from_date) for code, from_date in conn.execute(
+                f"""
+                SELECT code, MIN(from_date) FROM {BAR_QUALITY_TABLE}
+                WHERE repair_planned_at IS NULL AND kind IN ({kinds}) GROUP BY code
+                """,
+                REPAIRABLE_CHECKS
+            )
+            if wanted is None or code in wanted
+        ]
+        conn.executemany(
+            f"UPDATE {BAR_QUALITY_TABLE} SET repair_planned_at = ? WHERE code = ? AND repair_planned_at IS NULL AND kind IN ({kinds})",
+            [(datetime.datetime.now().isoformat(timespec='seconds'), code, *REPAIRABLE_CHECKS) for code, _ in rows]
+        )
+        conn.commit()
+    if not rows:
+        return {}
+    starts = int_dates_to_datetime([from_date for _, from_date in rows]) - np.timedelta64(margin_days, 'D')
+    return {code: pd.Timestamp(start) for (code, _), start in zip(rows, starts)}
+
+
+if __name__ == "__main__":
+    scan_bar_quality()
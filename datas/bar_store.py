@@ -0,0 +1,102 @@
+import json
+import threading
+import numpy as np
+import pandas as pd
+from typing import Optional
+from tools.log import get_fetch_logger
+from datas.create_database import BAR_STORE_DIR, BAR_STORE_META, BAR_STORE_FIELDS
+
+logger = get_fetch_logger()
+
+# same column order as `SELECT * FROM stock_bars_daily_qfq`
+BAR_COLUMNS = ['code', 'date', *BAR_STORE_FIELDS]
+
+class BarStore:
+    """
+    Read side of the columnar bar store built by `datas.create_database.build_bar_store`.
+
+    Every field is opened with np.load(mmap_mode='r'), so the frames returned are views
+    on the page cache and nothing is parsed or copied. Existing columns are read-only;
+    adding new columns (indicators etc.) works as usual.
+    """
+    def __init__(self, store_dir=BAR_STORE_DIR):
+        with open(store_dir / BAR_STORE_META, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.stamp = (store_dir / BAR_STORE_META).stat().st_mtime_ns
+        self.dates = np.load(store_dir / "date.npy", mmap_mode="r")
+        self.columns = {
+            col: np.load(store_dir / f"{col}.npy", mmap_mode="r")
+            for col in BAR_STORE_FIELDS
+        }
+        codes = np.load(store_dir / "codes.npy")
+        offsets = np.load(store_dir / "offsets.npy")
+        self.index = {
+            str(code): (int(offsets[i]), int(offsets[i + 1]))
+            for i, code in enumerate(codes)
+        }
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def _frame(self, code: str, lo: int, hi: int) -> pd.DataFrame:
+        data = {
+            'code': np.full(hi - lo, code, dtype=object),
+            'date': np.asarray(self.dates[lo:hi]),
+        }
+        for col, arr in self.columns.items():
+            data[col] = np.asarray(arr[lo:hi])
+        return pd.DataFrame(data, columns=BAR_COLUMNS, copy=False)
+
+    def _search(self, code: str, value: Optional[pd.Timestamp], side: str) -> int:
+        lo, hi = self.index[code]
+        if value is None:
+            return hi if side == 'right' else lo
+        return lo + int(np.searchsorted(self.dates[lo:hi], np.datetime64(value, 'ns'), side=side))
+
+    def daily_bars(
+        self,
+        code: str,
+        from_date: Optional[pd.Timestamp] = None,
+        to_date: Optional[pd.Timestamp] = None
+    ) -> pd.DataFrame:
+        """Bars of `code` with from_date <= date <= to_date, sorted by date."""
+        if code not in self.index:
+            return pd.DataFrame()
+        lo = self._search(code, from_date, 'left')
+        hi = self._search(code, to_date, 'right')
+        return self._frame(code, lo, hi)
+
+    def bars_by_days(self, code: str, days: int, to_date: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """The last `days` bars of `code` up to to_date (inclusive), sorted by date."""
+        if code not in self.index:
+            return pd.DataFrame()
+        start, _ = self.index[code]
+        hi = self._search(code, to_date, 'right')
+        return self._frame(code, max(start, hi - days), hi)
+
+_store: Optional[BarStore] = None
+_store_lock = threading.Lock()
+
+def get_bar_store() -> Optional[BarStore]:
+    """
+    Get the process-wide BarStore, or None when the store is missing or marked stale.
+    A rebuilt store is picked up automatically on the next call.
+    """
+    global _store
+    try:
+        stamp = (BAR_STORE_DIR / BAR_STORE_META).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    store = _store
+    if store is not None and store.stamp == stamp:
+        return store
+
+    with _store_lock:
+        if _store is None or _store.stamp != stamp:
+            try:
+                _store = BarStore(BAR_STORE_DIR)
+            except Exception as e:
+                logger.warning(f"Failed to open bar store, falling back to SQLite: {e}")
+                return None
+        return _store
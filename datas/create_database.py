@@ -5,8 +5,13 @@ from datetime import datetime
 from pathlib import Path
 import time
 import json
+import shutil
+import threading
+import numpy as np
 from tools.log import get_fetch_logger
+from tools.times import int_dates_to_datetime
 from contextlib import contextmanager
+from typing import Iterable, Optional
 
 DB_DIR = Path(__file__).parent.parent / "database"
 DB_DIR.mkdir(parents=True, exist_ok=True)
@@ -14,13 +19,44 @@ DB_PATH = DB_DIR / "ashare_data.db"
 
 STOCK_INFO_TABLE = "stock_base_info"
 DAILY_BAR_TABLE = "stock_bars_daily_qfq"
+BAR_COVERAGE_TABLE = "bar_coverage"
+FETCH_JOBS_TABLE = "fetch_jobs"
+TRADE_CALENDAR_TABLE = "trade_calendar"
+INDEX_CONSTITUENTS_TABLE = "index_constituents"
+BAR_QUALITY_TABLE = "bar_quality_findings"
+HUNT_SCAN_STATE_TABLE = "hunt_scan_state"
 
 EARLIEST_DATE = "20050101"
 
+# Columnar snapshot of DAILY_BAR_TABLE, one .npy array per field (see datas/bar_store.py)
+BAR_STORE_DIR = DB_DIR / "bar_store"
+BAR_STORE_META = "meta.json"
+BAR_STORE_FIELDS = {
+    'open': 'float64',
+    'close': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'volume': 'int64',
+    'amount': 'float64',
+    'amplitude': 'float64',
+    'change_pct': 'float64',
+    'price_change': 'float64',
+    'turnover_rate': 'float64',
+    'adj_factor': 'float64',
+}
+
+# Pragmas applied once to every pooled read connection
+READ_CONNECTION_PRAGMAS = (
+    "PRAGMA mmap_size=268435456;",  # 256MB memory-mapped I/O
+    "PRAGMA cache_size=-32768;",    # 32MB page cache
+    "PRAGMA query_only=1;",
+)
+
 logger = get_fetch_logger()
 
 @contextmanager
 def get_db_connection():
+    ensure_database_schema()
     conn = sqlite3.connect(DB_PATH)
     try:
         yield conn
@@ -30,6 +66,88 @@ def get_db_connection():
     finally:
         conn.close()
 
+_read_local = threading.local()
+_pool_lock = threading.Lock()
+_schema_lock = threading.RLock()
+_schema_ready: set[str] = set()
+_pool_stats = {'opened': 0, 'reused': 0}
+
+@contextmanager
+def _schema_check_suspended():
+    """Let the migrations open connections to a database ensure_database_schema() refuses."""
+    busy = getattr(_read_local, 'schema_busy', False)
+    _read_local.schema_busy = True
+    try:
+        yield
+    finally:
+        _read_local.schema_busy = busy
+
+def get_read_connection() -> sqlite3.Connection:
+    """
+    Get the calling thread's read-only connection, opening it on first use.
+
+    The connection is kept for the lifetime of the thread, has the read pragmas applied
+    once, and keeps sqlite3's statement cache warm across queries. Never close it
+    yourself, use close_read_connection() instead.
+    """
+    conn = getattr(_read_local, 'conn', None)
+    if conn is not None:
+        with _pool_lock:
+            _pool_stats['reused'] += 1
+        return conn
+
+    ensure_database_schema()
+    conn = sqlite3.connect(DB_PATH, cached_statements=256)
+    try:
+        # WAL is persistent, this is a no-op once prepare_database() has run
+        conn.execute("PRAGMA journal_mode=WAL;")
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Failed to enable WAL on read connection: {e}")
+    for pragma in READ_CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+    _read_local.conn = conn
+    with _pool_lock:
+        _pool_stats['opened'] += 1
+    return conn
+
+def close_read_connection():
+    """Close the calling thread's read connection, if any."""
+    conn = getattr(_read_local, 'conn', None)
+    if conn is not None:
+        _read_local.conn = None
+        conn.close()
+
+# read connections inherited across fork, kept referenced so they are never finalized
+_inherited_connections: list[sqlite3.Connection] = []
+
+def forget_read_connection():
+    """
+    Forget the calling thread's read connection without closing it, in a forked child.
+
+    The child inherited the parent's handle; closing it (or letting it be garbage
+    collected) in the child can release the parent's file locks, so it is parked instead
+    and the next get_read_connection() opens a connection of the child's own.
+    """
+    conn = getattr(_read_local, 'conn', None)
+    if conn is not None:
+        _read_local.conn = None
+        _inherited_connections.append(conn)
+
+def connection_pool_stats() -> dict:
+    """
+    Get read connection pool counters.
+
+    Returns:
+        dict with 'opened' (connections created), 'reused' (checkouts served by an existing
+        connection) and 'reuse_rate' (reused / total checkouts)
+    """
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    total = stats['opened'] + stats['reused']
+    stats['reuse_rate'] = round(stats['reused'] / total, 4) if total else 0.0
+    return stats
+
 def delete_table_if_exists(table_name: str):
     with get_db_connection() as conn:
         drop_table_query = f"DROP TABLE IF EXISTS {table_name};"
@@ -53,18 +171,25 @@ def create_stock_info_table():
             classi_name TEXT, -- 所有制性质名称
             list_date TEXT, -- 上市日期
             idn_code TEXT, -- 行业 code etc.BK0025
-            idn_name TEXT -- 行业名称 etc."汽车整车"
+            idn_name TEXT, -- 行业名称 etc."汽车整车"
+            updated_at TEXT -- 最近抓取时间 ISO 8601
         );
         """
         conn.execute(create_table_query)
         conn.commit()
 
-def create_daily_bar_table():
+def create_daily_bar_table(table_name: str = DAILY_BAR_TABLE, with_indexes: bool = True):
+    """
+    Create the daily bar table (schema v2).
+
+    Dates are stored as INTEGER yyyymmdd and the table is WITHOUT ROWID, so rows are
+    clustered on (code, date) and every per-code range query is a single b-tree range read.
+    """
     with get_db_connection() as conn:
         create_table_query = f"""
-        CREATE TABLE IF NOT EXISTS {DAILY_BAR_TABLE} (
+        CREATE TABLE IF NOT EXISTS {table_name} (
             code TEXT NOT NULL, -- 股票代码 (带交易所前缀)
-            date DATE NOT NULL, -- 交易日期
+            date INTEGER NOT NULL, -- 交易日期 yyyymmdd
             open REAL, -- 开盘价
             close REAL, -- 收盘价
             high REAL, -- 最高价
@@ -75,32 +200,578 @@ def create_daily_bar_table():
             change_pct REAL, -- 涨跌幅
             price_change REAL, -- 涨跌额
             turnover_rate REAL, -- 换手率
+            adj_factor REAL, -- 复权因子 (tushare), 价格为按该股最新一行因子前复权
             PRIMARY KEY (code, date)
+        ) WITHOUT ROWID;
+        """
+        conn.execute(create_table_query)
+
+        if with_indexes:
+            # Add index for faster date-range queries, (code, date) is the primary key itself
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_date ON {table_name} (date);")
+
+        conn.commit()
+
+_BAR_COVERAGE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {BAR_COVERAGE_TABLE} (
+    code TEXT PRIMARY KEY, -- 股票代码
+    first_date INTEGER NOT NULL, -- 最早交易日期 yyyymmdd
+    last_date INTEGER NOT NULL, -- 最新交易日期 yyyymmdd
+    row_count INTEGER NOT NULL, -- 日线条数
+    write_seq INTEGER NOT NULL DEFAULT 0 -- 最近一次写入该股日线的序号, 每次刷新递增
+) WITHOUT ROWID;
+"""
+
+# MAX(write_seq) is how readers in other processes notice bar writes, see query_stock
+_BAR_COVERAGE_WRITE_SEQ_INDEX = f"CREATE INDEX IF NOT EXISTS idx_{BAR_COVERAGE_TABLE}_write_seq ON {BAR_COVERAGE_TABLE} (write_seq);"
+
+def create_bar_coverage_table():
+    with get_db_connection() as conn:
+        conn.execute(_BAR_COVERAGE_DDL)
+        conn.execute(_BAR_COVERAGE_WRITE_SEQ_INDEX)
+        conn.commit()
+
+def refresh_bar_coverage(conn: sqlite3.Connection, codes: Optional[Iterable[str]] = None, chunk_codes: int = 500):
+    """
+    Recompute bar_coverage rows from DAILY_BAR_TABLE.
+
+    Every refreshed row gets a new write_seq, one more than the largest in the table, so
+    a code's write_seq changes whenever its bars are written, even when the rewrite keeps
+    its dates and row count (repairs, rebased qfq prices). Callers must refresh every
+    code they wrote.
+
+    Runs inside the caller's transaction and does not commit, so the upsert path can keep
+    bars and coverage consistent. If the table does not exist yet it is created and fully
+    built, a partial table would make every other code look empty to the planner.
+
+    Args:
+        conn: connection to write with
+        codes: codes whose coverage changed; None rebuilds the whole table
+        chunk_codes: number of codes bound per statement
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (BAR_COVERAGE_TABLE,)
+    ).fetchone()
+    if not exists:
+        conn.execute(_BAR_COVERAGE_DDL)
+        conn.execute(_BAR_COVERAGE_WRITE_SEQ_INDEX)
+        codes = None
+
+    write_seq = conn.execute(f"SELECT COALESCE(MAX(write_seq), 0) + 1 FROM {BAR_COVERAGE_TABLE}").fetchone()[0]
+    if codes is None:
+        conn.execute(f"DELETE FROM {BAR_COVERAGE_TABLE}")
+        conn.execute(
+            f"""
+            INSERT INTO {BAR_COVERAGE_TABLE} (code, first_date, last_date, row_count, write_seq)
+            SELECT code, MIN(date), MAX(date), COUNT(*), ? FROM {DAILY_BAR_TABLE} GROUP BY code
+            """,
+            (write_seq,)
+        )
+        return
+
+    codes = sorted(set(codes))
+    for i in range(0, len(codes), chunk_codes):
+        chunk = codes[i:i + chunk_codes]
+        placeholders = ','.join('?' for _ in chunk)
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO {BAR_COVERAGE_TABLE} (code, first_date, last_date, row_count, write_seq)
+            SELECT code, MIN(date), MAX(date), COUNT(*), ? FROM {DAILY_BAR_TABLE}
+            WHERE code IN ({placeholders})
+            GROUP BY code
+            """,
+            (write_seq, *chunk)
+        )
+
+FETCH_JOBS_DDL = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {FETCH_JOBS_TABLE} (
+        task TEXT NOT NULL, -- 任务名 etc. daily_bars / stock_info
+        code TEXT NOT NULL, -- 股票代码
+        status TEXT NOT NULL, -- pending / leased / done / failed
+        attempts INTEGER NOT NULL DEFAULT 0, -- 已失败次数
+        next_retry_at REAL NOT NULL DEFAULT 0, -- 最早可领取时间 (unix 秒)
+        lease_owner TEXT, -- 持有租约的进程
+        lease_expires_at REAL, -- 租约到期时间 (unix 秒)
+        payload TEXT, -- 任务参数 json
+        last_error TEXT, -- 最近一次错误
+        updated_at REAL NOT NULL, -- 最近更新时间 (unix 秒)
+        PRIMARY KEY (task, code)
+    ) WITHOUT ROWID;
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_{FETCH_JOBS_TABLE}_due ON {FETCH_JOBS_TABLE} (task, status, next_retry_at);",
+)
+
+def create_trade_calendar_table():
+    with get_db_connection() as conn:
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS {TRADE_CALENDAR_TABLE} (
+            date INTEGER PRIMARY KEY, -- 日期 yyyymmdd
+            is_open INTEGER NOT NULL -- 是否交易日 (上交所)
         );
         """
         conn.execute(create_table_query)
+        conn.commit()
+
+def create_index_constituents_table():
+    with get_db_connection() as conn:
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS {INDEX_CONSTITUENTS_TABLE} (
+            index_code TEXT NOT NULL, -- 指数代码 etc. 399300
+            code TEXT NOT NULL, -- 成分股代码
+            in_date INTEGER NOT NULL, -- 纳入日期 yyyymmdd
+            out_date INTEGER, -- 剔除日期 yyyymmdd, NULL 表示仍在指数中
+            PRIMARY KEY (index_code, code, in_date)
+        ) WITHOUT ROWID;
+        """
+        conn.execute(create_table_query)
+        conn.commit()
+
+def create_bar_quality_table():
+    with get_db_connection() as conn:
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS {BAR_QUALITY_TABLE} (
+            code TEXT NOT NULL, -- 股票代码
+            kind TEXT NOT NULL, -- 检查项 gap / ohlc / bad_price / volume_unit / price_jump
+            from_date INTEGER NOT NULL, -- 问题区间起始日期 yyyymmdd
+            to_date INTEGER NOT NULL, -- 问题区间结束日期 yyyymmdd
+            bar_count INTEGER NOT NULL, -- 问题K线数 (缺口为缺失交易日数)
+            detail TEXT, -- 说明
+            found_at TEXT NOT NULL, -- 发现时间
+            repair_planned_at TEXT, -- 已交给刷新计划重新抓取的时间, NULL 表示待修复
+            PRIMARY KEY (code, kind, from_date)
+        ) WITHOUT ROWID;
+        """
+        conn.execute(create_table_query)
+        conn.commit()
+
+def create_hunt_scan_state_table():
+    with get_db_connection() as conn:
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS {HUNT_SCAN_STATE_TABLE} (
+            scan_key TEXT NOT NULL, -- 选股器名 + 代码/参数哈希
+            code TEXT NOT NULL, -- 股票代码
+            input_window TEXT NOT NULL, -- 分析的K线范围 latest / 截止日期:天数
+            write_seq INTEGER NOT NULL, -- 扫描时 bar_coverage 的写入序号
+            result BLOB, -- 命中结果, pickle 的 name -> result_info, NULL 表示未命中
+            scanned_at TEXT NOT NULL, -- 扫描时间
+            PRIMARY KEY (scan_key, code, input_window)
+        ) WITHOUT ROWID;
+        """
+        conn.execute(create_table_query)
+        conn.commit()
+
+def create_fetch_jobs_table():
+    with get_db_connection() as conn:
+        for statement in FETCH_JOBS_DDL:
+            conn.execute(statement)
+        conn.commit()
+
+def backfill_bar_coverage(force: bool = False) -> bool:
+    """
+    Fill bar_coverage from the bar table when it is empty (or always with force=True).
 
-        # Add index for faster date-range queries
+    Returns:
+        True if the table was rebuilt
+    """
+    with get_db_connection() as conn:
+        if not force:
+            has_coverage = conn.execute(f"SELECT 1 FROM {BAR_COVERAGE_TABLE} LIMIT 1").fetchone()
+            has_bars = conn.execute(f"SELECT 1 FROM {DAILY_BAR_TABLE} LIMIT 1").fetchone()
+            if has_coverage or not has_bars:
+                return False
+        start = time.time()
+        refresh_bar_coverage(conn)
+        conn.commit()
+        count = conn.execute(f"SELECT COUNT(*) FROM {BAR_COVERAGE_TABLE}").fetchone()[0]
+    logger.info(f"🎉 Backfilled {BAR_COVERAGE_TABLE} for {count} codes in {time.time() - start:.2f}s")
+    return True
+
+def daily_bar_schema_version(conn: sqlite3.Connection) -> int:
+    """
+    Detect the daily bar table schema: 0 = missing, 1 = TEXT dates with rowid, 2 = INTEGER dates WITHOUT ROWID.
+    """
+    columns = {row[1]: row[2].upper() for row in conn.execute(f"PRAGMA table_info({DAILY_BAR_TABLE})")}
+    if not columns:
+        return 0
+    return 2 if columns.get('date') == 'INTEGER' else 1
+
+@_schema_check_suspended()
+def migrate_daily_bar_table_v2(chunk_codes: int = 200, vacuum: bool = True) -> bool:
+    """
+    Rewrite a schema v1 daily bar table into schema v2.
+
+    Rows are copied into a new table in chunks of `chunk_codes` codes (one commit per
+    chunk), the old table and its redundant indexes are dropped, and the new table takes
+    over the original name. The database is vacuumed afterwards to give the space back.
+
+    Returns:
+        True if a migration was performed, False if the table is already v2 or missing
+    """
+    with get_db_connection() as conn:
+        version = daily_bar_schema_version(conn)
+    if version != 1:
+        return False
+
+    start = time.time()
+    new_table = f"{DAILY_BAR_TABLE}_v2"
+    delete_table_if_exists(new_table)  # leftovers from an interrupted run
+    create_daily_bar_table(new_table, with_indexes=False)
+
+    # v1 tables predate adj_factor, it is left NULL
+    columns = [col for col in BAR_STORE_FIELDS if col != 'adj_factor']
+    with get_db_connection() as conn:
+        codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE} ORDER BY code")]
+        logger.info(f"Migrating {DAILY_BAR_TABLE} to schema v2: {len(codes)} codes...")
+
+        copied = 0
+        for i in range(0, len(codes), chunk_codes):
+            chunk = codes[i:i + chunk_codes]
+            placeholders = ','.join('?' for _ in chunk)
+            cursor = conn.execute(
+                f"""
+                INSERT INTO {new_table} (code, date, {', '.join(columns)})
+                SELECT code, CAST(REPLACE(substr(date, 1, 10), '-', '') AS INTEGER), {', '.join(columns)}
+                FROM {DAILY_BAR_TABLE}
+                WHERE code IN ({placeholders})
+                ORDER BY code, date
+                """,
+                chunk
+            )
+            conn.commit()
+            copied += cursor.rowcount
+            logger.info(f"  {min(i + chunk_codes, len(codes))}/{len(codes)} codes, {copied} rows")
+
+        old_count = conn.execute(f"SELECT COUNT(*) FROM {DAILY_BAR_TABLE}").fetchone()[0]
+        new_count = conn.execute(f"SELECT COUNT(*) FROM {new_table}").fetchone()[0]
+        if old_count != new_count:
+            raise RuntimeError(f"Migration row count mismatch: {old_count} -> {new_count}, old table kept")
+
+        conn.execute(f"DROP TABLE {DAILY_BAR_TABLE}")
+        conn.execute(f"ALTER TABLE {new_table} RENAME TO {DAILY_BAR_TABLE}")
         conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{DAILY_BAR_TABLE}_date ON {DAILY_BAR_TABLE} (date);")
-        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{DAILY_BAR_TABLE}_code ON {DAILY_BAR_TABLE} (code);")
+        conn.commit()
+
+        if vacuum:
+            logger.info("Vacuuming database...")
+            conn.execute("VACUUM")
+
+    logger.info(f"🎉 Migrated {new_count} rows to schema v2 in {time.time() - start:.2f}s")
+    return True
 
+def ensure_adj_factor_column() -> bool:
+    """
+    Add the adj_factor column to a v2 daily bar table created before it existed.
+
+    Returns:
+        True if the column was added
+    """
+    with get_db_connection() as conn:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({DAILY_BAR_TABLE})")}
+        if not columns or 'adj_factor' in columns:
+            return False
+        # look again under the write lock, another process may be adding it too
+        conn.execute("BEGIN IMMEDIATE")
+        if 'adj_factor' in {row[1] for row in conn.execute(f"PRAGMA table_info({DAILY_BAR_TABLE})")}:
+            conn.rollback()
+            return False
+        conn.execute(f"ALTER TABLE {DAILY_BAR_TABLE} ADD COLUMN adj_factor REAL")
+        conn.commit()
+    logger.info(f"Added adj_factor column to {DAILY_BAR_TABLE}.")
+    return True
+
+def _bar_coverage_write_seq_missing(conn: sqlite3.Connection) -> bool:
+    scan_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({HUNT_SCAN_STATE_TABLE})")}
+    if scan_columns and 'write_seq' not in scan_columns:
+        return True
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({BAR_COVERAGE_TABLE})")}
+    if not columns:
+        return False
+    index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (f"idx_{BAR_COVERAGE_TABLE}_write_seq",)
+    ).fetchone()
+    return 'write_seq' not in columns or index is None
+
+def ensure_bar_coverage_write_seq_column() -> bool:
+    """
+    Add the write_seq column (and its index) to a bar_coverage table created before it
+    existed, and drop the verdicts hunt_scan_state stored against the old (first, last,
+    count) coverage.
+
+    Returns:
+        True if the column was added
+    """
+    with get_db_connection() as conn:
+        if not _bar_coverage_write_seq_missing(conn):
+            return False
+        # look again under the write lock, another process may be adding it too
+        conn.execute("BEGIN IMMEDIATE")
+        scan_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({HUNT_SCAN_STATE_TABLE})")}
+        if scan_columns and 'write_seq' not in scan_columns:
+            conn.execute(f"DROP TABLE {HUNT_SCAN_STATE_TABLE}")
+            logger.info(f"Dropped {HUNT_SCAN_STATE_TABLE} of the old schema, the next hunts evaluate every code.")
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({BAR_COVERAGE_TABLE})")}
+        if not columns:
+            conn.commit()
+            return False
+        added = 'write_seq' not in columns
+        if added:
+            conn.execute(f"ALTER TABLE {BAR_COVERAGE_TABLE} ADD COLUMN write_seq INTEGER NOT NULL DEFAULT 0")
+        conn.execute(_BAR_COVERAGE_WRITE_SEQ_INDEX)
         conn.commit()
+    if not added:
+        return False
+    logger.info(f"Added write_seq column to {BAR_COVERAGE_TABLE}.")
+    return True
+
+# PRAGMA user_version: last data migration applied to the stored rows
+DATA_VERSION_TUSHARE_AMOUNT_YUAN = 1
 
+# a tushare bar whose amount is still in 千元
+_TUSHARE_AMOUNT_IN_THOUSANDS = "adj_factor IS NOT NULL AND volume > 0 AND amount < volume * ABS(close) * 0.05"
+
+def tushare_amount_migration_pending(conn: sqlite3.Connection) -> bool:
+    """
+    Check whether stored tushare bars still need migrate_tushare_amount_to_yuan().
+
+    A database without such bars gets its PRAGMA user_version recorded, so the table is
+    only scanned once.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= DATA_VERSION_TUSHARE_AMOUNT_YUAN:
+        return False
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({DAILY_BAR_TABLE})")}
+    if 'adj_factor' not in columns:
+        # no bars yet, or a v1 table migrate_daily_bar_table_v2() has not rewritten
+        return False
+    if conn.execute(f"SELECT 1 FROM {DAILY_BAR_TABLE} WHERE {_TUSHARE_AMOUNT_IN_THOUSANDS} LIMIT 1").fetchone():
+        return True
+    conn.execute(f"PRAGMA user_version = {DATA_VERSION_TUSHARE_AMOUNT_YUAN}")
+    conn.commit()
+    return False
+
+@_schema_check_suspended()
+def migrate_tushare_amount_to_yuan(chunk_codes: int = 500) -> bool:
+    """
+    Rescale the amount of stored tushare bars from 千元 to 元, once per database.
+
+    Tushare bars (the rows with an adj_factor) were stored in 千元 before
+    _format_tushare_bars() switched to 元. A row is only rescaled while its amount is far
+    below volume * close, so rows already written in 元 are left alone. The touched codes
+    get a new bar_coverage write_seq and the bar store is marked stale. PRAGMA
+    user_version records that the migration ran.
+
+    Returns:
+        True if the migration ran
+    """
+    with get_db_connection() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= DATA_VERSION_TUSHARE_AMOUNT_YUAN:
+            return False
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({DAILY_BAR_TABLE})")}
+        if 'adj_factor' not in columns:
+            # no bars yet, or a v1 table migrate_daily_bar_table_v2() has not rewritten
+            return False
+
+        start = time.time()
+        in_thousands = _TUSHARE_AMOUNT_IN_THOUSANDS
+        codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE} WHERE {in_thousands}")]
+        rescaled = 0
+        for i in range(0, len(codes), chunk_codes):
+            chunk = codes[i:i + chunk_codes]
+            placeholders = ','.join('?' for _ in chunk)
+            rescaled += conn.execute(
+                f"UPDATE {DAILY_BAR_TABLE} SET amount = amount * 1000 WHERE code IN ({placeholders}) AND {in_thousands}",
+                chunk
+            ).rowcount
+        if codes:
+            refresh_bar_coverage(conn, codes)
+        conn.execute(f"PRAGMA user_version = {DATA_VERSION_TUSHARE_AMOUNT_YUAN}")
+        conn.commit()
+
+    if rescaled:
+        invalidate_bar_store()
+    logger.info(f"Rescaled the amount of {rescaled} tushare bars of {len(codes)} codes to 元 in {time.time() - start:.2f}s")
+    return True
+
+def ensure_stock_info_updated_at_column() -> bool:
+    """
+    Add the updated_at column to a stock_base_info table created before it existed.
+    Existing rows keep NULL, which the incremental refresh treats as stale.
+
+    Returns:
+        True if the column was added
+    """
+    with get_db_connection() as conn:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({STOCK_INFO_TABLE})")}
+        if not columns or 'updated_at' in columns:
+            return False
+        conn.execute(f"ALTER TABLE {STOCK_INFO_TABLE} ADD COLUMN updated_at TEXT")
+        conn.commit()
+    logger.info(f"Added updated_at column to {STOCK_INFO_TABLE}.")
+    return True
+
+def ensure_database_schema():
+    """
+    Check an existing database against the schema the code expects, once per process and
+    DB_PATH, before the first connection is handed out.
+
+    The cheap column additions (adj_factor, bar_coverage write_seq) are applied here, each
+    under BEGIN IMMEDIATE so concurrent processes do not race them. The rewrites of every
+    bar, migrate_daily_bar_table_v2() and migrate_tushare_amount_to_yuan(), only run from
+    prepare_database(): a database that still needs one raises RuntimeError, nothing runs
+    against rows of the wrong schema.
+
+    Called by get_db_connection() and get_read_connection().
+    """
+    key = str(DB_PATH)
+    if key in _schema_ready:
+        return
+    with _schema_lock:
+        # the checks open connections themselves, they must not re-enter it
+        if key in _schema_ready or getattr(_read_local, 'schema_busy', False):
+            return
+        with _schema_check_suspended():
+            if DB_PATH.exists():
+                with get_db_connection() as conn:
+                    if daily_bar_schema_version(conn) == 1:
+                        raise RuntimeError(
+                            f"{DAILY_BAR_TABLE} is still schema v1, run prepare_database() "
+                            f"(python -m datas.create_database) to migrate it first."
+                        )
+                ensure_adj_factor_column()
+                ensure_bar_coverage_write_seq_column()
+                with get_db_connection() as conn:
+                    if tushare_amount_migration_pending(conn):
+                        raise RuntimeError(
+                            f"Tushare bars in {DAILY_BAR_TABLE} still store amount in 千元, run prepare_database() "
+                            f"(python -m datas.create_database) to rescale them first."
+                        )
+            _schema_ready.add(key)
+
+@_schema_check_suspended()
 def prepare_database(recreate: bool = False):
     if recreate:
         delete_table_if_exists(f"{STOCK_INFO_TABLE}")
         delete_table_if_exists(f"{DAILY_BAR_TABLE}")
+        delete_table_if_exists(f"{BAR_COVERAGE_TABLE}")
     create_stock_info_table()
+    ensure_stock_info_updated_at_column()
     create_daily_bar_table()
+    migrate_daily_bar_table_v2()
+    ensure_adj_factor_column()
+    create_bar_coverage_table()
+    ensure_bar_coverage_write_seq_column()
+    backfill_bar_coverage()
+    migrate_tushare_amount_to_yuan()
+    create_fetch_jobs_table()
+    create_trade_calendar_table()
+    create_index_constituents_table()
+    create_bar_quality_table()
+    create_hunt_scan_state_table()
     with get_db_connection() as conn:
         conn.execute('PRAGMA journal_mode=WAL;')
         conn.execute('PRAGMA synchronous=NORMAL;')
         conn.commit()
+    _schema_ready.add(str(DB_PATH))
+
+def invalidate_bar_store():
+    """
+    Mark the columnar bar store as stale so readers fall back to SQLite until it is rebuilt.
+    """
+    meta_path = BAR_STORE_DIR / BAR_STORE_META
+    try:
+        meta_path.unlink()
+        logger.info("Bar store marked stale, rebuild it with build_bar_store().")
+    except FileNotFoundError:
+        pass
+
+def build_bar_store(chunk_rows: int = 1_000_000) -> int:
+    """
+    Build the columnar bar store from DAILY_BAR_TABLE.
+
+    Rows are grouped by code and sorted by date, every field is written to its own
+    contiguous .npy array, and codes.npy / offsets.npy map each code to its row range.
+    The new store is written to a temp directory and swapped in when complete.
+
+    Args:
+        chunk_rows: number of rows fetched from SQLite per round trip
+
+    Returns:
+        int: number of rows written
+    """
+    start = time.time()
+    tmp_dir = BAR_STORE_DIR.with_name(BAR_STORE_DIR.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    fields = list(BAR_STORE_FIELDS)
+    codes: list[str] = []
+    offsets: list[int] = []
 
-if __name__ == "__main__":
     with get_db_connection() as conn:
-        conn.execute('PRAGMA journal_mode=WAL;')
-        conn.execute('PRAGMA synchronous=NORMAL;')
-        conn.commit()
+        # one read transaction so COUNT(*) and the scan see the same snapshot
+        conn.execute("BEGIN")
+        total = conn.execute(f"SELECT COUNT(*) FROM {DAILY_BAR_TABLE}").fetchone()[0]
+
+        dates = np.lib.format.open_memmap(tmp_dir / "date.npy", mode="w+", dtype="datetime64[ns]", shape=(total,))
+        columns = {
+            col: np.lib.format.open_memmap(tmp_dir / f"{col}.npy", mode="w+", dtype=dtype, shape=(total,))
+            for col, dtype in BAR_STORE_FIELDS.items()
+        }
+
+        cursor = conn.execute(
+            f"SELECT code, date, {', '.join(fields)} FROM {DAILY_BAR_TABLE} ORDER BY code, date"
+        )
+        pos = 0
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            chunk = pd.DataFrame.from_records(rows, columns=['code', 'date', *fields])
+            n = len(chunk)
+
+            chunk_codes = chunk['code'].to_numpy()
+            starts = np.concatenate(([0], np.flatnonzero(chunk_codes[1:] != chunk_codes[:-1]) + 1))
+            for s in starts:
+                if not codes or codes[-1] != chunk_codes[s]:
+                    codes.append(chunk_codes[s])
+                    offsets.append(pos + int(s))
+
+            dates[pos:pos + n] = int_dates_to_datetime(chunk['date'].to_numpy())
+            for col, dtype in BAR_STORE_FIELDS.items():
+                values = pd.to_numeric(chunk[col], errors='coerce')
+                if dtype.startswith('int'):
+                    values = values.fillna(0)
+                columns[col][pos:pos + n] = values.to_numpy(dtype=dtype)
+            pos += n
+        conn.rollback()
+
+    offsets.append(pos)
+    for arr in (dates, *columns.values()):
+        arr.flush()
+    del dates, columns
+
+    np.save(tmp_dir / "codes.npy", np.array(codes, dtype="U6"))
+    np.save(tmp_dir / "offsets.npy", np.array(offsets, dtype="int64"))
+    meta = {
+        'rows': pos,
+        'codes': len(codes),
+        'fields': BAR_STORE_FIELDS,
+        'built_at': datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(tmp_dir / BAR_STORE_META, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    old_dir = BAR_STORE_DIR.with_name(BAR_STORE_DIR.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if BAR_STORE_DIR.exists():
+        BAR_STORE_DIR.rename(old_dir)
+    tmp_dir.rename(BAR_STORE_DIR)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    logger.info(f"🎉 Built bar store: {pos} rows, {len(codes)} codes in {time.time() - start:.2f}s")
+    return pos
+
+if __name__ == "__main__":
+    prepare_database()
     # delete_table_if_exists(f"{DAILY_BAR_TABLE}")
     # create_daily_bar_table()
\ No newline at end of file
@@ -1,104 +1,434 @@
-from tqdm import tqdm
 import pandas as pd
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datas.fetch_stock_bars import logger, fetch_daily_bar_from_akshare, fetch_daily_bar_from_tushare, save_daily_bars_to_database
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datas.fetch_stock_bars import logger, fetch_daily_bar_from_akshare, fetch_daily_bar_from_tushare, fetch_daily_cross_section_from_tushare, save_daily_bars_batch, tushare_query, QFQ_PRICE_COLUMNS
 from queue import Queue
 import threading
 from datas.stock_index_list import hs300_code_list, csi500_code_list
 from datetime import datetime, timedelta
-from datas.query_stock import get_latest_date_by_code, query_all_stock_code_list
-from datas.create_database import DB_PATH, DAILY_BAR_TABLE, EARLIEST_DATE, get_db_connection
+from typing import Callable, Optional
+from datas.query_stock import get_latest_dates, get_latest_adj_factors, query_all_stock_code_list
+from datas.create_database import DB_PATH, DAILY_BAR_TABLE, EARLIEST_DATE, get_db_connection, ensure_database_schema
 import tushare as ts
+import sqlite3
+from dataclasses import dataclass, field
+from queue import Empty, Full
 from tools.stock_tools import latest_trade_day
+from datas.trade_calendar import ensure_trade_calendar, trading_days_between
+from tools.tushare_rate_limiter import tushare_token_pool
+from tools.fetch_scheduler import FetchScheduler, FetchJob, EndpointBudget
+from tools.response_cache import response_cache_stats
+from datas.fetch_jobs import FetchJobQueue, run_fetch_queue
+from datas.bar_quality import claim_bar_repairs
+import numpy as np
 
-def fetch_stock_bars_parallel(stock_codes: pd.Series, source: str = "akshare"):
-    result_queue = Queue(maxsize=20)
+# fetch concurrency ceiling, the scheduler adapts below it (AIMD)
+FETCH_MAX_CONCURRENCY = 16
+# calls per minute per data source; tushare is additionally bounded per token by tushare_token_rate_limiter
+FETCH_BUDGETS = {
+    "akshare": EndpointBudget(max_calls=300, period=60),
+    "tushare": EndpointBudget(max_calls=900, period=60),
+}
+
+# fetch_jobs task of the per-code daily bar refresh
+BAR_FETCH_TASK = "daily_bars"
+
+# writer group commit: flush when this many rows are buffered or the oldest buffered frame is this old
+WRITER_QUEUE_SIZE = 500
+WRITER_FLUSH_ROWS = 50_000
+WRITER_FLUSH_MS = 1000
+
+@dataclass
+class WriterMetrics:
+    """Counters published by database_writer, safe to read from other threads."""
+    flushes: int = 0
+    frames: int = 0
+    rows: int = 0
+    failed_frames: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    last_flush_rows: int = 0
+    last_flush_ms: float = 0.0
+    total_flush_ms: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'flushes': self.flushes,
+                'frames': self.frames,
+                'rows': self.rows,
+                'failed_frames': self.failed_frames,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'last_flush_rows': self.last_flush_rows,
+                'last_flush_ms': round(self.last_flush_ms, 1),
+                'avg_flush_rows': round(self.rows / self.flushes) if self.flushes else 0,
+                'avg_flush_ms': round(self.total_flush_ms / self.flushes, 1) if self.flushes else 0.0,
+            }
+
+def plan_bar_refresh(stock_codes: pd.Series, overlap_days: int = 30, repairs: bool = True) -> dict[str, pd.Timestamp]:
+    """
+    Decide which codes need fetching and from which date, using one bar_coverage query.
+
+    Args:
+        stock_codes: codes to consider
+        overlap_days: days re-fetched before the latest stored date, so qfq prices get rewritten
+        repairs: also re-fetch the broken ranges found by scan_bar_quality()
+
+    Returns:
+        dict: {code: from_date} for codes that are behind latest_trade_day() or have broken ranges
+    """
+    ensure_trade_calendar()
+    latest_dates = get_latest_dates(list(stock_codes))
+    to_date = latest_trade_day()
+    earliest = pd.to_datetime(EARLIEST_DATE)
+
+    plan = {}
+    for code in stock_codes:
+        latest_date = latest_dates.get(code)
+        if latest_date is None:
+            plan[code] = earliest
+        elif latest_date.date() < to_date:
+            plan[code] = latest_date - pd.Timedelta(days=overlap_days)
+    if repairs:
+        repair_plan = claim_bar_repairs(stock_codes)
+        for code, from_date in repair_plan.items():
+            plan[code] = min(plan.get(code, from_date), from_date)
+        if repair_plan:
+            logger.info(f"🩹 {len(repair_plan)} codes re-fetch ranges flagged by the bar quality scan.")
+    logger.info(f"📋 {len(plan)}/{len(stock_codes)} codes need daily bars up to {to_date}.")
+    return plan
+
+def fetch_stock_bars_parallel(stock_codes: pd.Series, source: str = "akshare", plan: Optional[dict[str, pd.Timestamp]] = None):
+    """
+    Fetch daily bars per code through the persistent job queue and write them through database_writer.
+
+    The plan is enqueued as BAR_FETCH_TASK jobs, so codes left pending by an interrupted
+    run or by another process are fetched too, and failed codes are retried with backoff.
+    A job is completed only once the writer has persisted its bars.
+
+    Args:
+        stock_codes: codes to refresh
+        source: "akshare" or "tushare"
+        plan: {code: from_date} to fetch; planned with plan_bar_refresh() if None
+    """
+    planned_at = time.time()
+    if plan is None:
+        plan = plan_bar_refresh(stock_codes)
+
+    jobs = FetchJobQueue(BAR_FETCH_TASK)
+    jobs.enqueue({code: {'from_date': from_date.strftime("%Y%m%d")} for code, from_date in plan.items()}, planned_at=planned_at)
+    if jobs.next_due_in() is None:
+        return
+
+    result_queue = Queue(maxsize=WRITER_QUEUE_SIZE)
     stop_event = threading.Event()
+    metrics = WriterMetrics()
+
+    def write_failed(codes: list[str], error: Exception):
+        for code in codes:
+            jobs.fail(code, error)
 
-    writer_thread = threading.Thread(target=database_writer, args=(result_queue, stop_event))
+    writer_thread = threading.Thread(target=database_writer, args=(result_queue, stop_event, metrics), kwargs={'on_persisted': jobs.complete, 'on_failed': write_failed})
     writer_thread.start()
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = {
-            executor.submit(worker_fetch_stock_and_queue, code, result_queue, source): code
-            for code in stock_codes
-        }
-        success_count = 0
-        all_count = len(futures)
-        for future in tqdm(as_completed(futures.keys()), total=len(futures)):
-            code = futures[future]
-            try:
-                if future.result():
-                    success_count += 1
-            except Exception as e:
-                logger.error(f"Failed to fetch {code}: {e}")       
-        logger.info(f"🎉 Fetched {success_count}/{all_count} stocks' daily bars.")
-        
-    result_queue.join()
-    stop_event.set()
-    writer_thread.join()
-
-def worker_fetch_stock_and_queue(code: str, result_queue: Queue, source: str = "akshare") -> bool:
-    latest_date = get_latest_date_by_code(code)
-    previous_day = pd.to_datetime(EARLIEST_DATE)
-
-    if latest_date is not None:
-        to_date = latest_trade_day()
-
-        if latest_date.date() >= to_date:
-            # logger.info(f"No update needed for {code}, latest date {latest_date.date()} is up-to-date.")
-            return True
-        previous_day = latest_date - pd.Timedelta(days=30)
-        
+    def make_job(job) -> FetchJob:
+        if not writer_thread.is_alive():
+            # nothing would persist the frames, stop the run instead of fetching for nothing
+            raise RuntimeError("Database writer stopped")
+        return FetchJob(job.code, source, worker_fetch_stock_and_queue, (job.code, result_queue, source, pd.Timestamp(job.payload['from_date']), writer_thread))
+
+    def writer_status() -> dict:
+        stats = metrics.snapshot()
+        return {'queue': stats['queue_depth'], 'flush_rows': stats['last_flush_rows'], 'flush_ms': stats['last_flush_ms']}
+
+    scheduler = FetchScheduler(
+        max_concurrency=FETCH_MAX_CONCURRENCY,
+        budgets=FETCH_BUDGETS,
+        max_attempts=1,
+        status=writer_status,
+        desc=f"{source} daily bars",
+    )
     try:
-        df = None
-        if source == "akshare":
-            df = fetch_daily_bar_from_akshare(code=code, from_date=previous_day.strftime("%Y%m%d"))
-        elif source == "tushare":
-            df = fetch_daily_bar_from_tushare(code=code, from_date=previous_day.strftime("%Y%m%d"))
-        if df is not None and not df.empty:
-            result_queue.put(df)
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"Error fetching data for {code}: {e}")
-        return False
-
-def database_writer(result_queue: Queue, stop_event: threading.Event):
-    while not stop_event.is_set():
+        run_fetch_queue(
+            jobs,
+            scheduler,
+            make_job,
+            # frames handed to the writer are completed by it once persisted
+            defer_complete=lambda code, queued: queued,
+        )
+    finally:
+        # result_queue.join() would wait forever on a writer that died
+        while result_queue.unfinished_tasks and writer_thread.is_alive():
+            writer_thread.join(timeout=0.5)
+        stop_event.set()
+        writer_thread.join()
+        orphaned = _drain_queue(result_queue)
+        if orphaned:
+            logger.error(f"💥 Database writer stopped, {len(orphaned)} fetched frames were not persisted.")
+            write_failed([str(df['code'].iloc[0]) for df in orphaned], RuntimeError("Database writer stopped"))
+
+    counts = jobs.counts()
+    logger.info(f"🎉 Daily bar jobs: {counts}")
+    if counts['failed']:
+        logger.error(f"💔 {counts['failed']} codes ran out of attempts: {list(jobs.failed_jobs())[:50]}")
+    if source == "tushare":
+        logger.info(f"🔑 Tushare tokens: {tushare_token_pool().stats()}")
+    logger.info(f"🗄️ Response cache: {response_cache_stats()}")
+    logger.info(f"💾 Writer: {metrics.snapshot()}")
+
+def _drain_queue(result_queue: Queue) -> list[pd.DataFrame]:
+    """Take every frame left in result_queue, marking each task done."""
+    frames = []
+    while True:
         try:
-            df = result_queue.get(timeout=0.5)
+            frames.append(result_queue.get_nowait())
+        except Empty:
+            return frames
+        result_queue.task_done()
+
+def worker_fetch_stock_and_queue(code: str, result_queue: Queue, source: str, previous_day: pd.Timestamp, writer: Optional[threading.Thread] = None) -> bool:
+    """
+    Fetch one code and queue the frame for database_writer. Source errors propagate so
+    the FetchScheduler can retry and back off on bans. If the `writer` thread dies while
+    the queue is full, the frame is given up with a RuntimeError instead of blocking.
+    """
+    df = None
+    if source == "akshare":
+        df = fetch_daily_bar_from_akshare(code=code, from_date=previous_day.strftime("%Y%m%d"), raise_errors=True)
+    elif source == "tushare":
+        df = fetch_daily_bar_from_tushare(code=code, from_date=previous_day.strftime("%Y%m%d"), raise_errors=True)
+    if df is not None and not df.empty:
+        while True:
             try:
-                save_daily_bars_to_database(df)
-            except Exception as e:
-                logger.error(f"Failed to save data to database: {e}")
-            finally:
-                result_queue.task_done()
-        except Exception:
-            continue
+                result_queue.put(df, timeout=1.0)
+                return True
+            except Full:
+                if writer is not None and not writer.is_alive():
+                    raise RuntimeError(f"Database writer stopped, bars of {code} not queued")
+    return False
 
-    while True:
+def database_writer(
+    result_queue: Queue,
+    stop_event: threading.Event,
+    metrics: Optional[WriterMetrics] = None,
+    flush_rows: int = WRITER_FLUSH_ROWS,
+    flush_ms: int = WRITER_FLUSH_MS,
+    on_persisted: Optional[Callable[[list[str]], None]] = None,
+    on_failed: Optional[Callable[[list[str], Exception], None]] = None
+):
+    """
+    Drain fetched frames from result_queue and write them with group commit.
+
+    Frames are buffered until `flush_rows` rows are pending or the oldest pending frame
+    has waited `flush_ms` milliseconds, then written in one transaction on a connection
+    kept open for the writer's lifetime. task_done() is called only after a frame is
+    persisted, so result_queue.join() still means "everything is on disk".
+
+    When a batch fails, its frames are written again one by one, so only the frames that
+    fail on their own are lost. After each flush, on_persisted(codes) is called with the
+    codes of the persisted frames and on_failed([code], error) for each failed one.
+    """
+    metrics = metrics or WriterMetrics()
+    conn = None
+
+    buffer: list[pd.DataFrame] = []
+    buffered_rows = 0
+    oldest = 0.0
+
+    def flush():
+        nonlocal buffer, buffered_rows
+        if not buffer:
+            return
+        start = time.perf_counter()
+        codes = [str(df['code'].iloc[0]) for df in buffer]
+        persisted, errors = codes, []
+        try:
+            written = save_daily_bars_batch(buffer, conn=conn)
+        except Exception as e:
+            # the batch was rolled back, retry frame by frame so one bad frame fails alone
+            logger.warning(f"Failed to save {len(buffer)} frames in one batch, retrying one by one: {e}")
+            written, persisted = 0, []
+            for code, df in zip(codes, buffer):
+                try:
+                    written += save_daily_bars_batch([df], conn=conn)
+                    persisted.append(code)
+                except Exception as frame_error:
+                    logger.error(f"Failed to save {len(df)} bars of {code} to database: {frame_error}")
+                    errors.append((code, frame_error))
         try:
-            df = result_queue.get_nowait()
+            if persisted and on_persisted is not None:
+                on_persisted(persisted)
+            if on_failed is not None:
+                for code, error in errors:
+                    on_failed([code], error)
+        except Exception as e:
+            logger.error(f"Writer callback failed for {len(codes)} codes: {e}")
+        failed = len(errors)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with metrics.lock:
+            metrics.flushes += 1
+            metrics.frames += len(buffer) - failed
+            metrics.failed_frames += failed
+            metrics.rows += written
+            metrics.last_flush_rows = written
+            metrics.last_flush_ms = elapsed_ms
+            metrics.total_flush_ms += elapsed_ms
+        for _ in buffer:
+            result_queue.task_done()
+        buffer, buffered_rows = [], 0
+
+    try:
+        ensure_database_schema()
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('PRAGMA synchronous=NORMAL;')
+        while not stop_event.is_set() or not result_queue.empty():
+            timeout = 0.5
+            if buffer:
+                timeout = max(0.0, oldest + flush_ms / 1000 - time.monotonic())
             try:
-                save_daily_bars_to_database(df)
-            except Exception as e:
-                logger.error(f"Failed to save leftover data: {e}")
-            finally:
-                result_queue.task_done()
-        except Exception:
+                df = result_queue.get(timeout=timeout)
+                if not buffer:
+                    oldest = time.monotonic()
+                buffer.append(df)
+                buffered_rows += len(df)
+                # take whatever else is already waiting without blocking
+                while buffered_rows < flush_rows:
+                    df = result_queue.get_nowait()
+                    buffer.append(df)
+                    buffered_rows += len(df)
+            except Empty:
+                pass
+
+            depth = result_queue.qsize()
+            with metrics.lock:
+                metrics.queue_depth = depth
+                metrics.max_queue_depth = max(metrics.max_queue_depth, depth + len(buffer))
+
+            if buffer and (buffered_rows >= flush_rows or time.monotonic() - oldest >= flush_ms / 1000):
+                flush()
+        flush()
+    except BaseException as e:
+        # frames still queued are failed by the caller, see fetch_stock_bars_parallel()
+        logger.error(f"💥 Database writer died: {e}")
+        if buffer and on_failed is not None:
+            on_failed([str(df['code'].iloc[0]) for df in buffer], e)
+        for _ in buffer:
+            result_queue.task_done()
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _adj_factors_from_tushare(trade_date: str) -> pd.Series:
+    """Adj factor of every stock on one trading day, indexed by std code."""
+    adj = tushare_query("adj_factor", trade_date=trade_date)
+    if adj is None or adj.empty:
+        return pd.Series(dtype='float64')
+    adj = adj[adj['ts_code'].str.match(r'^\d{6}\.')]
+    return pd.Series(adj['adj_factor'].to_numpy(dtype='float64'), index=adj['ts_code'].str[:6])
+
+def refresh_market_by_trade_date(overlap_days: int = 30) -> Optional[dict[str, pd.Timestamp]]:
+    """
+    Append the missing trading days for the whole market with by-trade-date endpoints.
+
+    Each missing day costs two tushare calls (pro.daily + pro.adj_factor by trade_date)
+    for all codes, and all days are upserted in one transaction. The new days are
+    forward-adjusted to each code's last factor in the window; when that factor differs
+    from the stored one, save_daily_bars_batch rebases the stored history in place.
+
+    Only days after the market's latest stored date are fetched. Codes stored up to an
+    earlier date (a failed or interrupted per-code fetch, a suspension) would get the new
+    days on top of a hole, they are left to a per-code fetch instead.
+
+    Args:
+        overlap_days: days re-fetched before the latest stored date of lagging codes
+
+    Returns:
+        {code: from_date} still to fetch per code: the full history of codes without
+        stored history or with an ex-rights event on history stored without adj factors,
+        the missing range of lagging codes; None if there is no stored data
+    """
+    latest_dates = get_latest_dates()
+    if not latest_dates:
+        logger.warning("No stored daily bars, run a per-code full fetch first.")
+        return None
+
+    market_last = max(latest_dates.values())
+    ensure_trade_calendar()
+    to_date = latest_trade_day()
+    if market_last.date() >= to_date:
+        logger.info(f"Daily bars are up to date ({market_last.date()}).")
+        return {}
+
+    trade_dates = [str(d) for d in trading_days_between(market_last + pd.Timedelta(days=1), to_date)]
+    logger.info(f"📅 {len(trade_dates)} trading days to append after {market_last.date()}: {trade_dates}")
+    if not trade_dates:
+        return {}
+
+    frames = []
+    for trade_date in trade_dates:
+        df = fetch_daily_cross_section_from_tushare(trade_date)
+        if df is None:
+            # later days cannot be published before this one
             break
+        frames.append(df)
+    if not frames:
+        return {}
+
+    bars = pd.concat(frames, ignore_index=True).sort_values(['code', 'date'], ignore_index=True)
+    # qfq within the window: scale every code to its last factor
+    last_factor = bars.groupby('code')['adj_factor'].transform('last')
+    scale = (bars['adj_factor'] / last_factor).fillna(1.0)
+    for col in QFQ_PRICE_COLUMNS:
+        bars[col] = (bars[col] * scale).round(2)
+
+    backfill = {code for code in bars['code'].unique() if code not in latest_dates}
+
+    # history stored before adj_factor existed cannot be rebased, refetch it on ex-rights
+    stored_factors = get_latest_adj_factors()
+    legacy = [code for code in bars['code'].unique() if code in latest_dates and stored_factors.get(code) is None]
+    if legacy:
+        previous = _adj_factors_from_tushare(market_last.strftime("%Y%m%d")).reindex(legacy)
+        current = bars.groupby('code')['adj_factor'].last().reindex(legacy)
+        changed = previous.notna() & current.notna() & ~np.isclose(current, previous)
+        backfill.update(current.index[changed])
+
+    earliest = pd.to_datetime(EARLIEST_DATE)
+    plan = {code: earliest for code in backfill}
+    for code in bars['code'].unique():
+        if code not in plan and latest_dates[code] < market_last:
+            plan[code] = latest_dates[code] - pd.Timedelta(days=overlap_days)
+
+    bars = bars[~bars['code'].isin(plan)]
+    rows = save_daily_bars_batch([bars])
+    logger.info(
+        f"🎉 Upserted {rows} bars for {len(frames)} trading days, {len(backfill)} codes need backfill, "
+        f"{len(plan) - len(backfill)} lagging codes are fetched per code."
+    )
+    return plan
+
+def refresh_daily_bars_incremental():
+    """
+    Evening refresh: append missing days cross-sectionally, then fetch per code the full
+    history of new codes and of legacy codes that went ex-rights, and the missing range
+    of codes that lag behind the market.
+    """
+    plan = refresh_market_by_trade_date()
+    if plan is None:
+        fetch_stock_bars_parallel(query_all_stock_code_list(), source="tushare")
+        return
+    if plan:
+        codes = sorted(plan)
+        logger.info(f"🔁 Fetching {len(codes)} codes per code: {codes[:20]}{'...' if len(codes) > 20 else ''}")
+        fetch_stock_bars_parallel(pd.Series(codes), source="tushare", plan=plan)
 
 import time  # ✅ 新增导入
 
 if __name__ == "__main__":
     start_time = time.time()  # ⏱️ 开始计时
     
-    fetch_stock_bars_parallel(query_all_stock_code_list(), source="tushare")
-    
-    # retry failed ones
+    # failed codes are retried with backoff by the job queue
     fetch_stock_bars_parallel(query_all_stock_code_list(), source="tushare")
     
     end_time = time.time()  # ⏱️ 结束计时
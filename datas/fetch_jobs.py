@@ -0,0 +1,342 @@
+import os
+import json
+import asyncio
+import time
+import uuid
+import random
+import socket
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional, Union
+from tools.log import get_fetch_logger
+from tools.fetch_scheduler import FetchScheduler, FetchJob
+from datas.create_database import DB_PATH, FETCH_JOBS_TABLE, FETCH_JOBS_DDL, get_read_connection
+
+logger = get_fetch_logger()
+
+JOB_STATUSES = ("pending", "leased", "done", "failed")
+
+@dataclass
+class LeasedJob:
+    code: str
+    payload: dict = field(default_factory=dict)
+    attempts: int = 0
+
+class FetchJobQueue:
+    """
+    Persistent per-code work queue of one fetch task, stored in the fetch_jobs table.
+
+    Fetchers enqueue the codes they need and lease batches of due jobs. A lease is held
+    by one process until it is settled (complete / fail / release) or expires, so several
+    processes can drain the same task against one database without double work, and jobs
+    of a crashed or interrupted run are picked up again by the next one. A failed job
+    goes back to pending with an exponential backoff and is marked failed after
+    `max_attempts` failures.
+
+    Usage:
+        queue = FetchJobQueue("daily_bars")
+        queue.enqueue({"SH600000": {"from_date": "20240101"}})
+        for job in queue.lease(50):
+            ...
+            queue.complete([job.code])  # or queue.fail(job.code, error)
+    """
+    def __init__(
+        self,
+        task: str,
+        lease_secs: float = 900.0,
+        max_attempts: int = 5,
+        base_backoff: float = 15.0,
+        max_backoff: float = 1800.0,
+    ):
+        self.task = task
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        with self._transaction() as conn:
+            for statement in FETCH_JOBS_DDL:
+                conn.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        """Short write transaction, BEGIN IMMEDIATE so concurrent leasers serialize."""
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def enqueue(self, items: Union[dict[str, Optional[dict]], Iterable[str]], planned_at: Optional[float] = None) -> int:
+        """
+        Add jobs, or revive finished ones.
+
+        New codes become pending. Done and failed jobs are reset to pending with their
+        attempts cleared, except done jobs completed after `planned_at`: they finished
+        after the caller computed what to fetch. Pending and leased jobs keep their state
+        and backoff, only their payload is updated (when one is given).
+
+        Args:
+            items: {code: payload} or codes without payload
+            planned_at: unix time the caller's plan was computed
+
+        Returns:
+            int: number of jobs that are now pending because of this call
+        """
+        if not isinstance(items, dict):
+            items = {code: None for code in items}
+        now = time.time()
+        cutoff = planned_at if planned_at is not None else float("inf")
+        payloads = [(json.dumps(payload or {}, ensure_ascii=False, default=str), code) for code, payload in items.items()]
+        with self._transaction() as conn:
+            conn.executemany(
+                f"UPDATE {FETCH_JOBS_TABLE} SET payload = ? WHERE task = ? AND code = ?",
+                [(payload, self.task, code) for payload, code in payloads if items[code] is not None]
+            )
+            revived = conn.executemany(
+                f"""
+                UPDATE {FETCH_JOBS_TABLE}
+                SET status = 'pending', attempts = 0, next_retry_at = 0, last_error = NULL,
+                    lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE task = ? AND code = ? AND (status = 'failed' OR (status = 'done' AND updated_at < ?))
+                """,
+                [(now, self.task, code, cutoff) for code in items]
+            ).rowcount
+            inserted = conn.executemany(
+                f"""
+                INSERT OR IGNORE INTO {FETCH_JOBS_TABLE} (task, code, status, attempts, next_retry_at, payload, updated_at)
+                VALUES (?, ?, 'pending', 0, 0, ?, ?)
+                """,
+                [(self.task, code, payload, now) for payload, code in payloads]
+            ).rowcount
+        return revived + inserted
+
+    def lease(self, limit: int) -> list[LeasedJob]:
+        """
+        Lease up to `limit` due jobs: pending jobs past their backoff, and leased jobs whose
+        lease expired (their owner crashed or was killed).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT code, payload, attempts FROM {FETCH_JOBS_TABLE}
+                WHERE task = ? AND (
+                    (status = 'pending' AND next_retry_at <= ?)
+                    OR (status = 'leased' AND lease_expires_at <= ?)
+                )
+                ORDER BY next_retry_at, code
+                LIMIT ?
+                """,
+                (self.task, now, now, limit)
+            ).fetchall()
+            conn.executemany(
+                f"""
+                UPDATE {FETCH_JOBS_TABLE}
+                SET status = 'leased', lease_owner = ?, lease_expires_at = ?, updated_at = ?
+                WHERE task = ? AND code = ?
+                """,
+                [(self.owner, now + self.lease_secs, now, self.task, row[0]) for row in rows]
+            )
+        return [LeasedJob(code, json.loads(payload or "{}"), attempts) for code, payload, attempts in rows]
+
+    def _held(self, conn: sqlite3.Connection, codes: Iterable[str]) -> list[str]:
+        codes = list(codes)
+        held = []
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            held += [row[0] for row in conn.execute(
+                f"""
+                SELECT code FROM {FETCH_JOBS_TABLE}
+                WHERE task = ? AND status = 'leased' AND lease_owner = ? AND code IN ({placeholders})
+                """,
+                (self.task, self.owner, *chunk)
+            )]
+        return held
+
+    def complete(self, codes: Iterable[str]) -> int:
+        """Mark jobs leased by this queue as done, returns the number settled."""
+        now = time.time()
+        with self._transaction() as conn:
+            held = self._held(conn, codes)
+            conn.executemany(
+                f"""
+                UPDATE {FETCH_JOBS_TABLE}
+                SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, updated_at = ?
+                WHERE task = ? AND code = ?
+                """,
+                [(now, self.task, code) for code in held]
+            )
+        return len(held)
+
+    def fail(self, code: str, error: BaseException) -> Optional[float]:
+        """
+        Record a failed attempt of a job leased by this queue.
+
+        Returns:
+            seconds until the job may be retried, None if it is now failed for good (or
+            not held by this queue any more)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if not self._held(conn, [code]):
+                return None
+            attempts = conn.execute(
+                f"SELECT attempts FROM {FETCH_JOBS_TABLE} WHERE task = ? AND code = ?", (self.task, code)
+            ).fetchone()[0] + 1
+            delay = None
+            if attempts < self.max_attempts:
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            conn.execute(
+                f"""
+                UPDATE {FETCH_JOBS_TABLE}
+                SET status = ?, attempts = ?, next_retry_at = ?, last_error = ?,
+                    lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE task = ? AND code = ?
+                """,
+                (
+                    'pending' if delay is not None else 'failed', attempts, now + (delay or 0),
+                    str(error)[:500], now, self.task, code
+                )
+            )
+        return delay
+
+    def release(self, codes: Iterable[str]) -> int:
+        """Hand leased jobs back as pending without counting an attempt (e.g. on Ctrl-C)."""
+        now = time.time()
+        with self._transaction() as conn:
+            held = self._held(conn, codes)
+            conn.executemany(
+                f"""
+                UPDATE {FETCH_JOBS_TABLE}
+                SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE task = ? AND code = ?
+                """,
+                [(now, self.task, code) for code in held]
+            )
+        return len(held)
+
+    def next_due_in(self) -> Optional[float]:
+        """Seconds until the next pending job is due (0 if one is due now), None if nothing is pending."""
+        # reads go through the thread's read connection, they need no write lock
+        next_retry_at = get_read_connection().execute(
+            f"SELECT MIN(next_retry_at) FROM {FETCH_JOBS_TABLE} WHERE task = ? AND status = 'pending'", (self.task,)
+        ).fetchone()[0]
+        return None if next_retry_at is None else max(0.0, next_retry_at - time.time())
+
+    def has_unfinished(self) -> bool:
+        """True if a previous run left pending or leased jobs behind."""
+        counts = self.counts()
+        return counts['pending'] + counts['leased'] > 0
+
+    def counts(self) -> dict[str, int]:
+        rows = get_read_connection().execute(
+            f"SELECT status, COUNT(*) FROM {FETCH_JOBS_TABLE} WHERE task = ? GROUP BY status", (self.task,)
+        ).fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def payloads(self, statuses: Iterable[str] = ("pending", "leased")) -> dict[str, dict]:
+        """{code: payload} of the jobs in `statuses`, by default the unfinished ones."""
+        statuses = tuple(statuses)
+        rows = get_read_connection().execute(
+            f"""
+            SELECT code, payload FROM {FETCH_JOBS_TABLE}
+            WHERE task = ? AND status IN ({','.join('?' for _ in statuses)}) ORDER BY code
+            """,
+            (self.task, *statuses)
+        ).fetchall()
+        return {code: json.loads(payload or "{}") for code, payload in rows}
+
+    def failed_jobs(self) -> dict[str, str]:
+        """{code: last error} of the jobs that ran out of attempts."""
+        return dict(get_read_connection().execute(
+            f"SELECT code, last_error FROM {FETCH_JOBS_TABLE} WHERE task = ? AND status = 'failed' ORDER BY code",
+            (self.task,)
+        ).fetchall())
+
+    def clear(self):
+        """Forget every job of this task."""
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {FETCH_JOBS_TABLE} WHERE task = ?", (self.task,))
+
+def run_fetch_queue(
+    queue: FetchJobQueue,
+    scheduler: FetchScheduler,
+    make_job: Callable[[LeasedJob], FetchJob],
+    batch_size: Optional[int] = None,
+    defer_complete: Optional[Callable[[str, Any], bool]] = None,
+    on_batch: Optional[Callable[[dict[str, Any]], None]] = None,
+    max_idle_wait: float = 60.0,
+) -> dict[str, int]:
+    """
+    Lease due jobs of `queue` in batches and run them on `scheduler` until nothing is pending.
+
+    Jobs that succeed are completed, failures go back to the queue with backoff, and jobs
+    still held when the run is interrupted are released for the next run. Jobs leased by
+    other live processes are left to them.
+
+    Args:
+        queue: the task's job queue
+        scheduler: runs each batch; give it max_attempts=1, the queue does the retrying
+        make_job: builds the FetchJob of a leased job, FetchJob.key must be the job's code
+        batch_size: jobs leased per round, 8x the scheduler's max concurrency by default
+        defer_complete: (code, result) -> True if the caller completes the job itself later,
+            e.g. once the writer has persisted the result
+        on_batch: persists {code: result} of a batch before its jobs are completed; if it
+            raises, every job of the batch counts as failed
+        max_idle_wait: longest sleep while waiting for backoffs to expire
+
+    Returns:
+        dict: job counts by status for the task after the run, see FetchJobQueue.counts()
+    """
+    batch_size = batch_size or scheduler.max_concurrency * 8
+
+    # every batch runs in the same event loop, the scheduler's primitives are bound to it
+    async def drain() -> None:
+        while True:
+            jobs = queue.lease(batch_size)
+            if not jobs:
+                wait = queue.next_due_in()
+                if wait is None:
+                    break
+                logger.info(f"⏳ {queue.task}: waiting {wait:.0f}s for jobs in backoff...")
+                await asyncio.sleep(min(wait, max_idle_wait) + 0.1)
+                continue
+
+            try:
+                results = await scheduler.arun(make_job(job) for job in jobs)
+            except BaseException:
+                released = queue.release(job.code for job in jobs)
+                logger.warning(f"{queue.task}: interrupted, released {released} leased jobs.")
+                raise
+
+            if on_batch is not None and results:
+                try:
+                    on_batch(results)
+                except Exception as e:
+                    logger.error(f"{queue.task}: failed to persist a batch of {len(results)}: {e}")
+                    for code in results:
+                        queue.fail(code, e)
+                    results = {}
+
+            queue.complete(
+                code for code, result in results.items()
+                if defer_complete is None or not defer_complete(code, result)
+            )
+            for code, error in scheduler.failures.items():
+                delay = queue.fail(code, error)
+                if delay is None:
+                    logger.error(f"{queue.task}: {code} gave up after {queue.max_attempts} attempts: {error}")
+
+    asyncio.run(drain())
+    return queue.counts()
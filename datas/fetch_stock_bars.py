@@ -1,34 +1,72 @@
 import akshare as ak
 import sqlite3
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from tools.log import get_fetch_logger
 from tools.stock_tools import get_exchange_by_code, to_dot_ex_code, MARKED_CLOSE_HOUR, latest_trade_day
-from tools.times import ms_timestamp_to_date
+from tools.times import ms_timestamp_to_date, datetime_to_int_dates
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional, Any
+from typing import Callable, Optional, Any
 from datetime import datetime, timedelta
-from datas.create_database import DB_PATH, DAILY_BAR_TABLE, EARLIEST_DATE, get_db_connection
-from datas.query_stock import query_daily_bars, query_latest_bars, get_latest_date_by_code
+from datas.create_database import DB_PATH, DAILY_BAR_TABLE, EARLIEST_DATE, get_db_connection, invalidate_bar_store, refresh_bar_coverage, BAR_COVERAGE_TABLE, ensure_database_schema
+from datas.query_stock import query_daily_bars, query_latest_bars, get_latest_date_by_code, invalidate_bar_cache
 from tools.export import export_bars_to_csv
 import time 
 from contextlib import closing
+from functools import lru_cache
 from ai.ai_kbar_analyses import analyze_kbar_data_openai
 from tools.markdown_lab import save_md_to_file_name, render_markdown_to_image_file_name
 from datas.query_stock import get_stock_info_by_code
 import tushare as ts
 from ratelimit import limits, sleep_and_retry
 from tools.tushare_rate_limiter import tushare_token_rate_limiter
+from tools.response_cache import cached_call
 
 logger = get_fetch_logger()
 FETCH_WORKERS = 10
 
+def bars_complete(end_date: Optional[str], date_column: str) -> Optional[Callable[[pd.DataFrame], bool]]:
+    """
+    cached_call() completeness check of a bars response up to `end_date` (YYYYMMDD).
+
+    Bars up to the latest trading day are final once they hold that day's bar; until
+    then the day may not be published yet and the response is cached as "partial". A
+    cross-section (end_date is its trade_date, date_column None) of the latest trading
+    day can be published piecemeal, it is always cached as "partial". Older windows are
+    final.
+    """
+    latest = latest_trade_day().strftime("%Y%m%d")
+    if end_date is None or end_date < latest:
+        return None
+    if date_column is None:
+        return lambda df: False
+    return lambda df: bool((pd.to_datetime(df[date_column].astype(str)).dt.strftime("%Y%m%d") >= latest).any())
+
+def tushare_query(endpoint: str, kind: str = "bars", **params) -> pd.DataFrame:
+    """
+    Call pro.<endpoint>(**params) through the response cache. A rate-limited token slot
+    is only taken when the call actually goes to the network, one slot per API call.
+    Bars of the latest trading day are cached briefly until complete, see bars_complete().
+    """
+    def call(**kwargs):
+        pro = ts.pro_api(token=tushare_token_rate_limiter())
+        return getattr(pro, endpoint)(**kwargs)
+    complete = None
+    if kind == "bars":
+        if 'trade_date' in params:
+            complete = bars_complete(params['trade_date'], None)
+        else:
+            complete = bars_complete(params.get('end_date'), 'trade_date')
+    return cached_call("tushare", endpoint, call, kind=kind, complete=complete, **params)
+
 def fetch_daily_bar_from_akshare(
     code: str,
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
-    adjust: str = "qfq"  # qfq:前复权, hfq:后复权, "" :不复权
+    adjust: str = "qfq",  # qfq:前复权, hfq:后复权, "" :不复权
+    raise_errors: bool = False
 ) -> Optional[pd.DataFrame]:
     """
     fetch daily stock bars from akshare
@@ -37,6 +75,7 @@ def fetch_daily_bar_from_akshare(
         from_date: start date in YYYYMMDD format
         to_date: end date in YYYYMMDD format
         adjust: adjustment type, "qfq" for 前复权, "hfq" for 后复权, "" for no adjustment
+        raise_errors: re-raise source errors (for schedulers that retry/back off) instead of returning None
     Returns:
         DataFrame with daily bars or None if failed
     """
@@ -48,7 +87,9 @@ def fetch_daily_bar_from_akshare(
         to_date = latest_trade_day().strftime("%Y%m%d")
     
     try:
-        df = ak.stock_zh_a_hist(
+        df = cached_call(
+            "akshare", "stock_zh_a_hist", ak.stock_zh_a_hist, kind="bars",
+            complete=bars_complete(to_date, '日期'),
             symbol=code,
             period="daily",
             start_date=from_date,
@@ -115,6 +156,8 @@ def fetch_daily_bar_from_akshare(
 
         return df
     except Exception as e:
+        if raise_errors:
+            raise
         logger.error(f"Error fetching data for {code}: {e}", exc_info=True)
         return None
 
@@ -124,10 +167,9 @@ def fetch_daily_bar_from_tushare(
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
     adjust: str = "qfq",
+    raise_errors: bool = False
 ) -> Optional[pd.DataFrame]:
 
-    token = tushare_token_rate_limiter()
-    
     if from_date is None:
         from_date = EARLIEST_DATE
 
@@ -137,9 +179,8 @@ def fetch_daily_bar_from_tushare(
     
     dot_ex_code = to_dot_ex_code(code)
     try:
-        
-        pro = ts.pro_api(token=token)        
-        df = pro.daily(
+        df = tushare_query(
+            "daily",
             ts_code=dot_ex_code,
             start_date=from_date,
             end_date=to_date
@@ -149,7 +190,8 @@ def fetch_daily_bar_from_tushare(
             logger.warning(f"No daily bar data returned from tushare for code={code}")
             return None
         
-        adj = pro.adj_factor(
+        adj = tushare_query(
+            "adj_factor",
             ts_code=dot_ex_code,
             start_date=from_date, 
             end_date=to_date
@@ -160,72 +202,306 @@ def fetch_daily_bar_from_tushare(
             return None
         
         df = df.merge(adj[['trade_date', 'adj_factor']], on='trade_date')
-        df = df.sort_values('trade_date').reset_index(drop=True)
-        latest_adj = df['adj_factor'].iloc[-1]
-        df['close'] = df['close'] * df['adj_factor'] / latest_adj
-        df['open'] = df['open'] * df['adj_factor'] / latest_adj
-        df['high'] = df['high'] * df['adj_factor'] / latest_adj
-        df['low'] = df['low'] * df['adj_factor'] / latest_adj
+        df['code'] = code
+        df = _format_tushare_bars(df, label=code, extra_columns=('adj_factor',))
+        if df is None:
+            return None
+        # qfq: scale every price column to the latest factor
+        scale = df['adj_factor'] / df['adj_factor'].iloc[-1]
+        for col in QFQ_PRICE_COLUMNS:
+            df[col] = (df[col] * scale).round(2)
+        return df
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger.error(f"Error fetching data for {code}: {e}", exc_info=True)
+        return None
+
+def _format_tushare_bars(df: pd.DataFrame, label: str, extra_columns: tuple[str, ...] = ()) -> Optional[pd.DataFrame]:
+    """
+    Rename tushare daily columns to the bar table's, convert types and sort by code/date.
+    `df` must already carry a std 'code' column.
+    """
+    column_mapping = {
+        'trade_date': 'date',
+        'open': 'open',
+        'high': 'high',
+        'low': 'low',
+        'close': 'close',
+        'vol': 'volume',
+        'amount': 'amount',
+        'pct_chg': 'change_pct',
+        'change': 'price_change'
+    }
+
+    df = df.rename(columns=column_mapping)
+
+    # required columns
+    required_columns = ['date', 'high', 'low', 'close', 'open', 'volume']
+    missing_cols = [col for col in required_columns if col not in df.columns]
+    if missing_cols:
+        logger.error(f"Missing required columns after mapping: {missing_cols} for {label}")
+        return None
+
+    final_columns = [
+        'code', 'date', 'open', 'close', 'high', 'low',
+        'volume', 'amount', 'change_pct', 
+        'price_change', *extra_columns
+    ]
+    available_columns = [col for col in final_columns if col in df.columns]
+    df = df[available_columns]
+
+    # Drop invalid dates
+    original_len = len(df)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date']).copy()
+    dropped_count = original_len - len(df)
+    if dropped_count > 0:
+        logger.warning(f"Dropped {dropped_count} rows with invalid dates for {label}")
         
-        column_mapping = {
-            'trade_date': 'date',
-            'open': 'open',
-            'high': 'high',
-            'low': 'low',
-            'close': 'close',
-            'vol': 'volume',
-            'amount': 'amount',
-            'pct_chg': 'change_pct',
-            'change': 'price_change'
-        }
+    # Convert data types
+    for col in ['open', 'close', 'high', 'low', 'amount', 'change_pct', 'price_change']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
+    df['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0).astype('int64') * 100
+    # tushare amounts are in 千元, akshare's (and the table's) in 元
+    df['amount'] = df['amount'] * 1000
+
+    return (
+        df
+        .drop_duplicates(subset=['code', 'date'], keep='last')
+        .sort_values(['code', 'date'])
+        .reset_index(drop=True)
+    )
+
+def fetch_daily_cross_section_from_tushare(trade_date: str) -> Optional[pd.DataFrame]:
+    """
+    Fetch the unadjusted daily bars of every stock for one trading day, with adj factors.
 
-        df = df.rename(columns=column_mapping)
+    Two tushare calls for the whole market (pro.daily and pro.adj_factor by trade_date)
+    instead of two per code.
 
-        # required columns
-        required_columns = ['date', 'high', 'low', 'close', 'open', 'volume']
-        missing_cols = [col for col in required_columns if col not in df.columns]
-        if missing_cols:
-            logger.error(f"Missing required columns after mapping: {missing_cols} for {code}")
+    Args:
+        trade_date: trading day in YYYYMMDD format
+
+    Returns:
+        DataFrame with bar columns plus 'adj_factor', or None if the day is not published yet
+    """
+    try:
+        df = tushare_query("daily", trade_date=trade_date)
+        if df is None or df.empty:
+            logger.warning(f"No daily bar data returned from tushare for trade_date={trade_date}")
             return None
 
-        df['code'] = code
+        adj = tushare_query("adj_factor", trade_date=trade_date)
+        if adj is None or adj.empty:
+            logger.warning(f"No adj factors returned from tushare for trade_date={trade_date}")
+            return None
 
-        final_columns = [
-            'code', 'date', 'open', 'close', 'high', 'low',
-            'volume', 'amount', 'change_pct', 
-            'price_change'
-        ]
-        available_columns = [col for col in final_columns if col in df.columns]
-        df = df[available_columns]
+        df = df.merge(adj[['ts_code', 'adj_factor']], on='ts_code', how='left')
+        df = df[df['ts_code'].str.match(r'^\d{6}\.')]
+        df['code'] = df['ts_code'].str[:6]
+        return _format_tushare_bars(df, label=trade_date, extra_columns=('adj_factor',))
+    except Exception as e:
+        logger.error(f"Error fetching cross section for {trade_date}: {e}", exc_info=True)
+        return None
 
-        # Drop invalid dates
-        original_len = len(df)
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date']).copy()
-        dropped_count = original_len - len(df)
-        if dropped_count > 0:
-            logger.warning(f"Dropped {dropped_count} rows with invalid dates for {code}")
-            
-        # Convert data types
-        for col in ['open', 'close', 'high', 'low', 'amount', 'change_pct', 'price_change']:
-            df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
-        df['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0).astype('int64') * 100
+BAR_STAGE_TABLE = "_stage_bars_daily"
+
+# stored prices that scale with the qfq reference factor
+QFQ_PRICE_COLUMNS = ('open', 'close', 'high', 'low', 'price_change')
+
+@lru_cache(maxsize=None)
+def _upsert_sql(table: str, columns: tuple[str, ...], from_stage: bool = False) -> str:
+    """Build (once per column set) the UPSERT statement for the daily bar table."""
+    assignments = ", ".join(
+        f"{col} = excluded.{col}"
+        for col in columns
+        if col not in ('code', 'date')
+    )
+    if from_stage:
+        # "WHERE true" keeps the parser from reading ON CONFLICT as a join constraint
+        source = f"SELECT {', '.join(columns)} FROM {BAR_STAGE_TABLE} WHERE true"
+    else:
+        source = f"VALUES ({', '.join('?' for _ in columns)})"
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        {source}
+        ON CONFLICT (code, date) DO UPDATE SET
+        {assignments};
+    """
+
+def _bar_rows(df: pd.DataFrame, columns: tuple[str, ...]):
+    """Convert a bar frame to row tuples column by column, dates as yyyymmdd ints."""
+    values = []
+    for col in columns:
+        if col == 'date':
+            values.append(datetime_to_int_dates(df['date']).tolist())
+        else:
+            # tolist() yields Python scalars, NaN is stored by SQLite as NULL
+            values.append(df[col].tolist())
+    return zip(*values)
+
+def _stored_adj_refs(conn: sqlite3.Connection, codes: list[str]) -> dict[str, tuple[int, Optional[float]]]:
+    """{code: (last stored date, adj_factor on that row)} read through bar_coverage."""
+    refs = {}
+    try:
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            rows = conn.execute(
+                f"""
+                SELECT c.code, c.last_date, b.adj_factor
+                FROM {BAR_COVERAGE_TABLE} c JOIN {DAILY_BAR_TABLE} b ON b.code = c.code AND b.date = c.last_date
+                WHERE c.code IN ({placeholders})
+                """,
+                chunk
+            ).fetchall()
+            refs.update({code: (last_date, factor) for code, last_date, factor in rows})
+    except sqlite3.OperationalError:
+        # no bar_coverage yet, nothing stored to rebase
+        return {}
+    return refs
+
+def _rebase_qfq_prices(conn: sqlite3.Connection, groups: dict[tuple[str, ...], list[pd.DataFrame]]) -> set[str]:
+    """
+    Keep every code's stored qfq prices on the adj factor of its latest row.
+
+    Frames carrying adj_factor hold prices forward-adjusted to the factor on each code's
+    last row in the frame. When that row is newer than the stored history and its factor
+    differs (ex-rights), the stored prices are rescaled with one UPDATE per code. When the
+    frame is older than the stored history, the frame itself is rescaled to the stored
+    factor. Rows without a stored factor (written before adj_factor existed) are left as is.
+
+    `groups` is updated in place with rescaled frames.
 
-        df = (
-            df
-            .drop_duplicates(subset=['code', 'date'], keep='last')
-            .sort_values('date')
-            .reset_index(drop=True)
+    Returns:
+        codes whose stored prices were rescaled
+    """
+    incoming: dict[str, tuple[int, float]] = {}
+    for columns, group in groups.items():
+        if 'adj_factor' not in columns:
+            continue
+        for df in group:
+            last = df.sort_values('date').groupby('code').tail(1)
+            for code, date, factor in zip(last['code'], datetime_to_int_dates(last['date']), last['adj_factor']):
+                if pd.notna(factor) and (code not in incoming or date > incoming[code][0]):
+                    incoming[code] = (int(date), float(factor))
+    if not incoming:
+        return set()
+
+    stored = _stored_adj_refs(conn, list(incoming))
+    rebase: dict[str, float] = {}
+    rescale: dict[str, float] = {}
+    for code, (date, factor) in incoming.items():
+        last_date, ref = stored.get(code, (None, None))
+        if ref is None or np.isclose(ref, factor, rtol=1e-9, atol=0):
+            continue
+        if date >= last_date:
+            rebase[code] = ref / factor
+        else:
+            rescale[code] = factor / ref
+
+    if rebase:
+        assignments = ", ".join(f"{col} = {col} * ?" for col in QFQ_PRICE_COLUMNS)
+        conn.executemany(
+            f"UPDATE {DAILY_BAR_TABLE} SET {assignments} WHERE code = ?",
+            [(*([ratio] * len(QFQ_PRICE_COLUMNS)), code) for code, ratio in rebase.items()]
         )
+        logger.info(f"♻️ Rebased qfq prices of {len(rebase)} codes on new adj factors")
+
+    if rescale:
+        for columns, group in groups.items():
+            if 'adj_factor' not in columns:
+                continue
+            for i, df in enumerate(group):
+                ratio = df['code'].map(rescale)
+                if ratio.notna().any():
+                    df = df.copy()
+                    ratio = ratio.fillna(1.0)
+                    for col in QFQ_PRICE_COLUMNS:
+                        if col in df.columns:
+                            df[col] = df[col] * ratio
+                    group[i] = df
+    return set(rebase)
+
+def save_daily_bars_batch(
+    frames: list[pd.DataFrame],
+    conn: Optional[sqlite3.Connection] = None,
+    staging: bool = False
+) -> int:
+    """
+    Upsert many daily bar DataFrames in a single transaction.
 
-        start_str = df['date'].min().strftime("%Y-%m-%d")
-        end_str = df['date'].max().strftime("%Y-%m-%d")
-        # logger.info(f"Fetched {len(df)} daily bars for {code} [{start_str} ~ {end_str}]")
+    Frames are grouped by their column set, so a frame only updates the columns it
+    carries (e.g. tushare frames leave amplitude/turnover_rate untouched). Each group is
+    written with one executemany on a prepared UPSERT, or, with staging=True, bulk
+    inserted into a TEMP table and merged with one INSERT ... ON CONFLICT.
+    bar_coverage rows (and write_seq) of the touched codes are refreshed in the same transaction, and
+    their cached windows from the earliest written date on are dropped afterwards.
+    Frames with an adj_factor column keep stored qfq prices consistent, see
+    _rebase_qfq_prices.
 
-        return df
-    except Exception as e:
-        logger.error(f"Error fetching data for {code}: {e}", exc_info=True)
-        return None
+    Args:
+        frames: daily bar frames as returned by fetch_daily_bar_from_*
+        conn: connection to write with; a new one is opened (and closed) if None
+        staging: merge through a TEMP staging table instead of a direct executemany
+
+    Returns:
+        int: number of rows written
+    """
+    groups: dict[tuple[str, ...], list[pd.DataFrame]] = {}
+    for df in frames:
+        if df is None or df.empty:
+            continue
+        groups.setdefault(tuple(df.columns), []).append(df)
+    if not groups:
+        return 0
+
+    own_conn = conn is None
+    if own_conn:
+        ensure_database_schema()
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('PRAGMA synchronous=NORMAL;')
+
+    start = time.perf_counter()
+    total = 0
+    try:
+        with conn:  # one transaction, rolled back on error
+            rebased = _rebase_qfq_prices(conn, groups)
+            for columns, group in groups.items():
+                if staging:
+                    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {BAR_STAGE_TABLE} AS SELECT * FROM {DAILY_BAR_TABLE} WHERE 0")
+                    for df in group:
+                        conn.executemany(
+                            f"INSERT INTO {BAR_STAGE_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                            _bar_rows(df, columns)
+                        )
+                    conn.execute(_upsert_sql(DAILY_BAR_TABLE, columns, from_stage=True))
+                    conn.execute(f"DELETE FROM {BAR_STAGE_TABLE}")
+                else:
+                    sql = _upsert_sql(DAILY_BAR_TABLE, columns)
+                    for df in group:
+                        conn.executemany(sql, _bar_rows(df, columns))
+                total += sum(len(df) for df in group)
+            touched: dict[str, int] = {}
+            for group in groups.values():
+                for df in group:
+                    first_dates = df.groupby('code')['date'].min()
+                    for code, first in zip(first_dates.index, datetime_to_int_dates(first_dates)):
+                        touched[code] = min(touched.get(code, first), int(first))
+            # rebased codes get a new write_seq too, their stored history was rewritten
+            refresh_bar_coverage(conn, set(touched) | rebased)
+    finally:
+        if own_conn:
+            conn.close()
+
+    for code, first in touched.items():
+        invalidate_bar_cache(code, None if code in rebased else first)
+
+    elapsed = time.perf_counter() - start
+    logger.debug(f"💾 Upserted {total} bars in {elapsed:.3f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    invalidate_bar_store()
+    return total
 
 def save_daily_bars_to_database(df: pd.DataFrame):
     """
@@ -237,50 +513,11 @@ def save_daily_bars_to_database(df: pd.DataFrame):
         logger.warning("Warning: Empty DataFrame, nothing to save.")
         return
 
-    write_df = df.copy()
-    write_df['date'] = write_df['date'].dt.strftime("%Y-%m-%d")  # 转为字符串存入 SQLite
-
-    def upsert_method(table, cursor, keys, data_iter):
-        """Custom upsert for SQLite 3.24+ using ON CONFLICT DO UPDATE"""
-        columns = ", ".join(keys)
-        placeholders = ", ".join([f":{key}" for key in keys])
-        conflict_target = "(code, date)"
-
-        assignments = ", ".join([
-            f"{col} = excluded.{col}"
-            for col in keys
-            if col not in ('code', 'date')
-        ])
-
-        sql = f"""
-            INSERT INTO {table.name} ({columns})
-            VALUES ({placeholders})
-            ON CONFLICT {conflict_target} DO UPDATE SET
-            {assignments};
-        """
-
-        try:
-            cursor.executemany(
-                sql,
-                ({k: v for k, v in zip(keys, row)} for row in data_iter)
-            )
-        except Exception as e:
-            logger.error(f"❌ Upsert failed: {e}\nSQL: {sql}")
-            raise
-
-    with sqlite3.connect(DB_PATH) as conn:
-        try:
-            write_df.to_sql(
-                name=DAILY_BAR_TABLE,
-                con=conn,
-                if_exists='append',
-                index=False,
-                method=upsert_method,
-                chunksize=5000
-            )
-            # logger.info(f"💾 Upserted {len(write_df)} records into {DAILY_BAR_TABLE}")
-        except Exception as e:
-            logger.error(f"💔 Failed to upsert bars: {e}", exc_info=True)
+    try:
+        save_daily_bars_batch([df])
+        # logger.info(f"💾 Upserted {len(df)} records into {DAILY_BAR_TABLE}")
+    except Exception as e:
+        logger.error(f"💔 Failed to upsert bars: {e}", exc_info=True)
 
 def update_daily_bars_for_code(
     code: str,
@@ -6,161 +6,194 @@ import json
 from tools.log import get_fetch_logger
 from tools.stock_tools import get_exchange_by_code
 from tools.times import ms_timestamp_to_date
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional, Any
-from datetime import datetime
-from datas.create_database import STOCK_INFO_TABLE
+from datetime import datetime, timedelta
+from datas.create_database import STOCK_INFO_TABLE, create_stock_info_table, ensure_stock_info_updated_at_column
+from datas.fetch_jobs import FetchJobQueue, run_fetch_queue
+from tools.fetch_scheduler import FetchScheduler, FetchJob
+from tools.response_cache import cached_call
 
 DB_PATH = Path(__file__).parent.parent / "database" / "ashare_data.db"
 logger = get_fetch_logger()
 
 FETCH_WORKERS = 20
-
-def fetch_stock_infos(rebuild: bool = True):
-    if rebuild:
-        logger.info("Rebuilding stock_base_info table...")
-        from datas.create_database import delete_table_if_exists, create_stock_info_table
-        delete_table_if_exists(STOCK_INFO_TABLE)
+# fetch_jobs task of the profile refresh
+STOCK_INFO_TASK = "stock_info"
+# profiles (intro, scope, industry) rarely change, refetch a code after this many days;
+# each code's TTL is stretched by 0.75-1.25x so refetches spread over days
+STOCK_INFO_TTL_DAYS = 30
+
+_STOCK_INFO_COLUMNS = [
+    'code', 'exchange_code', 'exchange_name', 'name', 'org_name_en', 'org_short_name_en',
+    'full_name', 'main_operation_business', 'operating_scope',
+    'org_introduction', 'classi_name', 'list_date', 'idn_code', 'idn_name', 'updated_at'
+]
+_SQL_SAVE_STOCK_INFO = f"""
+INSERT OR REPLACE INTO {STOCK_INFO_TABLE} ({', '.join(_STOCK_INFO_COLUMNS)})
+VALUES ({', '.join(':' + col for col in _STOCK_INFO_COLUMNS)})
+"""
+
+def plan_stock_info_refresh(code_names: dict[str, str], ttl_days: int = STOCK_INFO_TTL_DAYS) -> dict[str, str]:
+    """
+    Diff the listed codes against stock_base_info.
+
+    Args:
+        code_names: {code: name} of the current code list
+        ttl_days: refetch a stored profile after this many days
+
+    Returns:
+        dict: {code: name} of codes that are new, renamed, or past their TTL
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        stored = {code: (name, updated_at) for code, name, updated_at in conn.execute(f"SELECT code, name, updated_at FROM {STOCK_INFO_TABLE}")}
+    finally:
+        conn.close()
+
+    now = datetime.now()
+    new, renamed, stale = {}, {}, {}
+    for code, name in code_names.items():
+        if code not in stored:
+            new[code] = name
+        elif stored[code][0] != name:
+            renamed[code] = name
+        else:
+            updated_at = stored[code][1]
+            ttl = timedelta(days=ttl_days * (0.75 + int(code) % 50 / 100))
+            if updated_at is None or datetime.fromisoformat(updated_at) < now - ttl:
+                stale[code] = name
+    delisted = len(set(stored) - set(code_names))
+    logger.info(f"📋 Stock infos: {len(new)} new, {len(renamed)} renamed, {len(stale)} past TTL, {len(stored) - len(renamed) - len(stale) - delisted} fresh, {delisted} no longer listed.")
+    return {**new, **renamed, **stale}
+
+def fetch_stock_infos(rebuild: bool = False, ttl_days: int = STOCK_INFO_TTL_DAYS):
+    """
+    Refresh stock_base_info from Xueqiu.
+
+    Incremental by default: only codes that are new, renamed or older than their TTL are
+    fetched. rebuild=True drops the table and fetches every code. Codes are enqueued as
+    STOCK_INFO_TASK jobs and drained on a FetchScheduler, a failing code is retried with
+    backoff, and the records of each leased batch are written in one transaction. If a
+    previous run left jobs unfinished it is resumed instead, unless rebuild=True, which
+    drops them.
+    """
+    jobs = FetchJobQueue(STOCK_INFO_TASK)
+    if rebuild and jobs.has_unfinished():
+        logger.info(f"Dropping unfinished stock info jobs for the rebuild: {jobs.counts()}")
+        jobs.clear()
+    if jobs.has_unfinished():
+        logger.info(f"Resuming unfinished stock info jobs: {jobs.counts()}")
+    else:
+        planned_at = datetime.now().timestamp()
+        if rebuild:
+            logger.info("Rebuilding stock_base_info table...")
+            from datas.create_database import delete_table_if_exists
+            delete_table_if_exists(STOCK_INFO_TABLE)
+            logger.info("🎉 Done.")
         create_stock_info_table()
-        logger.info("🎉 Done.")
+        ensure_stock_info_updated_at_column()
 
-    logger.info("Fetching A-share code list...")
-    try:
-        code_list_df = ak.stock_info_a_code_name()
-    except Exception as e:
-        logger.error(f"Fetching failed: {e}")
-        return
-    if code_list_df.empty:
-        logger.error("Fetched data is empty.")
-        return
-
-    total_count = len(code_list_df)
-    logger.info(f"🎉 Done Fetched {total_count} codes.")
-    logger.info("Fetching stock detail infos...")
-    continuousFailed = 0
-    retryRows = []
-    startDatetime = datetime.now()
-    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
-        futures = [executor.submit(worker_task, row) for row in code_list_df.itertuples()]
-        success_count = 0
+        logger.info("Fetching A-share code list...")
         try:
-            for future in tqdm(as_completed(futures), total=total_count):
-                success, row = future.result()
-                if success:
-                    continuousFailed = 0
-                    success_count += 1
-                else:
-                    continuousFailed += 1
-                    retryRows.append(row)
-                    if continuousFailed >= 10:
-                        raise Exception("Too many continuous failures")
+            code_list_df = cached_call("akshare", "stock_info_a_code_name", ak.stock_info_a_code_name, kind="code_list")
         except Exception as e:
-            if continuousFailed >= 10:
-                logger.error("💔 Detected too many continuous failures, aborting...")
-                for f in futures:
-                    f.cancel()
-            
-    if continuousFailed < 10:
-        # Retry failed ones
-        if retryRows:
-            logger.info(f"Retrying {len(retryRows)} failed items...")
-            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
-                futures = [executor.submit(worker_task, row) for row in retryRows]
-                for future in tqdm(as_completed(futures), total=len(retryRows)):
-                    success, _ = future.result()
-                    if success:
-                        success_count += 1
-        
-        endDatetime = datetime.now()
-        elapsed = (endDatetime - startDatetime).total_seconds()
-        logger.info(f"🎉 Done: {elapsed:.2f} seconds taken, Success={success_count}, Failed={total_count - success_count}, Retried={len(retryRows)}")
-    else:
-        logger.info(f"💔 Aborted: Success={success_count}, Failed={total_count - success_count}")
+            logger.error(f"Fetching failed: {e}")
+            return
+        if code_list_df.empty:
+            logger.error("Fetched data is empty.")
+            return
+
+        logger.info(f"🎉 Done Fetched {len(code_list_df)} codes.")
+        code_names = {}
+        for code, name in zip(code_list_df['code'], code_list_df['name']):
+            code = str(code).zfill(6)
+            try:
+                get_exchange_by_code(code)
+                code_names[code] = name
+            except ValueError as e:
+                logger.warning(f"Skipping {code}: {e}")
+        plan = plan_stock_info_refresh(code_names, ttl_days)
+        if not plan:
+            return
+        jobs.enqueue({code: {'name': name} for code, name in plan.items()}, planned_at=planned_at)
 
-def worker_task(row_tuple) -> tuple[bool, Any]:
-    row = row_tuple
-    success = False
-    conn = None
+    logger.info("Fetching stock detail infos...")
+    startDatetime = datetime.now()
+    scheduler = FetchScheduler(max_concurrency=FETCH_WORKERS, max_attempts=1, desc="stock infos")
+    counts = run_fetch_queue(
+        jobs,
+        scheduler,
+        lambda job: FetchJob(job.code, "xueqiu", fetch_stock_info_record, (job.code, job.payload.get('name'))),
+        on_batch=lambda records: save_stock_info_records(records.values()),
+    )
+
+    elapsed = (datetime.now() - startDatetime).total_seconds()
+    logger.info(f"🎉 Done: {elapsed:.2f} seconds taken, jobs={counts}")
+    if counts['failed']:
+        logger.error(f"💔 Gave up on: {list(jobs.failed_jobs())[:50]}")
+
+def save_stock_info_records(records) -> int:
+    """Upsert stock_base_info records in one transaction, returns the number written."""
+    records = list(records)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        success = fetch_and_save_stock_info(row, cursor)
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Thread failed for {row.code}: {e}")
+        with conn:
+            conn.executemany(_SQL_SAVE_STOCK_INFO, records)
     finally:
-        if conn:
-            conn.close()
-    return (success, row_tuple)
+        conn.close()
+    return len(records)
 
-def fetch_and_save_stock_info(row, cursor) -> bool:
-    code = str(row.code).zfill(6)
-    name = row.name
-    try:
-        exchange_code, exchange_name = get_exchange_by_code(code)
-    except ValueError as e:
-        logger.error(f"Error fetching exchange code for {code}: {e}")
-        return False
+def fetch_stock_info_record(code: str, name: str) -> dict:
+    """
+    Fetch one code's Xueqiu profile as a stock_base_info record.
+
+    Raises:
+        RuntimeError / source errors: on any failure, so the job is retried
+    """
+    code = str(code).zfill(6)
+    exchange_code, exchange_name = get_exchange_by_code(code)
 
     symbol = f"{exchange_code}{code}"
 
-    try:
-        xueqiu_info = ak.stock_individual_basic_info_xq(symbol=symbol)
-        if xueqiu_info.empty:
-            logger.warning(f"No data returned from Xueqiu for {symbol}")
-            return False
-
-        required_cols = {'item', 'value'}
-        if not required_cols.issubset(xueqiu_info.columns):
-            missing = required_cols - set(xueqiu_info.columns)
-            logger.error(f"Missing columns {missing} in response for {symbol}")
-            return False
-
-        data_dict = dict(zip(xueqiu_info['item'], xueqiu_info['value']))
-        affiliate_industry = data_dict.get('affiliate_industry')
-        idn_code = None
-        idn_name = None
-        if isinstance(affiliate_industry, dict):
-            idn_code = affiliate_industry.get('ind_code')
-            idn_name = affiliate_industry.get('ind_name')
-
-        date_str = ms_timestamp_to_date(data_dict.get('listed_date'))
-        record = {
-            'code': code,
-            'exchange_code': exchange_code,
-            'exchange_name': exchange_name,
-            'name': name,
-            'org_name_en': data_dict.get('org_name_en'),
-            'org_short_name_en': data_dict.get('org_short_name_en'),
-            'full_name': data_dict.get('org_name_cn'),
-            'main_operation_business': data_dict.get('main_operation_business'),
-            'operating_scope': data_dict.get('operating_scope'),
-            'org_introduction': data_dict.get('org_cn_introduction'),
-            'classi_name': data_dict.get('classi_name'),
-            'list_date': date_str,
-            'idn_code': idn_code,
-            'idn_name': idn_name,
-        }
-
-        sql = """
-        INSERT OR REPLACE INTO stock_base_info (
-            code, exchange_code, exchange_name, name, org_name_en, org_short_name_en,
-            full_name, main_operation_business, operating_scope,
-            org_introduction, classi_name, list_date, idn_code, idn_name
-        ) VALUES (
-            :code, :exchange_code, :exchange_name, :name, :org_name_en, :org_short_name_en,
-            :full_name, :main_operation_business, :operating_scope,
-            :org_introduction, :classi_name, :list_date, :idn_code, :idn_name
-        )
-        """
-        cursor.execute(sql, record)
-
-        return True
-
-    except Exception as e:
-        logger.error(f"Failed to process Xueqiu info for {symbol}: {e}")
-        return False
+    xueqiu_info = cached_call(
+        "akshare", "stock_individual_basic_info_xq", ak.stock_individual_basic_info_xq,
+        kind="stock_info", symbol=symbol
+    )
+    if xueqiu_info.empty:
+        raise RuntimeError(f"No data returned from Xueqiu for {symbol}")
+
+    required_cols = {'item', 'value'}
+    if not required_cols.issubset(xueqiu_info.columns):
+        missing = required_cols - set(xueqiu_info.columns)
+        raise RuntimeError(f"Missing columns {missing} in response for {symbol}")
+
+    data_dict = dict(zip(xueqiu_info['item'], xueqiu_info['value']))
+    affiliate_industry = data_dict.get('affiliate_industry')
+    idn_code = None
+    idn_name = None
+    if isinstance(affiliate_industry, dict):
+        idn_code = affiliate_industry.get('ind_code')
+        idn_name = affiliate_industry.get('ind_name')
+
+    date_str = ms_timestamp_to_date(data_dict.get('listed_date'))
+    record = {
+        'code': code,
+        'exchange_code': exchange_code,
+        'exchange_name': exchange_name,
+        'name': name,
+        'org_name_en': data_dict.get('org_name_en'),
+        'org_short_name_en': data_dict.get('org_short_name_en'),
+        'full_name': data_dict.get('org_name_cn'),
+        'main_operation_business': data_dict.get('main_operation_business'),
+        'operating_scope': data_dict.get('operating_scope'),
+        'org_introduction': data_dict.get('org_cn_introduction'),
+        'classi_name': data_dict.get('classi_name'),
+        'list_date': date_str,
+        'idn_code': idn_code,
+        'idn_name': idn_name,
+        'updated_at': datetime.now().isoformat(timespec="seconds"),
+    }
+
+    return record
 
 if __name__ == "__main__":
-    fetch_stock_infos(rebuild=True)
\ No newline at end of file
+    fetch_stock_infos()
\ No newline at end of file
@@ -0,0 +1,181 @@
+import shutil
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pathlib import Path
+from typing import Optional
+from tools.log import get_fetch_logger
+from tools.stock_tools import to_std_code, get_exchange_by_code
+from tools.times import format_date_input_to_int, int_dates_to_datetime
+from datas.create_database import DB_DIR, DAILY_BAR_TABLE, BAR_STORE_FIELDS, get_db_connection
+
+logger = get_fetch_logger()
+
+PARQUET_DIR = DB_DIR / "parquet" / "daily_bars"
+
+PARQUET_SCHEMA = pa.schema(
+    [
+        pa.field('code', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('date', pa.int32()),  # yyyymmdd
+    ]
+    + [pa.field(col, pa.int64() if dtype.startswith('int') else pa.float64()) for col, dtype in BAR_STORE_FIELDS.items()]
+)
+
+def _exchange_of(code: str) -> str:
+    try:
+        return get_exchange_by_code(code)[0]
+    except ValueError:
+        return "OTHER"
+
+def export_daily_bars_to_parquet(
+    partition_by: str = "year",
+    out_dir: Path = PARQUET_DIR,
+    chunk_codes: int = 500
+) -> int:
+    """
+    Export the daily bar table to a hive-partitioned Parquet dataset.
+
+    Codes are dictionary encoded and dates are int32 yyyymmdd. The dataset is written to a
+    temp directory first and swapped in when complete.
+
+    Args:
+        partition_by: "year" (year=2024/...) or "exchange" (exchange=SH/...)
+        out_dir: dataset root directory
+        chunk_codes: number of codes read from SQLite per chunk
+
+    Returns:
+        int: number of rows exported
+    """
+    if partition_by not in {"year", "exchange"}:
+        raise ValueError(f"Unsupported partition_by: {partition_by}. Choose from 'year', 'exchange'.")
+
+    start = time.time()
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    partition_field = pa.field('year', pa.int16()) if partition_by == "year" else pa.field('exchange', pa.string())
+    schema = PARQUET_SCHEMA.append(partition_field)
+    columns = ['code', 'date', *BAR_STORE_FIELDS]
+
+    total = 0
+    with get_db_connection() as conn:
+        codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE} ORDER BY code")]
+        for i in range(0, len(codes), chunk_codes):
+            chunk = codes[i:i + chunk_codes]
+            placeholders = ','.join('?' for _ in chunk)
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(columns)} FROM {DAILY_BAR_TABLE} WHERE code IN ({placeholders}) ORDER BY code, date",
+                conn,
+                params=chunk
+            )
+            if df.empty:
+                continue
+
+            if partition_by == "year":
+                df['year'] = (df['date'] // 10000).astype('int16')
+            else:
+                df['exchange'] = df['code'].map(_exchange_of)
+            df['volume'] = df['volume'].fillna(0)
+
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            ds.write_dataset(
+                table,
+                tmp_dir,
+                format="parquet",
+                partitioning=ds.partitioning(pa.schema([partition_field]), flavor="hive"),
+                basename_template=f"part-{i // chunk_codes:05d}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+            )
+            total += len(df)
+            logger.info(f"  {min(i + chunk_codes, len(codes))}/{len(codes)} codes, {total} rows")
+
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        out_dir.rename(old_dir)
+    tmp_dir.rename(out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    logger.info(f"🎉 Exported {total} rows to {out_dir} (by {partition_by}) in {time.time() - start:.2f}s")
+    return total
+
+def read_daily_bars_parquet(
+    codes: Optional[list] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    data_dir: Path = PARQUET_DIR,
+    arrow_dtypes: bool = True
+) -> pd.DataFrame:
+    """
+    Read daily bars from the Parquet dataset, pushing code/date filters down to the scan.
+
+    Args:
+        codes: stock codes in any format accepted by to_std_code; None means all
+        from_date: start date (YYYYMMDD or YYYY-MM-DD), optional
+        to_date: end date (YYYYMMDD or YYYY-MM-DD), optional
+        columns: bar columns to load besides code/date; None means all
+        data_dir: dataset root directory
+        arrow_dtypes: return pyarrow-backed columns (pd.ArrowDtype) instead of numpy dtypes
+
+    Returns:
+        pd.DataFrame sorted by code and date, with 'date' as timestamps
+    """
+    if not data_dir.exists():
+        logger.warning(f"Parquet dataset {data_dir} does not exist, run export_daily_bars_to_parquet() first.")
+        return pd.DataFrame()
+
+    dataset = ds.dataset(data_dir, format="parquet", partitioning="hive")
+    names = set(dataset.schema.names)
+
+    filters = []
+    if codes is not None:
+        std_codes = []
+        for code in codes:
+            try:
+                std_codes.append(to_std_code(code))
+            except Exception as e:
+                logger.warning(f"Invalid stock code '{code}': {e}")
+        filters.append(ds.field('code').isin(std_codes))
+        if 'exchange' in names:
+            filters.append(ds.field('exchange').isin(sorted({_exchange_of(code) for code in std_codes})))
+    if from_date:
+        from_int = format_date_input_to_int(from_date)
+        filters.append(ds.field('date') >= from_int)
+        if 'year' in names:
+            filters.append(ds.field('year') >= from_int // 10000)
+    if to_date:
+        to_int = format_date_input_to_int(to_date)
+        filters.append(ds.field('date') <= to_int)
+        if 'year' in names:
+            filters.append(ds.field('year') <= to_int // 10000)
+
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+
+    load_columns = ['code', 'date', *(columns if columns is not None else BAR_STORE_FIELDS)]
+    table = dataset.to_table(columns=load_columns, filter=expression)
+    if table.num_rows == 0:
+        return pd.DataFrame()
+
+    # dictionary columns cannot be sort keys, sort on the decoded codes instead
+    order = pc.sort_indices(
+        pa.table({'code': table.column('code').cast(pa.string()), 'date': table.column('date')}),
+        sort_keys=[('code', 'ascending'), ('date', 'ascending')]
+    )
+    table = table.take(order)
+    dates = int_dates_to_datetime(table.column('date').to_numpy())
+    table = table.set_column(table.schema.get_field_index('date'), 'date', pa.array(dates, pa.timestamp('ns')))
+
+    if arrow_dtypes:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    df = table.to_pandas()
+    df['code'] = df['code'].astype(str)
+    return df
+
+if __name__ == "__main__":
+    export_daily_bars_to_parquet(partition_by="year")
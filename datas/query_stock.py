@@ -5,15 +5,214 @@ from pathlib import Path
 import json
 from tools.log import get_fetch_logger
 from tools.stock_tools import to_std_code
-from tools.times import ms_timestamp_to_date, format_date_input_to_yyyy_mm_dd
+from tools.times import ms_timestamp_to_date, format_date_input_to_int, int_dates_to_datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional, Any
+from typing import Optional, Any, Sequence
 from datetime import datetime
-from datas.create_database import DB_PATH, DAILY_BAR_TABLE, EARLIEST_DATE, STOCK_INFO_TABLE, get_db_connection
+from datas.create_database import DAILY_BAR_TABLE, BAR_COVERAGE_TABLE, BAR_STORE_FIELDS, EARLIEST_DATE, STOCK_INFO_TABLE, get_read_connection
+from datas.bar_store import get_bar_store
+from datas.trade_calendar import get_trade_calendar
 from contextlib import closing
+from collections import OrderedDict
+import threading
+import time
 
 logger = get_fetch_logger()
 
+# above this many codes query_panel scans the date range instead of binding an IN list
+PANEL_MAX_IN_CODES = 900
+
+# memory bound of the per-process bar window cache
+BAR_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# seconds between checks of stock_base_info for changes
+STOCK_INFO_CACHE_TTL = 60
+# short stock_base_info columns kept in memory, the long text columns are read on demand
+STOCK_INFO_BRIEF_COLUMNS = ['code', 'exchange_code', 'exchange_name', 'name', 'classi_name', 'list_date', 'idn_code', 'idn_name']
+
+# Statement text is built once so sqlite3's per-connection statement cache gets hits
+_SQL_DAILY_BARS = {
+    (has_from, has_to): (
+        f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ?"
+        + (" AND date >= ?" if has_from else "")
+        + (" AND date <= ?" if has_to else "")
+        + " ORDER BY date ASC"
+    )
+    for has_from in (False, True)
+    for has_to in (False, True)
+}
+_SQL_BARS_BY_DAYS = f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ? AND date <= ? ORDER BY date DESC LIMIT ?"
+_SQL_LATEST_BARS = f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ? ORDER BY date DESC LIMIT ?"
+_SQL_LATEST_DATE = f"SELECT MAX(date) FROM {DAILY_BAR_TABLE} WHERE code = ?"
+_SQL_COVERAGE_LATEST_DATE = f"SELECT last_date FROM {BAR_COVERAGE_TABLE} WHERE code = ?"
+_SQL_COVERAGE_LATEST_DATES = f"SELECT code, last_date FROM {BAR_COVERAGE_TABLE}"
+_SQL_COVERAGE_MAX_WRITE_SEQ = f"SELECT MAX(write_seq) FROM {BAR_COVERAGE_TABLE}"
+_SQL_COVERAGE_WRITTEN_SINCE = f"SELECT code FROM {BAR_COVERAGE_TABLE} WHERE write_seq > ?"
+_SQL_LATEST_ADJ_FACTOR = (
+    f"SELECT b.adj_factor FROM {BAR_COVERAGE_TABLE} c "
+    f"JOIN {DAILY_BAR_TABLE} b ON b.code = c.code AND b.date = c.last_date WHERE c.code = ?"
+)
+
+_daily_bar_table_exists = False
+
+class BarCache:
+    """
+    LRU cache of recent bar windows, keyed by (code, to_date) and holding the largest
+    `days` window read so far. A request for fewer days is answered from the tail of the
+    cached window. Eviction is by the frames' memory footprint.
+
+    Every hit returns a copy, so callers may add columns freely.
+
+    Writers in this process invalidate() what they wrote. Writes of other processes are
+    picked up by sync_bar_cache() before every lookup.
+    """
+    def __init__(self, max_bytes: int = BAR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, Optional[int]], tuple[int, pd.DataFrame, int]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def version(self, code: str) -> int:
+        with self._lock:
+            return self._versions.get(code, 0)
+
+    def get(self, code: str, to_date: Optional[int], days: int) -> Optional[pd.DataFrame]:
+        key = (code, to_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            # a window shorter than requested means the code has no older bars
+            if entry is None or (entry[0] < days and len(entry[1]) == entry[0]):
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            df = entry[1]
+        out = df.iloc[-days:].copy() if days < len(df) else df.copy()
+        out.index = pd.RangeIndex(len(out))
+        return out
+
+    def put(self, code: str, to_date: Optional[int], days: int, df: pd.DataFrame, version: int):
+        """Cache a window read while the code was at `version`; stale reads are dropped."""
+        if df.empty:
+            return
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        key = (code, to_date)
+        with self._lock:
+            if self._versions.get(code, 0) != version:
+                return
+            old = self._entries.get(key)
+            if old is not None:
+                if old[0] >= days:
+                    return
+                self._bytes -= old[2]
+            self._entries[key] = (days, df.copy(), size)
+            self._entries.move_to_end(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._stats['evictions'] += 1
+
+    def invalidate(self, code: Optional[str] = None, from_date: Optional[int] = None):
+        """
+        Drop cached windows of `code` (all codes if None) that can contain bars dated
+        on or after from_date (yyyymmdd); windows ending before it are still valid.
+        """
+        with self._lock:
+            if code is None:
+                self._entries.clear()
+                self._bytes = 0
+                self._versions = {c: v + 1 for c, v in self._versions.items()}
+                self._stats['invalidations'] += 1
+                return
+            self._versions[code] = self._versions.get(code, 0) + 1
+            for key in [k for k in self._entries if k[0] == code]:
+                if from_date is None or key[1] is None or key[1] >= from_date:
+                    self._bytes -= self._entries.pop(key)[2]
+                    self._stats['invalidations'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+_bar_cache = BarCache()
+
+def bar_cache_stats() -> dict:
+    """
+    Get bar cache counters: hits, misses, evictions, invalidations, entries, bytes, hit_rate.
+    """
+    return _bar_cache.stats()
+
+def invalidate_bar_cache(code: Optional[str] = None, from_date: Optional[int] = None):
+    """
+    Drop cached bar windows after `code` was written from `from_date` (yyyymmdd) on.
+    With no arguments the whole cache is cleared.
+    """
+    _bar_cache.invalidate(code, from_date)
+
+_synced_write_seq: Optional[int] = None
+_sync_lock = threading.Lock()
+
+def sync_bar_cache():
+    """
+    Drop cached windows of codes written by any process since the last call.
+
+    Every bar write refreshes the code's bar_coverage row with a new, larger write_seq
+    (see refresh_bar_coverage()), so one indexed MAX(write_seq) read tells whether
+    anything was written, and the codes written since are the rows above the last seen
+    value. The first call clears the cache.
+    """
+    global _synced_write_seq
+    conn = get_read_connection()
+    try:
+        current = conn.execute(_SQL_COVERAGE_MAX_WRITE_SEQ).fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        # bar_coverage not created yet, only this process' writers invalidate
+        return
+    with _sync_lock:
+        seen = _synced_write_seq
+        if current == seen:
+            return
+        _synced_write_seq = current
+    if seen is None or current < seen:
+        # first sync, or the table was recreated
+        _bar_cache.invalidate()
+        return
+    for (code,) in conn.execute(_SQL_COVERAGE_WRITTEN_SINCE, (seen,)).fetchall():
+        _bar_cache.invalidate(code)
+
+def _read_bars(query: str, params) -> pd.DataFrame:
+    """Run a bar query on the thread's read connection and turn yyyymmdd dates into datetimes."""
+    df = pd.read_sql_query(query, get_read_connection(), params=params)
+    if not df.empty:
+        df['date'] = int_dates_to_datetime(df['date'].to_numpy())
+    return df
+
+def daily_bar_table_exists() -> bool:
+    """
+    Check whether the daily bar table exists. A positive answer is cached for the
+    lifetime of the process, so sqlite_master is probed only until the table shows up.
+    """
+    global _daily_bar_table_exists
+    if _daily_bar_table_exists:
+        return True
+
+    row = get_read_connection().execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+        (DAILY_BAR_TABLE,)
+    ).fetchone()
+    _daily_bar_table_exists = row is not None
+    return _daily_bar_table_exists
+
 def query_daily_bars(
     code: str,
     from_date: Optional[str] = None,
@@ -30,38 +229,32 @@ def query_daily_bars(
     Returns:
         pd.DataFrame with daily bars, sorted by date; or None if no data found
     """
-    conn = None
     try:
         std_code = to_std_code(code)
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
 
-        # Check if table exists
-        cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name=?", 
-            (DAILY_BAR_TABLE,)
-        )
-        if cursor.fetchone() is None:
+        store = get_bar_store()
+        if store is not None:
+            return store.daily_bars(
+                std_code,
+                from_date=pd.to_datetime(from_date) if from_date else None,
+                to_date=pd.to_datetime(to_date) if to_date else None,
+            )
+
+        if not daily_bar_table_exists():
             logger.warning(f"Table '{DAILY_BAR_TABLE}' does not exist in database.")
             return pd.DataFrame()
         
-        query = f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ?"
+        query = _SQL_DAILY_BARS[(bool(from_date), bool(to_date))]
         params: list[Any] = [std_code]
 
         if from_date:
-            formatted_from = format_date_input_to_yyyy_mm_dd(from_date)
-            query += " AND date >= ?"
-            params.append(formatted_from)
+            params.append(format_date_input_to_int(from_date))
 
         if to_date:
-            formatted_to = format_date_input_to_yyyy_mm_dd(to_date)
-            query += " AND date <= ?"
-            params.append(formatted_to)
-
-        query += " ORDER BY date ASC"
+            params.append(format_date_input_to_int(to_date))
 
         # Execute query
-        df = pd.read_sql_query(query, conn, params=params, parse_dates=['date'])
+        df = _read_bars(query, params)
 
         if df.empty:
             logger.info(f"No daily bar data found for {std_code} between {from_date} and {to_date}")
@@ -72,9 +265,6 @@ def query_daily_bars(
     except Exception as e:
         logger.error(f"❌ Error querying daily bar data for {code}: {e}", exc_info=True)
         return pd.DataFrame()
-    finally:
-        if conn:
-            conn.close()
             
 def query_bars_by_days(
     code: str,
@@ -95,7 +285,9 @@ def query_bars_by_days(
     if days < 1:
         raise ValueError(f"days must be at least 1, got {days}")
 
-    conn = None
+    if not to_date:
+        return query_latest_bars(code, days)
+
     try:
         std_code = to_std_code(code)
     except Exception as e:
@@ -103,52 +295,40 @@ def query_bars_by_days(
         return pd.DataFrame()
 
     try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        params: list[Any] = [std_code]
-
-        query = f"""
-        SELECT *
-        FROM {DAILY_BAR_TABLE}
-        WHERE code = ?
-        """
+        # no bars exist on closed days, so a weekend or holiday to_date shares the window
+        # (and the cache entry) of the trading day before it
+        to_int = get_trade_calendar().prev_trading_day(format_date_input_to_int(to_date), 0)
+    except Exception as e:
+        logger.warning(f"Invalid to_date '{to_date}': {e}")
+        return pd.DataFrame()
 
-        if to_date:
-            formatted_to = format_date_input_to_yyyy_mm_dd(to_date)
-            query += " AND date <= ?"
-            params.append(formatted_to)
+    sync_bar_cache()
+    cached = _bar_cache.get(std_code, to_int, days)
+    if cached is not None:
+        return cached
+    version = _bar_cache.version(std_code)
 
-        query += """
-        ORDER BY date DESC
-        LIMIT ?
-        """
-        params.append(days)
+    store = get_bar_store()
+    if store is not None:
+        df = store.bars_by_days(std_code, days, to_date=pd.to_datetime(str(to_int)))
+        _bar_cache.put(std_code, to_int, days, df, version)
+        return df
 
-        df = pd.read_sql_query(
-            query, conn,
-            params=tuple(params),
-            parse_dates=['date']
-        )
+    try:
+        df = _read_bars(_SQL_BARS_BY_DAYS, (std_code, to_int, days))
 
         if df.empty:
             logger.info(f"No data found for {std_code} in last {days} days up to {to_date}.")
             return pd.DataFrame()
 
-        result = df[::-1].reset_index(drop=True)
-
-        if result.empty:
-            return pd.DataFrame()
-
-        return result
+        df = df[::-1].reset_index(drop=True)
+        _bar_cache.put(std_code, to_int, days, df, version)
+        return df
 
     except Exception as e:
         logger.error(f"❌ Failed to query last {days} bars for {std_code}: {e}", exc_info=True)
         return pd.DataFrame()
 
-    finally:
-        if conn:
-            conn.close()
-
 def query_latest_bars(
     code: str,
     n: int = 1
@@ -166,48 +346,197 @@ def query_latest_bars(
     if n < 1:
         raise ValueError(f"n must be at least 1, got {n}")
 
-    conn = None
     try:
         std_code = to_std_code(code)
     except Exception as e:
         logger.warning(f"Invalid stock code '{code}': {e}")
         return pd.DataFrame()
 
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        query = f"""
-        SELECT *
-        FROM {DAILY_BAR_TABLE}
-        WHERE code = ?
-        ORDER BY date DESC
-        LIMIT ?
-        """
+    sync_bar_cache()
+    cached = _bar_cache.get(std_code, None, n)
+    if cached is not None:
+        return cached
+    version = _bar_cache.version(std_code)
 
-        df = pd.read_sql_query(
-            query, conn,
-            params=(std_code, n),
-            parse_dates=['date']
-        )
+    store = get_bar_store()
+    if store is not None:
+        df = store.bars_by_days(std_code, n)
+        _bar_cache.put(std_code, None, n, df, version)
+        return df
+
+    try:
+        df = _read_bars(_SQL_LATEST_BARS, (std_code, n))
 
         if df.empty:
             logger.info(f"No data found for {std_code} in latest {n} days.")
             return pd.DataFrame()
 
-        result = df[::-1].reset_index(drop=True)
-
-        if result.empty:
-            return pd.DataFrame()
-
-        return result
+        df = df[::-1].reset_index(drop=True)
+        _bar_cache.put(std_code, None, n, df, version)
+        return df
 
     except Exception as e:
         logger.error(f"❌ Failed to query latest {n} bars for {std_code}: {e}", exc_info=True)
         return pd.DataFrame()
 
-    finally:
-        if conn:
-            conn.close()
+def query_recent_trade_dates(
+    n: int,
+    to_date: Optional[str] = None
+) -> list[pd.Timestamp]:
+    """
+    Query the latest N distinct trading dates present in the daily bar table.
+
+    Args:
+        n (int): Number of trading dates. Must be >= 1.
+        to_date (str, optional): Only consider dates <= to_date (YYYYMMDD or YYYY-MM-DD).
+
+    Returns:
+        list of pd.Timestamp sorted ascending
+    """
+    if n < 1:
+        raise ValueError(f"n must be at least 1, got {n}")
+
+    query = f"SELECT DISTINCT date FROM {DAILY_BAR_TABLE}"
+    params: list[Any] = []
+    if to_date:
+        query += " WHERE date <= ?"
+        params.append(format_date_input_to_int(to_date))
+    query += " ORDER BY date DESC LIMIT ?"
+    params.append(n)
+
+    rows = get_read_connection().execute(query, params).fetchall()
+
+    return sorted(pd.to_datetime(int_dates_to_datetime([row[0] for row in rows])))
+
+def query_bars_by_days_bulk(
+    codes: list,
+    days: int,
+    to_date: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    The last `days` bars up to to_date of many codes as one long frame sorted by code and
+    date, what query_bars_by_days returns per code, concatenated.
+
+    Bypasses the bar window cache: it is meant for loading a universe once (e.g. into a
+    shared memory panel), where caching every window would only cost memory. Reads the bar
+    store when it is fresh, else one cursor runs the per-code range query for every code.
+
+    Args:
+        codes (list): Stock codes in any format accepted by to_std_code
+        days (int): Bars per code. Must be >= 1.
+        to_date (str, optional): End date (YYYYMMDD or YYYY-MM-DD), latest bars if None
+
+    Returns:
+        pd.DataFrame with the columns of the bar table; codes without bars are missing
+    """
+    if days < 1:
+        raise ValueError(f"days must be at least 1, got {days}")
+
+    std_codes = []
+    for code in codes:
+        try:
+            std_codes.append(to_std_code(code))
+        except Exception as e:
+            logger.warning(f"Invalid stock code '{code}': {e}")
+    std_codes = list(dict.fromkeys(std_codes))
+    to_int = get_trade_calendar().prev_trading_day(format_date_input_to_int(to_date), 0) if to_date else None
+
+    store = get_bar_store()
+    if store is not None:
+        to_ts = pd.to_datetime(str(to_int)) if to_int else None
+        frames = [store.bars_by_days(code, days, to_date=to_ts) for code in std_codes if code in store]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    if not std_codes or not daily_bar_table_exists():
+        return pd.DataFrame()
+    cursor = get_read_connection().cursor()
+    rows = []
+    for code in std_codes:
+        if to_int:
+            window = cursor.execute(_SQL_BARS_BY_DAYS, (code, to_int, days)).fetchall()
+        else:
+            window = cursor.execute(_SQL_LATEST_BARS, (code, days)).fetchall()
+        window.reverse()
+        rows += window
+    columns = [col[0] for col in cursor.description]
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    if not df.empty:
+        df['date'] = int_dates_to_datetime(df['date'].to_numpy())
+    return df
+
+def query_panel(
+    codes: Optional[list] = None,
+    fields: Sequence[str] = ('close',),
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> dict[str, pd.DataFrame]:
+    """
+    Query daily bars of many stocks with one date-range scan and pivot them into
+    aligned wide frames.
+
+    Args:
+        codes (list, optional): Stock codes in any format accepted by to_std_code. None means all codes.
+        fields (Sequence[str]): Bar columns to load, e.g. ['close', 'volume'], any of BAR_STORE_FIELDS
+        from_date (str, optional): Start date (YYYYMMDD or YYYY-MM-DD)
+        to_date (str, optional): End date (YYYYMMDD or YYYY-MM-DD)
+
+    Returns:
+        dict mapping each field to a DataFrame indexed by trading date (ascending) with one
+        column per code. All frames share the same index and columns; NaN means no bar
+        (suspended or not listed yet).
+
+    Raises:
+        ValueError: a field is not a bar column, fields go into the SQL as identifiers
+    """
+    fields = list(fields)
+    unknown = [field for field in fields if field not in BAR_STORE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unsupported fields: {unknown}. Choose from {list(BAR_STORE_FIELDS)}.")
+    std_codes: Optional[list[str]] = None
+    if codes is not None:
+        std_codes = []
+        for code in codes:
+            try:
+                std_codes.append(to_std_code(code))
+            except Exception as e:
+                logger.warning(f"Invalid stock code '{code}': {e}")
+        std_codes = list(dict.fromkeys(std_codes))
+        if not std_codes:
+            return {field: pd.DataFrame() for field in fields}
+
+    query = f"SELECT code, date, {', '.join(fields)} FROM {DAILY_BAR_TABLE} WHERE 1 = 1"
+    params: list[Any] = []
+
+    if from_date:
+        query += " AND date >= ?"
+        params.append(format_date_input_to_int(from_date))
+    if to_date:
+        query += " AND date <= ?"
+        params.append(format_date_input_to_int(to_date))
+
+    # small pools go through the (code, date) primary key, large ones scan the date range once
+    filter_after = std_codes is not None and len(std_codes) > PANEL_MAX_IN_CODES
+    if std_codes is not None and not filter_after:
+        query += f" AND code IN ({','.join('?' for _ in std_codes)})"
+        params.extend(std_codes)
+
+    try:
+        df = _read_bars(query, params)
+    except Exception as e:
+        logger.error(f"❌ Failed to query panel {fields} between {from_date} and {to_date}: {e}", exc_info=True)
+        return {field: pd.DataFrame() for field in fields}
+
+    if filter_after:
+        df = df[df['code'].isin(std_codes)]
+
+    if df.empty:
+        logger.info(f"No panel data found between {from_date} and {to_date}.")
+        return {field: pd.DataFrame() for field in fields}
+
+    wide = df.pivot(index='date', columns='code', values=fields).sort_index()
+    present = set(df['code'].unique())
+    columns = [code for code in std_codes if code in present] if std_codes is not None else sorted(present)
+    return {field: wide[field].reindex(columns=columns) for field in fields}
 
 def get_latest_date_by_code(
     code: str
@@ -227,45 +556,241 @@ def get_latest_date_by_code(
     earliest_date = pd.to_datetime(EARLIEST_DATE)
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            query = f"SELECT MAX(date) FROM {DAILY_BAR_TABLE} WHERE code = ?"
-            result = conn.execute(query, (std_code,)).fetchone()
-
-            if result[0] is not None:
-                latest_date = pd.to_datetime(result[0])
-                return latest_date
-            return earliest_date
+        conn = get_read_connection()
+        try:
+            result = conn.execute(_SQL_COVERAGE_LATEST_DATE, (std_code,)).fetchone()
+        except sqlite3.OperationalError:
+            # bar_coverage not created yet, probe the bar table
+            result = conn.execute(_SQL_LATEST_DATE, (std_code,)).fetchone()
+
+        if result is not None and result[0] is not None:
+            latest_date = pd.to_datetime(str(result[0]), format="%Y%m%d")
+            return latest_date
+        return earliest_date
 
     except Exception as e:
         return earliest_date
 
-def get_stock_info_by_code(code: str) -> pd.DataFrame:
+def get_latest_dates(codes: Optional[list] = None) -> dict[str, pd.Timestamp]:
     """
-    Get stock information for a single stock code.
+    Get the latest stored bar date of many codes with one query on bar_coverage.
+
+    Args:
+        codes: stock codes in any format accepted by to_std_code; None means every stored code
+
+    Returns:
+        dict: {std_code: latest date}, codes without any bars are left out
+    """
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(_SQL_COVERAGE_LATEST_DATES).fetchall()
+    except sqlite3.OperationalError:
+        logger.warning(f"{BAR_COVERAGE_TABLE} is missing, run prepare_database(). Falling back to MAX(date) per code.")
+        try:
+            rows = conn.execute(f"SELECT code, MAX(date) FROM {DAILY_BAR_TABLE} GROUP BY code").fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    if not rows:
+        return {}
+
+    dates = int_dates_to_datetime([row[1] for row in rows])
+    latest = {row[0]: pd.Timestamp(date) for row, date in zip(rows, dates)}
+    if codes is None:
+        return latest
+
+    result = {}
+    for code in codes:
+        try:
+            std_code = to_std_code(code)
+        except Exception as e:
+            logger.warning(f"Invalid stock code '{code}': {e}")
+            continue
+        if std_code in latest:
+            result[std_code] = latest[std_code]
+    return result
+
+class StockInfoCache:
+    """
+    In-memory copy of the short stock_base_info columns, {code: row tuple}.
+
+    The table is reloaded when its (COUNT(*), MAX(rowid)) fingerprint changes, checked at
+    most once per `ttl` seconds. INSERT OR REPLACE gives rewritten rows a new rowid, so
+    refreshes are picked up. Long text columns are read per code on first use and kept
+    until the next reload.
+    """
+    def __init__(self, ttl: float = STOCK_INFO_CACHE_TTL):
+        self.ttl = ttl
+        self.columns: list[str] = []
+        self._rows: dict[str, tuple] = {}
+        self._details: dict[str, tuple] = {}
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._fingerprint is not None and time.monotonic() - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            if self._fingerprint is not None and time.monotonic() - self._checked_at < self.ttl:
+                return
+            conn = get_read_connection()
+            try:
+                fingerprint = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {STOCK_INFO_TABLE}").fetchone()
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({STOCK_INFO_TABLE})")]
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Failed to load {STOCK_INFO_TABLE}: {e}")
+                fingerprint, columns = (0, None), []
+            if fingerprint != self._fingerprint:
+                rows = conn.execute(f"SELECT {', '.join(STOCK_INFO_BRIEF_COLUMNS)} FROM {STOCK_INFO_TABLE}").fetchall() if columns else []
+                self.columns = columns
+                self._rows = {row[0]: row for row in rows}
+                self._details = {}
+                self._fingerprint = fingerprint
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._fingerprint = None
+
+    def brief(self, std_code: str) -> Optional[dict]:
+        self._refresh()
+        row = self._rows.get(std_code)
+        return dict(zip(STOCK_INFO_BRIEF_COLUMNS, row)) if row is not None else None
+
+    def frame(self, std_codes: list[str], brief: bool = True) -> pd.DataFrame:
+        """Rows of std_codes in the given order, unknown codes left out."""
+        self._refresh()
+        rows = [self._rows[code] for code in std_codes if code in self._rows]
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows, columns=STOCK_INFO_BRIEF_COLUMNS)
+        if not brief:
+            long_columns = [col for col in self.columns if col not in STOCK_INFO_BRIEF_COLUMNS]
+            details = self._load_details([row[0] for row in rows], long_columns)
+            for i, col in enumerate(long_columns):
+                df[col] = [details.get(code, (None,) * len(long_columns))[i] for code in df['code']]
+            df = df[self.columns]
+        return df.set_index('code')
+
+    def _load_details(self, std_codes: list[str], long_columns: list[str]) -> dict[str, tuple]:
+        missing = [code for code in std_codes if code not in self._details]
+        for i in range(0, len(missing), PANEL_MAX_IN_CODES):
+            chunk = missing[i:i + PANEL_MAX_IN_CODES]
+            placeholders = ','.join('?' for _ in chunk)
+            rows = get_read_connection().execute(
+                f"SELECT code, {', '.join(long_columns)} FROM {STOCK_INFO_TABLE} WHERE code IN ({placeholders})",
+                chunk
+            ).fetchall()
+            for row in rows:
+                self._details[row[0]] = row[1:]
+        return {code: self._details[code] for code in std_codes if code in self._details}
+
+_stock_info_cache = StockInfoCache()
+
+def invalidate_stock_info_cache():
+    """
+    Force the stock info cache to re-check stock_base_info on the next lookup.
+    """
+    _stock_info_cache.invalidate()
+
+def get_stock_brief(code: str) -> Optional[dict]:
+    """
+    Get the short stock info fields (name, exchange, industry, ...) of a code from memory.
+
+    Returns:
+        dict keyed by STOCK_INFO_BRIEF_COLUMNS, or None if the code is unknown
     """
     try:
         std_code = to_std_code(code)
     except Exception as e:
         logger.warning(f"Invalid stock code '{code}': {e}")
-        return pd.DataFrame()
+        return None
+    return _stock_info_cache.brief(std_code)
 
-    query = f"SELECT * FROM {STOCK_INFO_TABLE} WHERE code = ?"
-    with get_db_connection() as conn:
-        df = pd.read_sql_query(query, conn, params=(std_code,))
+def format_stock_brief(code: str) -> str:
+    """
+    Same text as format_stock_info(..., level='brief'), built from the in-memory cache.
+    """
+    info = get_stock_brief(code)
+    if info is None:
+        return "❌ No stock info found"
+    safe = lambda x: str(x) if x is not None else ""
+    return f"{safe(info['name'])} ({info['code']}) — {safe(info['idn_name'])}"
 
-    if df.empty:
-        return pd.DataFrame()
-    
-    df.set_index('code', inplace=True)
+def get_latest_adj_factors() -> dict[str, Optional[float]]:
+    """
+    Get the adj factor on every code's latest stored bar, i.e. the factor its qfq prices
+    are based on. None for history stored before adj factors were kept.
+    """
+    try:
+        rows = get_read_connection().execute(
+            f"""
+            SELECT c.code, b.adj_factor
+            FROM {BAR_COVERAGE_TABLE} c JOIN {DAILY_BAR_TABLE} b ON b.code = c.code AND b.date = c.last_date
+            """
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Failed to read adj factors: {e}")
+        return {}
+    return dict(rows)
+
+def adjust_bars(df: pd.DataFrame, adjust: str = "hfq") -> pd.DataFrame:
+    """
+    Convert stored (qfq) bars of one code to another price basis using adj_factor.
+
+    Stored prices are raw * adj_factor / ref, where ref is the factor on the code's
+    latest stored row. Raw prices divide that back out and hfq (后复权) prices are
+    raw * adj_factor = qfq * ref.
+
+    Args:
+        df: bars of one code as returned by the query_* functions
+        adjust: "qfq" (unchanged), "hfq", or "" for raw prices
+
+    Returns:
+        a new DataFrame; rows without adj_factor are returned unchanged
+    """
+    if adjust not in {"qfq", "hfq", ""}:
+        raise ValueError(f"Unsupported adjust: {adjust}. Choose from 'qfq', 'hfq', ''.")
+    df = df.copy()
+    if adjust == "qfq" or df.empty or 'adj_factor' not in df.columns:
+        return df
+
+    row = get_read_connection().execute(_SQL_LATEST_ADJ_FACTOR, (df['code'].iloc[0],)).fetchone()
+    if row is None or row[0] is None:
+        return df
+    ref = row[0]
+
+    if adjust == "hfq":
+        ratio = pd.Series(ref, index=df.index).where(df['adj_factor'].notna(), 1.0)
+    else:
+        ratio = (ref / df['adj_factor']).fillna(1.0)
+    for col in ('open', 'close', 'high', 'low', 'price_change'):
+        if col in df.columns:
+            df[col] = df[col] * ratio
     return df
 
+def get_stock_info_by_code(code: str, brief: bool = False) -> pd.DataFrame:
+    """
+    Get stock information for a single stock code.
+
+    Args:
+        code: stock code
+        brief: only return STOCK_INFO_BRIEF_COLUMNS, served from memory
+    """
+    try:
+        std_code = to_std_code(code)
+    except Exception as e:
+        logger.warning(f"Invalid stock code '{code}': {e}")
+        return pd.DataFrame()
+
+    return _stock_info_cache.frame([std_code], brief=brief)
+
 def get_stock_info_by_name(name: str) -> pd.DataFrame:
     """
     Get stock information for a single stock name.
     """
     query = f"SELECT * FROM {STOCK_INFO_TABLE} WHERE name = ?"
-    with get_db_connection() as conn:
-        df = pd.read_sql_query(query, conn, params=(name,))
+    df = pd.read_sql_query(query, get_read_connection(), params=(name,))
 
     if df.empty:
         return pd.DataFrame()
@@ -279,8 +804,7 @@ def get_stock_code_by_name(name: str) -> Optional[str]:
     """
     query = f"SELECT code FROM {STOCK_INFO_TABLE} WHERE name LIKE ?"
     # 注意：参数中加入通配符，而不是拼进 SQL 语句
-    with get_db_connection() as conn:
-        result = conn.execute(query, (f"%{name}%",)).fetchone()
+    result = get_read_connection().execute(query, (f"%{name}%",)).fetchone()
 
     return result[0] if result else None  # 更简洁的写法
 
@@ -325,9 +849,13 @@ def format_stock_info(df: pd.DataFrame, level: str = "medium") -> str:
     else:
         raise ValueError("level must be 'brief', 'medium', or 'detailed'")
 
-def get_stock_info_by_codes(codes: list) -> pd.DataFrame:
+def get_stock_info_by_codes(codes: list, brief: bool = False) -> pd.DataFrame:
     """
     Get stock information for multiple stock codes.
+
+    Args:
+        codes: stock codes
+        brief: only return STOCK_INFO_BRIEF_COLUMNS, served from memory without SQLite
     """
     std_codes = []
     for code in codes:
@@ -341,21 +869,14 @@ def get_stock_info_by_codes(codes: list) -> pd.DataFrame:
     if not std_codes:
         return pd.DataFrame()
 
-    placeholders = ','.join('?' for _ in std_codes)
-    query = f"SELECT * FROM {STOCK_INFO_TABLE} WHERE code IN ({placeholders})"
-    with get_db_connection() as conn:
-        df = pd.read_sql_query(query, conn, params=std_codes)
-
-    df.set_index('code', inplace=True)
-    return df
+    return _stock_info_cache.frame(std_codes, brief=brief)
 
 def query_all_stock_code_list() -> pd.Series:
     """
     Query all stock basic information from the database.
     """
     query = f"SELECT code, name FROM {STOCK_INFO_TABLE}"
-    with get_db_connection() as conn:
-        df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(query, get_read_connection())
 
     return df['code'].map(to_std_code)
     
@@ -0,0 +1,197 @@
+import uuid
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Iterable, Optional
+from tools.log import get_fetch_logger
+from datas.create_database import BAR_STORE_FIELDS
+from datas.bar_store import BAR_COLUMNS
+from datas.query_stock import query_bars_by_days_bulk
+
+logger = get_fetch_logger()
+
+# fields stored in the panel, prices and ratios are narrowed to `price_dtype`
+PANEL_FIELDS = tuple(BAR_STORE_FIELDS)
+_WIDE_FIELDS = {'volume': 'int64'}
+
+@dataclass(frozen=True)
+class PanelSpec:
+    """
+    What a process needs to attach to a SharedMarketPanel, small and picklable: the
+    shared memory block of every field plus the code -> rows index.
+    """
+    blocks: dict[str, tuple[str, str]]  # field -> (shared memory name, dtype)
+    rows: int
+    codes: tuple[str, ...]
+    offsets: tuple[int, ...]  # rows of codes[i] are offsets[i]:offsets[i + 1]
+
+class SharedMarketPanel:
+    """
+    The last `days` bars of a universe of codes in multiprocessing.shared_memory, one
+    block per field (dates as int64 nanoseconds), laid out code by code.
+
+    The creating process loads the bars once and owns the blocks; worker processes attach
+    with the spec and read zero-copy, read-only NumPy views, so N workers cost one copy of
+    the data instead of N SQLite reads of it.
+
+    Workers should be started through multiprocessing by the owner (fork or spawn), so they
+    share its resource tracker and the blocks live until the owner unlinks them.
+
+    Usage:
+        with SharedMarketPanel.create(codes, days=500) as panel:
+            ProcessPoolExecutor(initializer=attach_worker_panel, initargs=(panel.spec,)) ...
+
+        # in the worker
+        panel = SharedMarketPanel.attach(spec)
+        df = panel.frame("600000")
+    """
+    def __init__(self, spec: PanelSpec, blocks: dict[str, shared_memory.SharedMemory], owner: bool):
+        self.spec = spec
+        self.owner = owner
+        self._blocks = blocks
+        self._arrays = {}
+        for field, (_, dtype) in spec.blocks.items():
+            arr = np.ndarray((spec.rows,), dtype=dtype, buffer=blocks[field].buf)
+            arr.flags.writeable = False
+            self._arrays[field] = arr
+        self.index = {
+            code: (spec.offsets[i], spec.offsets[i + 1])
+            for i, code in enumerate(spec.codes)
+        }
+
+    @classmethod
+    def create(
+        cls,
+        codes: Iterable[str],
+        days: int = 500,
+        to_date: Optional[str] = None,
+        price_dtype: str = 'float32',
+    ) -> 'SharedMarketPanel':
+        """
+        Load the last `days` bars up to to_date of every code and copy them into new
+        shared memory blocks. Codes without bars are left out.
+
+        Args:
+            codes: the universe
+            days: bars per code
+            to_date: last date (YYYYMMDD or YYYY-MM-DD), latest bars if None
+            price_dtype: dtype of prices and ratios, 'float64' keeps them bit-identical to
+                the bar table
+        """
+        bars = query_bars_by_days_bulk(list(codes), days=days, to_date=to_date)
+        rows = len(bars)
+        if rows:
+            code_values = bars['code'].to_numpy(dtype=str)
+            starts = np.flatnonzero(np.r_[True, code_values[1:] != code_values[:-1]])
+            panel_codes = tuple(code_values[starts].tolist())
+        else:
+            starts, panel_codes = np.empty(0, dtype='int64'), ()
+        offsets = np.r_[starts, rows]
+
+        columns = {'date': bars['date'].to_numpy(dtype='datetime64[ns]').view('int64') if rows else np.empty(0, 'int64')}
+        for field in PANEL_FIELDS:
+            # bars read from an older table may lack a field, e.g. adj_factor
+            if field in _WIDE_FIELDS:
+                values = bars[field].fillna(0) if field in bars else np.zeros(rows)
+                columns[field] = np.asarray(values).astype(_WIDE_FIELDS[field])
+            else:
+                values = bars[field] if field in bars else np.full(rows, np.nan)
+                columns[field] = np.asarray(values, dtype='float64').astype(price_dtype)
+
+        prefix = f"panel_{uuid.uuid4().hex[:12]}"
+        blocks, spec_blocks = {}, {}
+        try:
+            for field, values in columns.items():
+                shm = shared_memory.SharedMemory(name=f"{prefix}_{field}", create=True, size=max(1, values.nbytes))
+                blocks[field] = shm
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+                spec_blocks[field] = (shm.name, values.dtype.str)
+        except BaseException:
+            for shm in blocks.values():
+                shm.close()
+                shm.unlink()
+            raise
+
+        spec = PanelSpec(
+            blocks=spec_blocks,
+            rows=rows,
+            codes=panel_codes,
+            offsets=tuple(int(o) for o in offsets),
+        )
+        size_mb = sum(shm.size for shm in blocks.values()) / 1024 / 1024
+        logger.info(f"🧠 Shared market panel: {rows} bars of {len(panel_codes)} codes, {size_mb:.1f} MB in {len(blocks)} blocks ({prefix}).")
+        return cls(spec, blocks, owner=True)
+
+    @classmethod
+    def attach(cls, spec: PanelSpec) -> 'SharedMarketPanel':
+        """Attach to the blocks of a panel created by another process."""
+        blocks = {field: shared_memory.SharedMemory(name=name) for field, (name, _) in spec.blocks.items()}
+        return cls(spec, blocks, owner=False)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def codes(self) -> tuple[str, ...]:
+        return self.spec.codes
+
+    def arrays(self, code: str) -> dict[str, np.ndarray]:
+        """Zero-copy, read-only views of every field of `code`, dates as int64 nanoseconds."""
+        lo, hi = self.index[code]
+        return {field: arr[lo:hi] for field, arr in self._arrays.items()}
+
+    def frame(self, code: str) -> pd.DataFrame:
+        """Bars of `code` sorted by date, with the columns of the bar table."""
+        if code not in self.index:
+            return pd.DataFrame()
+        lo, hi = self.index[code]
+        data = {
+            'code': np.full(hi - lo, code, dtype=object),
+            'date': self._arrays['date'][lo:hi].view('datetime64[ns]'),
+        }
+        for field in PANEL_FIELDS:
+            data[field] = self._arrays[field][lo:hi]
+        return pd.DataFrame(data, columns=BAR_COLUMNS, copy=False)
+
+    def close(self):
+        """Detach from the blocks; views handed out before must not be used afterwards."""
+        self._arrays = {}
+        for shm in self._blocks.values():
+            try:
+                shm.close()
+            except BufferError:
+                # a frame or view still references the block, it is released with them
+                pass
+
+    def unlink(self):
+        """Free the blocks (owner only), attached processes keep their mappings until they close."""
+        if not self.owner:
+            raise RuntimeError("Only the process that created the panel can unlink it.")
+        for shm in self._blocks.values():
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> 'SharedMarketPanel':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+_worker_panel: Optional[SharedMarketPanel] = None
+
+def attach_worker_panel(spec: PanelSpec):
+    """Process pool initializer: attach the panel once per worker, see worker_panel()."""
+    global _worker_panel
+    _worker_panel = SharedMarketPanel.attach(spec)
+
+def worker_panel() -> Optional[SharedMarketPanel]:
+    """The panel attached by attach_worker_panel() in this process, if any."""
+    return _worker_panel
@@ -1,4 +1,8 @@
 import akshare as ak
+import sqlite3
+import threading
+import time
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from tools.log import get_fetch_logger
@@ -9,19 +13,42 @@ from datetime import datetime, timedelta
 from tools.export import export_bars_to_csv
 from datas.query_stock import get_stock_info_by_code
 from tools.stock_tools import to_std_code
+from tools.response_cache import cached_call
+from tools.times import format_date_input_to_int
+from datas.create_database import INDEX_CONSTITUENTS_TABLE, STOCK_INFO_TABLE, create_index_constituents_table, get_db_connection, get_read_connection
 
 logger = get_fetch_logger()
 
 DATABASE_DIR = Path(__file__).parent.parent / "database"
 
-hs300_list_path = DATABASE_DIR / "hs300_stock_list.csv"
-csi500_list_path = DATABASE_DIR / "csi500_stock_list.csv"
-csi2000_list_path = DATABASE_DIR / "csi2000_stock_list.csv"
-csi_a500_list_path = DATABASE_DIR / "csi_a500_stock_list.csv"
+# index name -> index symbol used by ak.index_stock_cons and stored as index_code
+INDEXES = {
+    "hs300": "399300",
+    "csi500": "000905",
+    "csi2000": "932000",
+    "csi_a500": "000510",
+}
+
+# constituent lists of earlier versions, imported once into the database
+LEGACY_CSV_PATHS = {
+    "hs300": DATABASE_DIR / "hs300_stock_list.csv",
+    "csi500": DATABASE_DIR / "csi500_stock_list.csv",
+    "csi2000": DATABASE_DIR / "csi2000_stock_list.csv",
+    "csi_a500": DATABASE_DIR / "csi_a500_stock_list.csv",
+}
 dummy_path = DATABASE_DIR / ".dummy"
 
 update_interval_days = 30  # update every 30 days
 
+# seconds between checks of the constituent and stock tables for changes
+INDEX_MEMBERSHIP_TTL = 60
+
+column_mapping = {
+    "品种代码": "code",
+    "品种名称": "name",
+    "纳入日期": "list_date"
+}
+
 def needs_update(file_path: Path) -> bool:
     """Check if a file needs to be updated based on its modification time.
 
@@ -41,7 +68,7 @@ def needs_update(file_path: Path) -> bool:
 
 
 def update_index_stock_list(force_update: bool = False):
-    """Update index constituent stock lists (HS300 & CSI500) if needed.
+    """Update index constituent stock lists (INDEXES) if needed.
 
     Uses a dummy file's timestamp to track last update time. Skips update
     if within the interval unless `force_update` is True.
@@ -49,6 +76,7 @@ def update_index_stock_list(force_update: bool = False):
     Args:
         force_update: If True, bypass the time check and fetch fresh data.
     """
+    _import_legacy_csv_lists()
     if force_update or needs_update(dummy_path):
         fetch_index_stock_list()
     else:
@@ -56,123 +84,230 @@ def update_index_stock_list(force_update: bool = False):
 
 
 def fetch_index_stock_list():
-    """Fetch and save the latest HS300 and CSI500 constituent stock lists.
+    """Fetch the latest constituents of every index in INDEXES into the database.
 
-    Retrieves data via akshare, renames columns for consistency, saves to CSV,
-    and updates a dummy file's timestamp on success.
+    Each snapshot is diffed against the stored membership (see save_index_snapshot) and
+    the dummy file's timestamp is updated when every index succeeded.
     """
     done = True
-    column_mapping = {
-        "品种代码": "code",
-        "品种名称": "name",
-        "纳入日期": "list_date"
-    }
-    
-    logger.info("Updating HS300 lists...")
-    df_300 = ak.index_stock_cons(symbol="399300")
-    if not df_300.empty:
-        df_300 = df_300.rename(columns=column_mapping)
-        df_300.to_csv(hs300_list_path, index=False)
-        logger.info(f"Done with {len(df_300)} entries.")
-    else:
-        done = False
-
-    logger.info("Updating CSI500 lists...")
-    df_500 = ak.index_stock_cons(symbol="000905")
-    if not df_500.empty:
-        df_500 = df_500.rename(columns=column_mapping)
-        df_500.to_csv(csi500_list_path, index=False)
-        logger.info(f"Done with {len(df_500)} entries.")
-    else:
-        done = False
-        
-    logger.info("Updating CSI2000 lists...")
-    df_2000 = ak.index_stock_cons(symbol="932000")
-    if not df_2000.empty:
-        df_2000 = df_2000.rename(columns=column_mapping)
-        df_2000.to_csv(csi2000_list_path, index=False)
-        logger.info(f"Done with {len(df_2000)} entries.")
-    else:
-        done = False
-        
-    logger.info("Updating CSIA500 lists...")
-    df_a500 = ak.index_stock_cons(symbol="000510")
-    if not df_a500.empty:
-        df_a500 = df_a500.rename(columns=column_mapping)
-        df_a500.to_csv(csi_a500_list_path, index=False)
-        logger.info(f"Done with {len(df_a500)} entries.")
-    else:
-        done = False
+    for name, symbol in INDEXES.items():
+        logger.info(f"Updating {name} lists...")
+        try:
+            df = cached_call("akshare", "index_stock_cons", ak.index_stock_cons, kind="index_cons", symbol=symbol)
+        except Exception as e:
+            logger.error(f"Failed to fetch {name} constituents: {e}")
+            df = pd.DataFrame()
+        if not df.empty:
+            df = df.rename(columns=column_mapping)
+            added, removed = save_index_snapshot(symbol, df)
+            logger.info(f"Done with {len(df)} entries, {added} added, {removed} removed.")
+        else:
+            done = False
 
     if done:
         # Update the dummy file's timestamp to mark successful update
         dummy_path.touch()
 
+def save_index_snapshot(index_code: str, df: pd.DataFrame, snapshot_date: Optional[int] = None) -> tuple[int, int]:
+    """
+    Diff a constituent snapshot against the open membership rows of an index.
 
-def hs300_code_list() -> pd.Series:
-    """Get a pandas Series of HS300 constituent stock codes.
+    Codes no longer listed get out_date = snapshot_date. New codes are inserted with
+    their inclusion date (纳入日期) when the source gives one and the code was never a
+    member before, otherwise with snapshot_date. History therefore reaches back to the
+    inclusion dates of the members of the first snapshot, plus every change seen since.
 
-    Triggers an update if the local list is outdated or missing.
+    Args:
+        index_code: index symbol, e.g. "399300"
+        df: snapshot with 'code' and optionally 'list_date' columns
+        snapshot_date: yyyymmdd the snapshot is valid for, today if None
 
     Returns:
-        A Series containing stock codes (e.g., '600000'), or empty Series if failed.
+        (added, removed) member counts
     """
-    update_index_stock_list()
-    if hs300_list_path.exists():
-        df = pd.read_csv(hs300_list_path, dtype={"code": "string"})
-        return df["code"].map(to_std_code)
-    else:
-        logger.warning("HS300 stock list file does not exist.")
-        return pd.Series()
+    snapshot_date = snapshot_date or format_date_input_to_int(datetime.now())
+    list_dates = {}
+    for code, list_date in zip(df['code'].astype(str).map(to_std_code), df.get('list_date', pd.Series(None, index=df.index))):
+        try:
+            list_dates[code] = min(format_date_input_to_int(list_date), snapshot_date) if pd.notna(list_date) else snapshot_date
+        except Exception:
+            list_dates[code] = snapshot_date
 
+    create_index_constituents_table()
+    with get_db_connection() as conn:
+        current = {row[0] for row in conn.execute(
+            f"SELECT code FROM {INDEX_CONSTITUENTS_TABLE} WHERE index_code = ? AND out_date IS NULL", (index_code,)
+        )}
+        former = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT code FROM {INDEX_CONSTITUENTS_TABLE} WHERE index_code = ? AND out_date IS NOT NULL", (index_code,)
+        )}
+        removed = sorted(current - set(list_dates))
+        added = sorted(set(list_dates) - current)
+        conn.executemany(
+            f"UPDATE {INDEX_CONSTITUENTS_TABLE} SET out_date = ? WHERE index_code = ? AND code = ? AND out_date IS NULL",
+            [(snapshot_date, index_code, code) for code in removed]
+        )
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {INDEX_CONSTITUENTS_TABLE} (index_code, code, in_date, out_date) VALUES (?, ?, ?, NULL)",
+            [(index_code, code, snapshot_date if code in former else list_dates[code]) for code in added]
+        )
+        conn.commit()
+    invalidate_index_membership()
+    return len(added), len(removed)
 
-def csi500_code_list() -> pd.Series:
-    """Get a pandas Series of CSI500 constituent stock codes.
+_legacy_checked = False
 
-    Triggers an update if the local list is outdated or missing.
+def _import_legacy_csv_lists():
+    """Seed an empty constituent table from the CSV lists written by earlier versions."""
+    global _legacy_checked
+    if _legacy_checked:
+        return
+    _legacy_checked = True
+    create_index_constituents_table()
+    with get_db_connection() as conn:
+        if conn.execute(f"SELECT 1 FROM {INDEX_CONSTITUENTS_TABLE} LIMIT 1").fetchone():
+            return
+    for name, path in LEGACY_CSV_PATHS.items():
+        if path.exists():
+            df = pd.read_csv(path, dtype={"code": "string"})
+            snapshot_date = format_date_input_to_int(datetime.fromtimestamp(path.stat().st_mtime))
+            added, _ = save_index_snapshot(INDEXES[name], df, snapshot_date)
+            logger.info(f"Imported {added} {name} constituents from {path.name}.")
 
-    Returns:
-        A Series containing stock codes (e.g., '600000'), or empty Series if failed.
+class IndexMembership:
     """
-    update_index_stock_list()
-    if csi500_list_path.exists():
-        df = pd.read_csv(csi500_list_path, dtype={"code": "string"})
-        return df["code"].map(to_std_code)
-    else:
-        logger.warning("CSI500 stock list file does not exist.")
-        return pd.Series()
+    Index membership as boolean masks over a dense code universe.
 
-def csi2000_code_list() -> pd.Series:
-    """Get a pandas Series of CSI2000 constituent stock codes.
+    The universe is every code of stock_base_info and of the constituent table, sorted,
+    and a code's dense id is its position in `codes`. Masks are read-only arrays of
+    len(codes), so pool unions and intersections are `|` and `&`. Only combine masks of
+    the same IndexMembership object, a reload may change the universe.
+    """
+    def __init__(self, codes: np.ndarray, rows: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]], fingerprint=None):
+        self.codes = codes
+        self.ids = {code: i for i, code in enumerate(codes)}
+        self._rows = rows  # index_code -> (code ids, in dates, out dates with 0 = still a member)
+        self._masks: dict[tuple[str, Optional[int]], np.ndarray] = {}
+        self.fingerprint = fingerprint
+        self.loaded_at = time.monotonic()
 
-    Triggers an update if the local list is outdated or missing.
+    def mask(self, index: str, date=None) -> np.ndarray:
+        """
+        Members of `index` (a name of INDEXES or an index symbol), currently or as of
+        `date` (YYYYMMDD, YYYY-MM-DD, datetime or int yyyymmdd).
+        """
+        index_code = INDEXES.get(index, index)
+        d = None if date is None else (int(date) if isinstance(date, (int, np.integer)) else format_date_input_to_int(date))
+        key = (index_code, d)
+        mask = self._masks.get(key)
+        if mask is None:
+            ids, in_dates, out_dates = self._rows.get(index_code, (np.array([], dtype='int64'),) * 3)
+            if d is None:
+                live = out_dates == 0
+            else:
+                live = (in_dates <= d) & ((out_dates == 0) | (out_dates > d))
+            mask = np.zeros(len(self.codes), dtype=bool)
+            mask[ids[live]] = True
+            mask.setflags(write=False)
+            self._masks[key] = mask
+        return mask
 
-    Returns:
-        A Series containing stock codes (e.g., '600000'), or empty Series if failed.
+    def mask_of(self, codes) -> np.ndarray:
+        """Mask of arbitrary codes, codes outside the universe are ignored."""
+        mask = np.zeros(len(self.codes), dtype=bool)
+        mask[[self.ids[code] for code in codes if code in self.ids]] = True
+        return mask
+
+    def codes_of(self, mask: np.ndarray) -> pd.Series:
+        return pd.Series(self.codes[mask], dtype=object)
+
+_membership: Optional[IndexMembership] = None
+_membership_lock = threading.Lock()
+
+def _membership_fingerprint(conn) -> tuple:
+    try:
+        stocks = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {STOCK_INFO_TABLE}").fetchone()
+    except sqlite3.OperationalError:
+        stocks = (0, None)
+    try:
+        members = conn.execute(f"SELECT COUNT(*), COUNT(out_date) FROM {INDEX_CONSTITUENTS_TABLE}").fetchone()
+    except sqlite3.OperationalError:
+        members = (0, 0)
+    return (*stocks, *members)
+
+def get_index_membership() -> IndexMembership:
     """
-    update_index_stock_list()
-    if csi2000_list_path.exists():
-        df = pd.read_csv(csi2000_list_path, dtype={"code": "string"})
-        return df["code"].map(to_std_code)
-    else:
-        logger.warning("CSI2000 stock list file does not exist.")
-        return pd.Series()
+    Get the process-wide IndexMembership. The database is re-checked at most once per
+    INDEX_MEMBERSHIP_TTL seconds and reloaded when stock or constituent rows changed.
+    """
+    global _membership
+    membership = _membership
+    if membership is not None and time.monotonic() - membership.loaded_at < INDEX_MEMBERSHIP_TTL:
+        return membership
 
-def csi_a500_code_list() -> pd.Series:
-    """Get a pandas Series of CSIA500 constituent stock codes.
+    with _membership_lock:
+        conn = get_read_connection()
+        fingerprint = _membership_fingerprint(conn)
+        if _membership is not None and _membership.fingerprint == fingerprint:
+            _membership.loaded_at = time.monotonic()
+            return _membership
+
+        stock_codes = [row[0] for row in conn.execute(f"SELECT code FROM {STOCK_INFO_TABLE}")] if fingerprint[0] else []
+        rows = conn.execute(
+            f"SELECT index_code, code, in_date, COALESCE(out_date, 0) FROM {INDEX_CONSTITUENTS_TABLE}"
+        ).fetchall() if fingerprint[2] else []
+        codes = np.unique(np.array(stock_codes + [row[1] for row in rows], dtype='U6'))
+
+        by_index: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        if rows:
+            frame = pd.DataFrame(rows, columns=['index_code', 'code', 'in_date', 'out_date'])
+            frame['id'] = np.searchsorted(codes, frame['code'].to_numpy(dtype='U6'))
+            for index_code, group in frame.groupby('index_code'):
+                by_index[index_code] = (
+                    group['id'].to_numpy(dtype='int64'),
+                    group['in_date'].to_numpy(dtype='int64'),
+                    group['out_date'].to_numpy(dtype='int64'),
+                )
+        _membership = IndexMembership(codes, by_index, fingerprint)
+        return _membership
+
+def invalidate_index_membership():
+    """Force get_index_membership() to re-check the database on the next call."""
+    with _membership_lock:
+        if _membership is not None:
+            _membership.loaded_at = 0.0
+            _membership.fingerprint = None
 
-    Triggers an update if the local list is outdated or missing.
+def index_code_list(index: str, date=None) -> pd.Series:
+    """Constituent codes of `index` (a name of INDEXES), currently or as of `date`, sorted.
+
+    Triggers an update if the stored lists are outdated or missing.
 
     Returns:
         A Series containing stock codes (e.g., '600000'), or empty Series if failed.
     """
     update_index_stock_list()
-    if csi_a500_list_path.exists():
-        df = pd.read_csv(csi_a500_list_path, dtype={"code": "string"})
-        return df["code"].map(to_std_code)
-    else:
-        logger.warning("CSIA500 stock list file does not exist.")
-        return pd.Series()
+    membership = get_index_membership()
+    codes = membership.codes_of(membership.mask(index, date))
+    if codes.empty:
+        logger.warning(f"No {index} constituents stored.")
+    return codes
+
+def hs300_code_list() -> pd.Series:
+    """Get a pandas Series of HS300 constituent stock codes."""
+    return index_code_list("hs300")
+
+def csi500_code_list() -> pd.Series:
+    """Get a pandas Series of CSI500 constituent stock codes."""
+    return index_code_list("csi500")
+
+def csi2000_code_list() -> pd.Series:
+    """Get a pandas Series of CSI2000 constituent stock codes."""
+    return index_code_list("csi2000")
+
+def csi_a500_code_list() -> pd.Series:
+    """Get a pandas Series of CSIA500 constituent stock codes."""
+    return index_code_list("csi_a500")
 
 if __name__ == "__main__":
-    update_index_stock_list(force_update=True)
\ No newline at end of file
+    update_index_stock_list(force_update=True)
@@ -0,0 +1,173 @@
+import datetime
+import sqlite3
+import threading
+import numpy as np
+from typing import Optional
+from tools.log import get_fetch_logger
+from tools.stock_tools import MARKED_CLOSE_HOUR
+from tools.times import format_date_input_to_int, int_dates_to_datetime, datetime_to_int_dates
+from datas.create_database import TRADE_CALENDAR_TABLE, DAILY_BAR_TABLE, EARLIEST_DATE, get_db_connection, get_read_connection, create_trade_calendar_table
+
+logger = get_fetch_logger()
+
+def _as_int(date) -> int:
+    """yyyymmdd of an int, date, datetime, Timestamp or date string."""
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    if isinstance(date, datetime.date):
+        return date.year * 10000 + date.month * 100 + date.day
+    return format_date_input_to_int(date)
+
+class TradeCalendar:
+    """
+    SSE trading days as a sorted int64 array of yyyymmdd, every lookup is a binary search.
+
+    The calendar is authoritative up to `last`. Days after it (a stale stored calendar, or
+    one derived from stored bars) are assumed to be weekdays-only, the previous heuristic,
+    and appended on first use.
+    """
+    def __init__(self, dates: np.ndarray, last: int, source: str):
+        self.dates = np.asarray(dates, dtype='int64')
+        self.last = last
+        self.source = source
+        self.loaded_on = datetime.date.today()
+        self._lock = threading.Lock()
+
+    def _cover(self, d: int):
+        if d <= self.last:
+            return
+        with self._lock:
+            if d <= self.last:
+                return
+            start = int_dates_to_datetime([self.last]).astype('datetime64[D]')[0] + 1
+            days = np.arange(start, int_dates_to_datetime([d]).astype('datetime64[D]')[0] + 1)
+            weekdays = datetime_to_int_dates(days[np.is_busday(days)])
+            logger.warning(f"Trade calendar ({self.source}) ends at {self.last}, assuming weekdays up to {d} are trading days.")
+            self.dates = np.concatenate((self.dates, weekdays))
+            self.last = d
+
+    def is_trading_day(self, date) -> bool:
+        d = _as_int(date)
+        self._cover(d)
+        i = np.searchsorted(self.dates, d)
+        return bool(i < len(self.dates) and self.dates[i] == d)
+
+    def prev_trading_day(self, date, n: int = 1) -> int:
+        """
+        The n-th trading day before `date` as yyyymmdd; n=0 returns `date` itself when it
+        is a trading day, else the trading day before it.
+
+        Raises:
+            ValueError: if that day is before the start of the calendar
+        """
+        d = _as_int(date)
+        self._cover(d)
+        if n == 0:
+            i = np.searchsorted(self.dates, d, side='right') - 1
+        else:
+            i = np.searchsorted(self.dates, d, side='left') - n
+        if i < 0:
+            raise ValueError(f"{n} trading days before {d} is before the start of the calendar")
+        return int(self.dates[i])
+
+    def trading_days_between(self, start, end) -> np.ndarray:
+        """Trading days in [start, end] as an ascending int64 array of yyyymmdd."""
+        s, e = _as_int(start), _as_int(end)
+        self._cover(e)
+        return self.dates[np.searchsorted(self.dates, s, side='left'):np.searchsorted(self.dates, e, side='right')]
+
+    def latest_trade_day(self, now: Optional[datetime.datetime] = None) -> datetime.date:
+        """The latest trading day whose daily bars are published (after MARKED_CLOSE_HOUR)."""
+        now = now or datetime.datetime.now()
+        today = _as_int(now.date())
+        if now.hour >= MARKED_CLOSE_HOUR and self.is_trading_day(today):
+            d = today
+        else:
+            d = self.prev_trading_day(today)
+        return datetime.date(d // 10000, d // 100 % 100, d % 100)
+
+_calendar: Optional[TradeCalendar] = None
+_calendar_lock = threading.Lock()
+
+def _load_trade_calendar() -> TradeCalendar:
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(f"SELECT date, is_open FROM {TRADE_CALENDAR_TABLE} ORDER BY date").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    if rows:
+        dates = np.array([d for d, is_open in rows if is_open], dtype='int64')
+        return TradeCalendar(dates, rows[-1][0], "db")
+
+    # offline fallback: every day some stock has a bar on
+    try:
+        dates = np.array([row[0] for row in conn.execute(f"SELECT DISTINCT date FROM {DAILY_BAR_TABLE} ORDER BY date")], dtype='int64')
+    except sqlite3.OperationalError:
+        dates = np.array([], dtype='int64')
+    if len(dates):
+        logger.warning(f"No stored trade calendar, using the {len(dates)} dates of stored bars.")
+        return TradeCalendar(dates, int(dates[-1]), "bars")
+    logger.warning("No stored trade calendar or bars, assuming weekdays are trading days.")
+    return TradeCalendar(dates, _as_int(EARLIEST_DATE) - 1, "weekdays")
+
+def get_trade_calendar() -> TradeCalendar:
+    """Get the process-wide TradeCalendar, reloaded from the database once a day."""
+    global _calendar
+    calendar = _calendar
+    if calendar is not None and calendar.loaded_on == datetime.date.today():
+        return calendar
+    with _calendar_lock:
+        if _calendar is None or _calendar.loaded_on != datetime.date.today():
+            _calendar = _load_trade_calendar()
+            logger.info(f"📅 Trade calendar: {len(_calendar.dates)} trading days up to {_calendar.last} ({_calendar.source}).")
+        return _calendar
+
+def refresh_trade_calendar() -> int:
+    """
+    Fetch the SSE calendar from EARLIEST_DATE to the end of this year from tushare and
+    store it in TRADE_CALENDAR_TABLE.
+
+    Returns:
+        int: number of calendar days stored, 0 if fetching failed
+    """
+    global _calendar
+    from datas.fetch_stock_bars import tushare_query
+    end_date = f"{datetime.date.today().year}1231"
+    try:
+        cal = tushare_query("trade_cal", kind="calendar", exchange="SSE", start_date=EARLIEST_DATE, end_date=end_date)
+    except Exception as e:
+        logger.error(f"Failed to fetch trade calendar: {e}")
+        return 0
+    if cal is None or cal.empty:
+        logger.error("Fetched trade calendar is empty.")
+        return 0
+
+    rows = list(zip(cal['cal_date'].astype(int).tolist(), cal['is_open'].astype(int).tolist()))
+    create_trade_calendar_table()
+    with get_db_connection() as conn:
+        conn.executemany(f"INSERT OR REPLACE INTO {TRADE_CALENDAR_TABLE} (date, is_open) VALUES (?, ?)", rows)
+        conn.commit()
+    with _calendar_lock:
+        _calendar = None
+    logger.info(f"🎉 Stored {len(rows)} trade calendar days up to {end_date}.")
+    return len(rows)
+
+def ensure_trade_calendar():
+    """Fetch the calendar if the stored one does not cover today yet."""
+    today = _as_int(datetime.date.today())
+    try:
+        with get_db_connection() as conn:
+            last = conn.execute(f"SELECT MAX(date) FROM {TRADE_CALENDAR_TABLE}").fetchone()[0]
+    except sqlite3.OperationalError:
+        last = None
+    if last is None or last < today:
+        refresh_trade_calendar()
+
+def is_trading_day(date) -> bool:
+    return get_trade_calendar().is_trading_day(date)
+
+def prev_trading_day(date, n: int = 1) -> int:
+    return get_trade_calendar().prev_trading_day(date, n)
+
+def trading_days_between(start, end) -> np.ndarray:
+    return get_trade_calendar().trading_days_between(start, end)
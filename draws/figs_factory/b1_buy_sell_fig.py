@@ -2,11 +2,7 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datas.query_stock import query_latest_bars, get_stock_info_by_code, query_bars_by_days
 from pathlib import Path
-from indicators.bbi import add_bbi_to_dataframe
-from indicators.zxdkx import add_zxdkx_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
-from indicators.kdj import add_kdj_to_dataframe
-from indicators.macd import add_macd_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 from draws.kline_theme import ThemeRegistry, KlineTheme
 from tools.colors import hex_to_rgba
 from draws.figs_factory.ploty_tools import compute_row_paper_domains, add_row_background
@@ -43,11 +39,7 @@ def b1_buy_sell_fig(code: str, n: int = 60, width: int = 600, height: int = 600,
     if stock_info.empty or code not in stock_info.index:
         raise ValueError(f"No stock info found for code: {code}")
 
-    add_bbi_to_dataframe(df, inplace=True)
-    add_zxdkx_to_dataframe(df, inplace=True)
-    add_volume_ma_to_dataframe(df, inplace=True)
-    add_kdj_to_dataframe(df, inplace=True)
-    add_macd_to_dataframe(df, inplace=True)
+    df = df.ind.with_columns('bbi', 'zxdkx', 'volume_ma', 'kdj', 'macd')
 
     df = df.tail(n)
 
@@ -2,21 +2,25 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datas.query_stock import query_latest_bars, get_stock_info_by_code, query_bars_by_days
 from pathlib import Path
-from indicators.bbi import add_bbi_to_dataframe
-from indicators.zxdkx import add_zxdkx_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
-from indicators.kdj import add_kdj_to_dataframe
-from indicators.macd import add_macd_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 from draws.kline_theme import ThemeRegistry, KlineTheme
 from tools.colors import hex_to_rgba
 from draws.figs_factory.ploty_tools import compute_row_paper_domains, add_row_background
 from typing import Optional
+import pandas as pd
 
-def ztalk_fig_v2(code: str, n: int = 60, width: int = 600, height: int = 600, to_date: Optional[str] = None, theme_name: str = "vintage_ticker") -> go.Figure:
+# bars loaded for a chart, the long indicators (zxdkx 114 days, macd) need the history
+ZTALK_FIG_DAYS = 500
+
+def ztalk_fig_v2(code: str, n: int = 60, width: int = 600, height: int = 600, to_date: Optional[str] = None, theme_name: str = "vintage_ticker", bars: Optional[pd.DataFrame] = None) -> go.Figure:
+    """
+    bars: the ZTALK_FIG_DAYS bars up to to_date when the caller already has them (e.g. the
+        frame a hunt analyzed), indicators the hunt computed on them are reused from bars.ind
+    """
     theme = ThemeRegistry.get(name=theme_name)
     
     stock_info = get_stock_info_by_code(code)
-    df = query_bars_by_days(code=code, days=500, to_date=to_date)
+    df = bars if bars is not None else query_bars_by_days(code=code, days=ZTALK_FIG_DAYS, to_date=to_date)
     
     if df.empty:
         raise ValueError(f"No data found for code: {code}")
@@ -24,11 +28,7 @@ def ztalk_fig_v2(code: str, n: int = 60, width: int = 600, height: int = 600, to
     if stock_info.empty or code not in stock_info.index:
         raise ValueError(f"No stock info found for code: {code}")
 
-    add_bbi_to_dataframe(df, inplace=True)
-    add_zxdkx_to_dataframe(df, inplace=True)
-    add_volume_ma_to_dataframe(df, inplace=True)
-    add_kdj_to_dataframe(df, inplace=True)
-    add_macd_to_dataframe(df, inplace=True)
+    df = df.ind.with_columns('bbi', 'zxdkx', 'volume_ma', 'kdj', 'macd')
 
     df = df.tail(n)
 
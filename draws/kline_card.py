@@ -39,8 +39,8 @@ def add_rounded_rectangle_border(
     result = Image.alpha_composite(result, border_layer)
     return result
 
-def make_kline_card(code: str, n: int = 60, width: int = 600, height: int = 800, to_date: Optional[str] = None, theme_name: str = "vintage_ticker") -> Image.Image:
-    fig = ztalk_fig_v2(code=code, n=n, width=width, height=height, to_date=to_date, theme_name=theme_name)
+def make_kline_card(code: str, n: int = 60, width: int = 600, height: int = 800, to_date: Optional[str] = None, theme_name: str = "vintage_ticker", bars: Optional[pd.DataFrame] = None) -> Image.Image:
+    fig = ztalk_fig_v2(code=code, n=n, width=width, height=height, to_date=to_date, theme_name=theme_name, bars=bars)
     theme = ThemeRegistry.get(name=theme_name)
     img_bytes = fig.to_image(format="png", width=width, height=height, scale=3)
     img = Image.open(io.BytesIO(img_bytes))
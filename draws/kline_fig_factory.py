@@ -3,11 +3,7 @@ from plotly.subplots import make_subplots
 import pandas as pd
 from datas.query_stock import query_latest_bars, get_stock_info_by_code
 from pathlib import Path
-from indicators.kdj import add_kdj_to_dataframe
-from indicators.macd import add_macd_to_dataframe
-from indicators.bbi import add_bbi_to_dataframe
-from indicators.zxdkx import add_zxdkx_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 from draws.kline_theme import ThemeRegistry, KlineTheme
 from tools.colors import hex_to_rgba
 
@@ -23,9 +19,7 @@ def standard_fig(code: str, n: int = 60, width: int = 600, height: int = 600, th
     if stock_info.empty or code not in stock_info.index:
         raise ValueError(f"No stock info found for code: {code}")
 
-    add_bbi_to_dataframe(df, inplace=True)
-    add_zxdkx_to_dataframe(df, inplace=True)
-    add_volume_ma_to_dataframe(df, inplace=True)
+    df = df.ind.with_columns('bbi', 'zxdkx', 'volume_ma')
 
     df = df.tail(n)
 
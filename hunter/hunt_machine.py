@@ -1,8 +1,13 @@
+import os
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from typing import Callable, List, Any, Optional
 from tqdm import tqdm
-from datas.query_stock import query_all_stock_code_list, query_latest_bars, get_stock_info_by_code, format_stock_info, query_bars_by_days
+from datas.query_stock import query_all_stock_code_list, query_latest_bars, get_stock_info_by_code, get_stock_brief, format_stock_brief, query_bars_by_days, bar_cache_stats
+from datas.create_database import connection_pool_stats, forget_read_connection
+from datas.shared_panel import SharedMarketPanel, PanelSpec, attach_worker_panel, worker_panel
+from indicators.context import share_indicators
+from hunter.scan_state import HuntScanState, analyzer_scan_key
 from tools.log import get_fetch_logger
 from dataclasses import dataclass, field
 
@@ -29,17 +34,20 @@ class HuntResult:
     code: str
     result_info: Any
     input: Optional[HuntInputLike]
-    stockInfo: pd.DataFrame = field(default_factory=pd.DataFrame, init=False)
     format_info: str = field(default="", init=False)
     name: str = field(default="", init=False)
 
     def __post_init__(self):
-        if self.stockInfo.empty:
-            self.stockInfo = get_stock_info_by_code(self.code)
+        # names come from the in-memory stock info cache, no SQL per match
         if not self.format_info:
-            self.format_info = format_stock_info(self.stockInfo, level='brief')
+            self.format_info = format_stock_brief(self.code)
         if not self.name:
-            self.name = self.stockInfo['name'].values[0] if not self.stockInfo.empty else ""
+            info = get_stock_brief(self.code)
+            self.name = info['name'] if info is not None else ""
+
+    @property
+    def stockInfo(self) -> pd.DataFrame:
+        return get_stock_info_by_code(self.code)
             
     def __repr__(self):
         return self.format_info
@@ -65,20 +73,137 @@ class HuntResult:
         right_codes = {res.code for res in right}
         return [res for res in left if res.code in right_codes]
 
+# "thread": one pool thread per input, overlaps SQLite reads but analyzers share the GIL
+# "process": chunks of inputs per worker process, analyzers run on every core
+EXECUTORS = ("thread", "process")
+
+def _input_code(input: HuntInputLike) -> str:
+    return input.code if isinstance(input, HuntInput) else input
+
+Analyzer = Callable[[pd.DataFrame], Any]
+CombineLike = str | Callable[[dict[str, Any]], bool]
+
+# how hunt_many combines the verdicts of its analyzers
+COMBINES = ("all", "any")
+
+def _analyze_input(input: HuntInputLike, analyzers: dict[str, Analyzer], min_bars: int, short_circuit: bool = False) -> dict[str, Any]:
+    """
+    Load the bars of one input once and run every analyzer on them.
+
+    Each analyzer gets its own shallow copy of the frame when there are several, so columns
+    one of them adds are not seen by the next. The copies share the frame's indicator cache
+    (df.ind), so an indicator several analyzers use is computed once.
+
+    Args:
+        short_circuit: stop at the first analyzer that does not match
+
+    Returns:
+        dict: {name: result} of the analyzers that matched
+
+    Raises:
+        RuntimeError: an analyzer raised, the input failed rather than matched nothing, so
+            an incremental hunt does not store a verdict for it
+    """
+    panel = worker_panel()
+    if isinstance(input, HuntInput):
+        df = input.dataframe()
+    elif panel is not None and input in panel:
+        df = panel.frame(input)
+    else:
+        df = query_latest_bars(input, n=min_bars)
+
+    if df.empty or len(df) < min_bars:
+        return {}
+
+    matches = {}
+    for name, analyzer in analyzers.items():
+        try:
+            res = analyzer(share_indicators(df, df.copy(deep=False)) if len(analyzers) > 1 else df)
+        except Exception as e:
+            raise RuntimeError(f"Analyzer {name} failed: {e}") from e
+        if res:
+            matches[name] = res
+        elif short_circuit:
+            break
+
+    return matches
+
+def _combined(combine: CombineLike, names: list[str], matches: dict[str, Any]) -> bool:
+    if combine == "all":
+        return len(matches) == len(names)
+    if combine == "any":
+        return bool(matches)
+    return bool(combine({name: matches.get(name) for name in names}))
+
+def _init_hunt_worker(panel_spec: Optional[PanelSpec] = None):
+    # a forked worker inherits the parent's read connection, sqlite handles must not be used
+    # (or closed) across a fork
+    forget_read_connection()
+    if panel_spec is not None:
+        attach_worker_panel(panel_spec)
+
+def _hunt_chunk(inputs: list[tuple[int, HuntInputLike]], analyzers: dict[str, Analyzer], min_bars: int, short_circuit: bool) -> tuple[list[tuple[int, dict[str, Any]]], list[tuple[int, str]]]:
+    """
+    Worker process side: ([(position, {name: result_info}) of the inputs of a chunk that
+    matched anything], [(position, error) of the inputs that failed to load or analyze]).
+    """
+    matched, failed = [], []
+    for pos, input in inputs:
+        try:
+            matches = _analyze_input(input, analyzers, min_bars, short_circuit)
+        except Exception as e:
+            failed.append((pos, str(e)))
+            continue
+        if matches:
+            matched.append((pos, matches))
+    return matched, failed
+
+def _shippable(input: HuntInputLike) -> HuntInputLike:
+    """The input without bars it may have loaded, workers load their own."""
+    if isinstance(input, HuntInput):
+        return HuntInput(input.code, input.to_date, input.days)
+    return input
+
 class HuntMachine:
-    def __init__(self, max_workers: int = 8, on_result_found: Optional[Callable[[HuntResult], None]] = None):
+    def __init__(
+        self,
+        max_workers: int = 8,
+        on_result_found: Optional[Callable[[HuntResult], None]] = None,
+        executor: str = "thread",
+        chunk_size: Optional[int] = None,
+        shared_panel: bool = False,
+    ):
         """
         Initialize HuntMachine.
 
         Args:
-            max_workers: Number of concurrent workers for parallel processing
+            max_workers: Number of concurrent workers for parallel processing, capped at the
+                         number of cores in process mode
             on_result_found: Optional callback function that gets called immediately when a match is found.
                            The callback receives a HuntResult object as parameter.
+            executor: "thread" or "process", see EXECUTORS. In process mode the analyzer must be a
+                      module-level function and its results must be picklable.
+            chunk_size: inputs shipped to a worker process at a time, by default about four
+                        chunks per worker (at most 64 inputs each)
+            shared_panel: process mode only, load the bars of the code inputs once into a
+                          SharedMarketPanel that workers read zero-copy instead of each
+                          querying SQLite
         """
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unsupported executor: {executor}. Choose from {EXECUTORS}.")
         self.max_workers = max_workers
         self.on_result_found = on_result_found
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.shared_panel = shared_panel
 
-    def hunt(self, analyzer: Callable[[pd.DataFrame], Any], min_bars: int = 500, hunt_pool: Optional[List[HuntInputLike]] = None) -> List[HuntResult]:
+    def hunt(
+        self,
+        analyzer: Callable[[pd.DataFrame], Any],
+        min_bars: int = 500,
+        hunt_pool: Optional[List[HuntInputLike]] = None,
+        incremental: bool = False,
+    ) -> List[HuntResult]:
         """
         Scan all stocks and apply the analyzer function.
         
@@ -87,62 +212,208 @@ class HuntMachine:
                       The return value can be a boolean or any object (e.g., a dict with details).
             min_bars: Minimum number of bars required for the analyzer.
             hunt_pool: A list of stock codes to analyze.
+            incremental: only evaluate inputs whose bars changed since the last incremental
+                         hunt with the same analyzer and min_bars, the stored verdict of the
+                         others is reused, see HuntScanState. Results must be picklable.
 
         Returns:
             A list of HuntResult objects for stocks that matched the analyzer criteria.
         """
+        results: list[HuntResult] = []
+
+        def on_matches(input: HuntInputLike, matches: dict[str, Any]):
+            self._found(HuntResult(_input_code(input), matches['hunt'], input), results)
+
+        analyzers = {'hunt': analyzer}
+        scan_state = HuntScanState(analyzer_scan_key(analyzers, min_bars)) if incremental else None
+        self._run(self._pool(hunt_pool), analyzers, min_bars, False, on_matches, scan_state)
+        logger.info(f"✅ Hunt finished. Found {len(results)} matches.")
+        self._log_stats()
+        return results
+
+    def hunt_many(
+        self,
+        analyzers: dict[str, Callable[[pd.DataFrame], Any]],
+        combine: CombineLike = "all",
+        min_bars: int = 500,
+        hunt_pool: Optional[List[HuntInputLike]] = None,
+        incremental: bool = False,
+    ) -> 'MultiHuntResult':
+        """
+        Run several analyzers in one pass: every input's bars are loaded once and all
+        analyzers run on that frame.
+
+        Args:
+            analyzers: {name: analyzer}, run in this order
+            combine: "all" (every analyzer matches, later analyzers are skipped once one
+                     fails), "any", or a callable receiving {name: result_info or None} of
+                     every analyzer and returning whether the input matches
+            min_bars: Minimum number of bars required, the largest any analyzer needs
+            hunt_pool: A list of stock codes to analyze.
+            incremental: only evaluate inputs whose bars changed since the last incremental
+                         run of the same analyzers, see hunt()
+
+        Returns:
+            MultiHuntResult with the matches of each analyzer and the combined matches, whose
+            result_info is {name: result_info} of the analyzers that matched. With "all"
+            the per-analyzer lists only hold matches of analyzers that ran. on_result_found
+            is called for combined matches.
+        """
+        if not analyzers:
+            raise ValueError("hunt_many needs at least one analyzer.")
+        if isinstance(combine, str) and combine not in COMBINES:
+            raise ValueError(f"Unsupported combine: {combine}. Choose from {COMBINES} or pass a callable.")
+        names = list(analyzers)
+        result = MultiHuntResult(by_analyzer={name: [] for name in names}, combined=[])
+
+        def on_matches(input: HuntInputLike, matches: dict[str, Any]):
+            code = _input_code(input)
+            for name, res in matches.items():
+                result.by_analyzer[name].append(HuntResult(code, res, input))
+            if _combined(combine, names, matches):
+                self._found(HuntResult(code, matches, input), result.combined)
+
+        short_circuit = combine == "all"
+        scan_state = HuntScanState(analyzer_scan_key(analyzers, min_bars, short_circuit)) if incremental else None
+        self._run(self._pool(hunt_pool), analyzers, min_bars, short_circuit, on_matches, scan_state)
+        counts = {name: len(matches) for name, matches in result.by_analyzer.items()}
+        logger.info(f"✅ Hunt finished. Found {len(result.combined)} matches ({combine}), per analyzer: {counts}.")
+        self._log_stats()
+        return result
+
+    def _pool(self, hunt_pool: Optional[List[HuntInputLike]]) -> list[HuntInputLike]:
         pool = []
         if hunt_pool is None:
             pool = query_all_stock_code_list()
         else:
             pool = hunt_pool
-        results: list[HuntResult] = []
-        
-        logger.info(f"🏹 Start hunting among {len(pool)} inputs...")
-        
+        return list(pool)
+
+    def _log_stats(self):
+        logger.info(f"DB read connections: {connection_pool_stats()}")
+        logger.info(f"Bar cache: {bar_cache_stats()}")
+
+    def _found(self, result: HuntResult, results: list[HuntResult]):
+        results.append(result)
+        # Trigger callback immediately when a result is found
+        if self.on_result_found:
+            try:
+                self.on_result_found(result)
+            except Exception as callback_error:
+                logger.error(f"Error in callback for {result.code}: {callback_error}")
+
+    def _run(
+        self,
+        pool: list[HuntInputLike],
+        analyzers: dict[str, Analyzer],
+        min_bars: int,
+        short_circuit: bool,
+        on_matches: Callable[[HuntInputLike, dict[str, Any]], None],
+        scan_state: Optional[HuntScanState] = None,
+    ):
+        """
+        Run the analyzers over the pool, on_matches(input, {name: result_info}) runs in the calling thread.
+
+        With a scan_state, inputs whose bars did not change since their stored verdict are
+        not evaluated, their stored matches go to on_matches; the verdicts of the evaluated
+        inputs are stored afterwards (inputs that failed are left out).
+        """
+        if scan_state is not None:
+            pool, reused = scan_state.partition(pool)
+            for input, matches in reused:
+                on_matches(input, matches)
+            matched = {}
+
+            def record(input: HuntInputLike, matches: dict[str, Any]):
+                matched[id(input)] = matches
+                on_matches(input, matches)
+        else:
+            record = on_matches
+
+        logger.info(f"🏹 Start hunting among {len(pool)} inputs with {len(analyzers)} analyzer(s) ({self.executor} executor)...")
+        if self.executor == "process":
+            failed = self._run_in_processes(pool, analyzers, min_bars, short_circuit, record)
+        else:
+            failed = self._run_in_threads(pool, analyzers, min_bars, short_circuit, record)
+
+        if scan_state is not None:
+            saved = scan_state.save(
+                (input, matched.get(id(input), {})) for pos, input in enumerate(pool) if pos not in failed
+            )
+            if saved:
+                logger.info(f"💾 Stored {saved} verdicts of {scan_state.scan_key}.")
+
+    def _run_in_threads(self, pool: list[HuntInputLike], analyzers: dict[str, Analyzer], min_bars: int, short_circuit: bool, on_matches: Callable[[HuntInputLike, dict[str, Any]], None]) -> set[int]:
+        """Returns the positions of the inputs that failed."""
+        failed = set()
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             futures = {
-                executor.submit(self._process_stock, input, analyzer, min_bars): (input.code if isinstance(input, HuntInput) else input)
-                for input in pool
+                executor.submit(_analyze_input, input, analyzers, min_bars, short_circuit): pos
+                for pos, input in enumerate(pool)
             }
             
             for future in tqdm(as_completed(futures), total=len(futures), desc="Hunting"):
-                code = futures[future]
+                pos = futures[future]
+                input = pool[pos]
                 try:
-                    result: Optional[HuntResult] = future.result()
-                    if result:
-                        results.append(result)
-                        # Trigger callback immediately when a result is found
-                        if self.on_result_found:
-                            try:
-                                self.on_result_found(result)
-                            except Exception as callback_error:
-                                logger.error(f"Error in callback for {code}: {callback_error}")
+                    matches = future.result()
+                    if matches:
+                        on_matches(input, matches)
                 except Exception as e:
-                    logger.error(f"Error processing {code}: {e}")
-                    
-        logger.info(f"✅ Hunt finished. Found {len(results)} matches.")
-        return results
+                    failed.add(pos)
+                    logger.error(f"Error processing {_input_code(input)}: {e}")
+        return failed
 
-    def _process_stock(self, input: HuntInputLike, analyzer: Callable[[pd.DataFrame], Any], min_bars: int) -> Optional[HuntResult]:
-        # Fetch data
-        if isinstance(input, HuntInput):
-            code = input.code
-            df = input.dataframe()
-        else:
-            code = input
-            df = query_latest_bars(code, n=min_bars)
-        
-        if df.empty or len(df) < min_bars:
-            return None
-            
-        # Apply analyzer
+    def _run_in_processes(self, pool: list[HuntInputLike], analyzers: dict[str, Analyzer], min_bars: int, short_circuit: bool, on_matches: Callable[[HuntInputLike, dict[str, Any]], None]) -> set[int]:
+        """
+        Ship chunks of inputs to worker processes. Workers open their own read connections
+        and return only (position, {name: result_info}), HuntResults are built here in the parent.
+
+        Returns the positions of the inputs that failed (every input of a chunk whose worker
+        died).
+        """
+        failed = set()
+        if not pool:
+            return failed
+        workers = max(1, min(self.max_workers, os.cpu_count() or 1))
+        chunk_size = self.chunk_size or max(1, min(64, -(-len(pool) // (workers * 4))))
+        indexed = [(pos, _shippable(input)) for pos, input in enumerate(pool)]
+        chunks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+
+        panel = None
+        if self.shared_panel:
+            # float64 so analyzers see exactly the values they would read from the bar table
+            panel = SharedMarketPanel.create(
+                [input for input in pool if not isinstance(input, HuntInput)], days=min_bars, price_dtype='float64'
+            )
         try:
-            res = analyzer(df)
-            if res:
-                return HuntResult(code, res, input)
-        except Exception as e:
-            # logger.debug(f"Analyzer failed for {code}: {e}") # Optional: debug log
-            pass
-            
-        return None
\ No newline at end of file
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_hunt_worker,
+                initargs=(panel.spec if panel is not None else None,),
+            ) as executor, tqdm(total=len(pool), desc="Hunting") as progress:
+                futures = {executor.submit(_hunt_chunk, chunk, analyzers, min_bars, short_circuit): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    chunk = futures[future]
+                    try:
+                        matched, chunk_failed = future.result()
+                        for pos, matches in matched:
+                            on_matches(pool[pos], matches)
+                        for pos, error in chunk_failed:
+                            failed.add(pos)
+                            logger.error(f"Error processing {_input_code(pool[pos])}: {error}")
+                    except Exception as e:
+                        failed.update(pos for pos, _ in chunk)
+                        codes = [_input_code(input) for _, input in chunk]
+                        logger.error(f"Error processing {codes[0]}..{codes[-1]} ({len(codes)} inputs): {e}")
+                    progress.update(len(chunk))
+        finally:
+            if panel is not None:
+                panel.close()
+                panel.unlink()
+        return failed
+
+@dataclass
+class MultiHuntResult:
+    by_analyzer: dict[str, List[HuntResult]]
+    combined: List[HuntResult]
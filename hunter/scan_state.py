@@ -0,0 +1,230 @@
+import sys
+import pickle
+import sqlite3
+import hashlib
+import functools
+from datetime import datetime
+from pathlib import Path
+from types import CodeType
+from typing import Any, Callable, Iterable, Optional
+from tools.log import get_fetch_logger
+from datas.create_database import HUNT_SCAN_STATE_TABLE, BAR_COVERAGE_TABLE, get_db_connection, get_read_connection, create_hunt_scan_state_table
+
+logger = get_fetch_logger()
+
+# the indicators analyzers compute with, their source is part of every scan key
+INDICATORS_DIR = Path(__file__).resolve().parent.parent / "indicators"
+
+# module-level values an analyzer reads (thresholds etc.) that are part of its scan key
+_PARAM_TYPES = (bool, int, float, str, bytes, tuple, frozenset, type(None))
+
+def _code_digest(code: CodeType, h):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _code_digest(const, h)
+        else:
+            h.update(repr(const).encode())
+
+def _globals_digest(fn: Callable, h):
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.update(const.co_names)
+    module_globals = getattr(fn, '__globals__', {})
+    for name in sorted(names):
+        value = module_globals.get(name)
+        if isinstance(value, _PARAM_TYPES):
+            h.update(f"{name}={value!r};".encode())
+
+def _source_digest(paths: Iterable[Path], h):
+    for path in sorted(set(paths)):
+        try:
+            h.update(path.read_bytes())
+        except OSError:
+            # removed since it was imported, the loaded bytecode is hashed anyway
+            h.update(f"{path}:missing;".encode())
+
+def _module_path(fn: Callable) -> Optional[Path]:
+    module_file = getattr(sys.modules.get(getattr(fn, '__module__', None) or ''), '__file__', None)
+    return Path(module_file).resolve() if module_file else None
+
+def analyzer_scan_key(analyzers: dict[str, Callable], *params: Any) -> str:
+    """
+    Key of the verdicts of `analyzers` in the scan state: their qualified names plus a hash
+    of their code, of the module-level parameters they read, of partial() arguments, of
+    `params` (min_bars etc.), and of the source of the analyzers' modules and of the
+    indicators package. Editing an analyzer, a helper next to it, an indicator or one of
+    their thresholds gives a new key, so verdicts of the old version are never reused.
+
+    Helpers in other modules are not hashed, clear() the state after changing them.
+    """
+    h = hashlib.sha1()
+    names = []
+    sources = set(INDICATORS_DIR.glob("*.py"))
+    for name, analyzer in analyzers.items():
+        fn, args = analyzer, ()
+        while isinstance(fn, functools.partial):
+            args += (fn.args, sorted(fn.keywords.items()))
+            fn = fn.func
+        names.append(f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', type(fn).__qualname__)}")
+        h.update(f"{name}:{names[-1]}:{args!r};".encode())
+        code = getattr(fn, '__code__', None)
+        if code is not None:
+            _code_digest(code, h)
+        _globals_digest(fn, h)
+        module_path = _module_path(fn)
+        if module_path is not None:
+            sources.add(module_path)
+    _source_digest(sources, h)
+    h.update(repr(params).encode())
+    return f"{'+'.join(names)}#{h.hexdigest()[:16]}"
+
+def _input_window(input) -> tuple[str, str]:
+    """(code, window) of a hunt input, window tells which bars of the code it analyzes."""
+    if isinstance(input, str):
+        return input, "latest"
+    return input.code, f"{input.to_date or 'latest'}:{input.days}"
+
+class HuntScanState:
+    """
+    Verdicts of one scan key (see analyzer_scan_key()) per code, stored in the
+    hunt_scan_state table together with the bar_coverage write_seq of the code they were
+    computed on.
+
+    write_seq changes whenever any bar of the code is written: new bars, backfills, and
+    in-place rewrites (repairs, rebased qfq prices) that keep the dates and row count. A
+    code whose write_seq is unchanged since its last scan has the same bars, its stored
+    verdict is reused; otherwise it is evaluated again. Codes without coverage are always
+    evaluated and never stored.
+
+    Usage:
+        state = HuntScanState(analyzer_scan_key({"b1": hunt_b1}, 500))
+        pending, reused = state.partition(pool)   # reused: [(input, {name: result_info})]
+        ...evaluate pending...
+        state.save(verdicts)                      # [(input, {name: result_info} or {})]
+    """
+    def __init__(self, scan_key: str):
+        self.scan_key = scan_key
+        self._coverage: dict[str, int] = {}
+        create_hunt_scan_state_table()
+
+    def _load_coverage(self) -> dict[str, int]:
+        try:
+            rows = get_read_connection().execute(
+                f"SELECT code, write_seq FROM {BAR_COVERAGE_TABLE}"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            logger.warning(f"{BAR_COVERAGE_TABLE} is missing, run prepare_database(). Evaluating every code.")
+            return {}
+        return dict(rows)
+
+    def partition(self, pool: Iterable) -> tuple[list, list[tuple[Any, dict[str, Any]]]]:
+        """
+        Split hunt inputs into the ones to evaluate and the ones whose bars did not change
+        since their stored verdict.
+
+        The write_seq read here is what save() records, so bars written while the hunt runs
+        are picked up by the next one.
+
+        Returns:
+            (inputs to evaluate, [(input, stored {name: result_info}) of unchanged inputs
+            that matched])
+        """
+        self._coverage = self._load_coverage()
+        with get_db_connection() as conn:
+            stored = {
+                (code, window): (write_seq, result)
+                for code, window, write_seq, result in conn.execute(
+                    f"""
+                    SELECT code, input_window, write_seq, result
+                    FROM {HUNT_SCAN_STATE_TABLE} WHERE scan_key = ?
+                    """,
+                    (self.scan_key,)
+                )
+            }
+
+        pending, reused, skipped = [], [], 0
+        for input in pool:
+            code, window = _input_window(input)
+            write_seq = self._coverage.get(code)
+            row = stored.get((code, window))
+            if write_seq is None or row is None or row[0] != write_seq:
+                pending.append(input)
+                continue
+            try:
+                matches = pickle.loads(row[1]) if row[1] is not None else {}
+            except Exception:
+                # stored by a version whose result classes are gone
+                pending.append(input)
+                continue
+            skipped += 1
+            if matches:
+                reused.append((input, matches))
+        logger.info(f"♻️ Incremental hunt: {skipped} inputs unchanged ({len(reused)} stored matches reused), {len(pending)} to evaluate.")
+        return pending, reused
+
+    def save(self, verdicts: Iterable[tuple[Any, dict[str, Any]]]) -> int:
+        """
+        Store the verdicts of evaluated inputs, {} for no match, against the write_seq read
+        by partition().
+
+        Returns:
+            int: number of verdicts stored
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        for input, matches in verdicts:
+            code, window = _input_window(input)
+            write_seq = self._coverage.get(code)
+            if write_seq is None:
+                continue
+            try:
+                result = pickle.dumps(matches, protocol=pickle.HIGHEST_PROTOCOL) if matches else None
+            except Exception as e:
+                logger.warning(f"Cannot store the verdict of {code} for {self.scan_key}: {e}")
+                continue
+            rows.append((self.scan_key, code, window, write_seq, result, now))
+
+        with get_db_connection() as conn:
+            conn.executemany(
+                f"""
+                INSERT OR REPLACE INTO {HUNT_SCAN_STATE_TABLE}
+                (scan_key, code, input_window, write_seq, result, scanned_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            conn.commit()
+        return len(rows)
+
+    def clear(self):
+        """Forget every verdict of this scan key."""
+        with get_db_connection() as conn:
+            conn.execute(f"DELETE FROM {HUNT_SCAN_STATE_TABLE} WHERE scan_key = ?", (self.scan_key,))
+            conn.commit()
+
+def prune_scan_state(keep_keys: Optional[Iterable[str]] = None) -> int:
+    """
+    Delete stored verdicts of scan keys not in `keep_keys` (all of them if None), e.g. the
+    keys of analyzer versions that no longer exist.
+
+    Returns:
+        int: number of rows deleted
+    """
+    create_hunt_scan_state_table()
+    with get_db_connection() as conn:
+        keep = list(keep_keys or [])
+        if not keep:
+            deleted = conn.execute(f"DELETE FROM {HUNT_SCAN_STATE_TABLE}").rowcount
+        else:
+            placeholders = ','.join('?' for _ in keep)
+            deleted = conn.execute(
+                f"DELETE FROM {HUNT_SCAN_STATE_TABLE} WHERE scan_key NOT IN ({placeholders})", keep
+            ).rowcount
+        conn.commit()
+    return deleted
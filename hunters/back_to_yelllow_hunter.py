@@ -1,8 +1,7 @@
 import pandas as pd
 from typing import Optional
 from tools.log import get_analyze_logger
-from indicators.zxdkx import add_zxdkx_to_dataframe
-from indicators.kdj import add_kdj_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 from hunter.hunt_machine import HuntMachine, HuntResult, HuntInputLike, HuntInput
 
 logger = get_analyze_logger()
@@ -18,10 +17,8 @@ def back_to_yellow_hunter(df: pd.DataFrame) -> Optional[dict]:
     if df is None or len(df) < 2:
         return None
     
-    # 添加双线系统指标（生成 z_white 和 z_yellow 列）
-    add_zxdkx_to_dataframe(df, inplace=True)
-    
-    add_kdj_to_dataframe(df, inplace=True)
+    # 添加双线系统指标（z_white 和 z_yellow 列）和 KDJ，加在浅拷贝上
+    df = df.ind.with_columns('zxdkx', 'kdj')
     
     ret = {}
     last_row = df.iloc[-1]
@@ -29,8 +29,7 @@ import pandas as pd
 import numpy as np
 from typing import Optional
 from tools.log import get_analyze_logger
-from indicators.macd import add_macd_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 
 logger = get_analyze_logger()
 
@@ -50,18 +49,15 @@ def hunt_golden_cross(df: pd.DataFrame) -> Optional[dict]:
 
     ret = {}
 
+    # MACD 和成交量均线取自 df.ind 缓存，所有列加在浅拷贝上，不修改调用方的 DataFrame
+    df = df.ind.with_columns('macd', 'volume_ma', volume_ma=(5, 20))
+
     # 1. 计算均线：MA5, MA10, MA20, MA60
     df['ma5'] = df['close'].rolling(window=5).mean()
     df['ma10'] = df['close'].rolling(window=10).mean()
     df['ma20'] = df['close'].rolling(window=20).mean()
     df['ma60'] = df['close'].rolling(window=60).mean()
 
-    # 2. 添加MACD指标
-    add_macd_to_dataframe(df, inplace=True)
-
-    # 3. 计算成交量均线
-    add_volume_ma_to_dataframe(df, periods=[5, 20], inplace=True)
-
     # 获取最近几天的数据
     last_row = df.iloc[-1]
     prev_row = df.iloc[-2]
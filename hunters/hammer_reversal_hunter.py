@@ -38,8 +38,7 @@ import pandas as pd
 import numpy as np
 from typing import Optional
 from tools.log import get_analyze_logger
-from indicators.macd import add_macd_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 
 logger = get_analyze_logger()
 
@@ -127,14 +126,12 @@ def hunt_hammer_reversal(df: pd.DataFrame) -> Optional[dict]:
 
     ret = {}
 
-    # 1. 添加均线和成交量指标
+    # 1. 添加均线和成交量指标，MACD 和成交量均线取自 df.ind 缓存，列加在浅拷贝上
+    df = df.ind.with_columns('volume_ma', 'macd', volume_ma=(5, 10))
     df['ma5'] = df['close'].rolling(window=5).mean()
     df['ma10'] = df['close'].rolling(window=10).mean()
     df['ma20'] = df['close'].rolling(window=20).mean()
 
-    add_volume_ma_to_dataframe(df, periods=[5, 10], inplace=True)
-    add_macd_to_dataframe(df, inplace=True)
-
     # 2. 检查最近1-3天内是否出现锤子线
     hammer_found = False
     hammer_idx = None
@@ -1,5 +1,6 @@
 from tools.path import export_file_path
 from draws.kline_card import make_kline_card, save_img_file
+from draws.figs_factory.ztalk_fig_v2 import ZTALK_FIG_DAYS
 from draws.kline_theme import ThemeRegistry, KlineTheme
 from datas.query_stock import get_stock_info_by_code, get_stock_info_by_name, get_latest_date_by_code
 import webbrowser
@@ -17,7 +18,9 @@ def draw_hunt_results(hunt_results: list[HuntResult], title: str = "Hunt Results
         code = result.code
         input = result.input
         if isinstance(input, HuntInput):
-            img = make_kline_card(code=code, n=60, width=600, height=800, to_date=input.to_date, theme_name=theme_name)
+            # the bars the hunt analyzed, if it loaded them in this process, with their cached indicators
+            bars = getattr(input, 'df', None) if input.days == ZTALK_FIG_DAYS else None
+            img = make_kline_card(code=code, n=60, width=600, height=800, to_date=input.to_date, theme_name=theme_name, bars=bars)
         else:
             img = make_kline_card(code=code, n=60, width=600, height=800, theme_name=theme_name)
         images.append(img)
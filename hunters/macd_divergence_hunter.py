@@ -36,8 +36,7 @@ import pandas as pd
 import numpy as np
 from typing import Optional, Tuple
 from tools.log import get_analyze_logger
-from indicators.macd import add_macd_to_dataframe
-from indicators.rsi import add_rsi_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 
 logger = get_analyze_logger()
 
@@ -94,10 +93,9 @@ def hunt_macd_divergence(df: pd.DataFrame) -> Optional[dict]:
     ret = {}
 
     # 1. 添加MACD指标
-    add_macd_to_dataframe(df, inplace=True)
-
     # 2. 添加RSI指标（辅助判断超卖）
-    add_rsi_to_dataframe(df, period=14, inplace=True)
+    # 均取自 df.ind 缓存，列加在浅拷贝上，不修改调用方的 DataFrame
+    df = df.ind.with_columns('macd', 'rsi')
 
     # 3. 在最近60天内寻找背离形态
     lookback = min(60, len(df))
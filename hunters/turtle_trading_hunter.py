@@ -46,7 +46,8 @@ import pandas as pd
 import numpy as np
 from typing import Optional, Tuple
 from tools.log import get_analyze_logger
-from indicators.volume_ma import add_volume_ma_to_dataframe
+from indicators.atr import atr
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 
 logger = get_analyze_logger()
 
@@ -60,19 +61,10 @@ def calculate_atr(df: pd.DataFrame, period: int = 20) -> pd.Series:
         period: 计算周期
 
     Returns:
-        ATR序列
+        ATR序列（不修改df）
     """
-    # 计算真实波幅TR
-    df['h_l'] = df['high'] - df['low']
-    df['h_pc'] = abs(df['high'] - df['close'].shift(1))
-    df['l_pc'] = abs(df['low'] - df['close'].shift(1))
-
-    df['tr'] = df[['h_l', 'h_pc', 'l_pc']].max(axis=1)
-
-    # 计算ATR（TR的指数移动平均）
-    atr = df['tr'].rolling(window=period).mean()
-
-    return atr
+    # 真实波幅TR的简单移动平均
+    return atr(df['high'], df['low'], df['close'], period=period)
 
 
 def calculate_donchian_channel(df: pd.DataFrame, period: int) -> Tuple[pd.Series, pd.Series]:
@@ -107,9 +99,12 @@ def hunt_turtle_trading(df: pd.DataFrame) -> Optional[dict]:
 
     ret = {}
 
+    # ATR 和成交量均线取自 df.ind 缓存，所有列加在浅拷贝上，不修改调用方的 DataFrame
+    df = df.ind.with_columns('volume_ma', volume_ma=(20, 55))
+
     # 1. 计算ATR（20日）
-    df['atr20'] = calculate_atr(df, period=20)
-    df['atr10'] = calculate_atr(df, period=10)
+    df['atr20'] = df.ind.atr(20)
+    df['atr10'] = df.ind.atr(10)
 
     # 2. 计算唐奇安通道
     # 系统1：20日通道（激进）
@@ -120,8 +115,7 @@ def hunt_turtle_trading(df: pd.DataFrame) -> Optional[dict]:
     df['dc55_high'], df['dc55_low'] = calculate_donchian_channel(df, period=55)
     df['dc20_low_exit'] = calculate_donchian_channel(df, period=20)[1]  # 系统2的退出信号
 
-    # 3. 添加成交量指标
-    add_volume_ma_to_dataframe(df, periods=[20, 55], inplace=True)
+    # 3. 成交量指标 volume_ma_20 / volume_ma_55 已在开头加入
 
     # 4. 检测突破信号
     last_row = df.iloc[-1]
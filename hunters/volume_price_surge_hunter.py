@@ -38,8 +38,7 @@ import pandas as pd
 import numpy as np
 from typing import Optional
 from tools.log import get_analyze_logger
-from indicators.macd import add_macd_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 
 logger = get_analyze_logger()
 
@@ -98,24 +97,21 @@ def hunt_volume_price_surge(df: pd.DataFrame) -> Optional[dict]:
 
     ret = {}
 
+    # 成交量均线和 MACD 取自 df.ind 缓存，所有列加在浅拷贝上，不修改调用方的 DataFrame
+    df = df.ind.with_columns('volume_ma', 'macd', volume_ma=(5, 10, 20))
+
     # 1. 添加均线指标
     df['ma5'] = df['close'].rolling(window=5).mean()
     df['ma10'] = df['close'].rolling(window=10).mean()
     df['ma20'] = df['close'].rolling(window=20).mean()
     df['ma60'] = df['close'].rolling(window=60).mean()
 
-    # 2. 添加成交量均线
-    add_volume_ma_to_dataframe(df, periods=[5, 10, 20], inplace=True)
-
-    # 3. 计算OBV指标
+    # 2. 计算OBV指标
     df['obv'] = calculate_obv(df)
 
-    # 4. 计算VWAP
+    # 3. 计算VWAP
     df['vwap20'] = calculate_vwap(df, period=20)
 
-    # 5. 添加MACD
-    add_macd_to_dataframe(df, inplace=True)
-
     # 6. 检测量价齐升
     # 查看最近3-5天的情况
     lookback = 5
@@ -331,16 +327,9 @@ def hunt_volume_price_surge(df: pd.DataFrame) -> Optional[dict]:
 
     # 20. 趋势确认：使用ADX（简化版）
     # 计算价格的波动性和方向性
-    df['tr'] = pd.DataFrame({
-        'hl': df['high'] - df['low'],
-        'hc': abs(df['high'] - df['close'].shift(1)),
-        'lc': abs(df['low'] - df['close'].shift(1))
-    }).max(axis=1)
-
-    df['atr14'] = df['tr'].rolling(window=14).mean()
+    atr = df.ind.atr(14).iloc[-1]
 
     # 趋势强度：最近涨幅 / ATR
-    atr = last_row['atr14']
     if atr > 0:
         trend_strength = gain_5d * current_price / atr
         ret['trend_strength'] = round(trend_strength, 2)
@@ -2,11 +2,7 @@ import pandas as pd
 from typing import Callable, List, Any, Optional
 from tools.log import get_analyze_logger
 from dataclasses import dataclass, field
-from indicators.kdj import add_kdj_to_dataframe
-from indicators.zxdkx import add_zxdkx_to_dataframe
-from indicators.bbi import add_bbi_to_dataframe
-from indicators.macd import add_macd_to_dataframe
-from indicators.volume_ma import add_volume_ma_to_dataframe
+import indicators.context  # registers the DataFrame.ind accessor  # noqa: F401
 from hunter.filters.is_bbi_deriv_uptrend import is_bbi_deriv_uptrend
 from hunter.hunt_machine import HuntMachine, HuntResult, HuntInputLike, HuntInput
 from hunters.hunt_output import draw_hunt_results
@@ -46,8 +42,8 @@ def hunt_b1(df: pd.DataFrame) -> Optional[dict]:
         logger.warning("DataFrame 为空或为 None。")
         return None
     
-    add_kdj_to_dataframe(df, inplace=True)
-    add_zxdkx_to_dataframe(df, inplace=True)
+    # 指标取自 df.ind 缓存，列加在浅拷贝上，不修改调用方的 DataFrame
+    df = df.ind.with_columns('kdj', 'zxdkx')
     
     ret = {}
     last_row = df.iloc[-1]
@@ -101,8 +97,8 @@ def hunt_b1(df: pd.DataFrame) -> Optional[dict]:
     ]
 
     # 添加盘整期成交量均线
-    add_volume_ma_to_dataframe(df, periods=[consolidation_days], inplace=True)
     vol_ma_key = f'volume_ma_{consolidation_days}'
+    df[vol_ma_key] = df.ind.volume_ma(consolidation_days)
 
     # 辅助列：涨跌、涨跌幅
     df['_pct_change_oc'] = df['close'] / df['open'] - 1
@@ -353,7 +349,7 @@ def main():
     def print_result(result: HuntResult):
         logger.info(f"{result.format_info}")
 
-    hunter = HuntMachine(max_workers=20, on_result_found=print_result)
+    hunter = HuntMachine(max_workers=20, on_result_found=print_result, executor="process")
     pool = target_pool
     
     # 执行选股
@@ -0,0 +1,84 @@
+import pandas as pd
+from typing import Optional
+
+def true_range(
+    high: pd.Series,
+    low: pd.Series,
+    close: pd.Series
+) -> pd.Series:
+    """
+    Calculate True Range (TR).
+
+    TR is the largest of high - low, |high - previous close| and |low - previous close|.
+
+    Args:
+        high: pd.Series of high prices
+        low: pd.Series of low prices
+        close: pd.Series of closing prices
+
+    Returns:
+        pd.Series: TR values
+    """
+    prev_close = close.shift(1)
+    return pd.concat([
+        high - low,
+        (high - prev_close).abs(),
+        (low - prev_close).abs()
+    ], axis=1).max(axis=1)
+
+def atr(
+    high: pd.Series,
+    low: pd.Series,
+    close: pd.Series,
+    period: int = 14
+) -> pd.Series:
+    """
+    Calculate ATR (Average True Range) indicator.
+
+    ATR is the simple moving average of the True Range over `period` days, NaN until
+    `period` bars are available.
+
+    Args:
+        high: pd.Series of high prices
+        low: pd.Series of low prices
+        close: pd.Series of closing prices
+        period: int, the period for the moving average, default is 14
+
+    Returns:
+        pd.Series: ATR values
+    """
+    return true_range(high, low, close).rolling(window=period).mean()
+
+def add_atr_to_dataframe(
+    df: pd.DataFrame,
+    high_col: str = 'high',
+    low_col: str = 'low',
+    close_col: str = 'close',
+    period: int = 14,
+    atr_col: Optional[str] = None,
+    inplace: bool = False
+) -> Optional[pd.DataFrame]:
+    """
+    Add an ATR column to DataFrame.
+
+    Args:
+        df: pd.DataFrame containing price data
+        high_col: str, column name for high price, default is 'high'
+        low_col: str, column name for low price, default is 'low'
+        close_col: str, column name for close price, default is 'close'
+        period: int, the period for the moving average, default is 14
+        atr_col: str, name for the new ATR column, default is f'atr{period}'
+        inplace: bool, if True modify df in place and return None; if False return modified copy
+
+    Returns:
+        pd.DataFrame: Modified DataFrame with the ATR column (if inplace=False), or None (if inplace=True)
+    """
+    atr_col = atr_col or f'atr{period}'
+    values = atr(df[high_col], df[low_col], df[close_col], period=period)
+    if inplace:
+        df[atr_col] = values
+        return None
+    else:
+        result = df.copy()
+        result[atr_col] = values
+        return result
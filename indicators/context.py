@@ -0,0 +1,152 @@
+"""
+Per-frame indicator cache, registered as the DataFrame accessor `df.ind`.
+
+    j = df.ind.kdj(9, 3, 3).j
+    white, yellow = df.ind.zxdkx()
+    vol_ma5 = df.ind.volume_ma(5)
+
+Every indicator is computed on first use with the functions of the indicators package and
+cached on the frame by its parameters, so analyzers and charts working on the same bars
+compute it once. Results are Series over read-only arrays sharing the frame's index, and
+the frame itself is never modified. Code that wants the classic columns (charts, hunters
+reading rows) takes them from with_columns(), a shallow copy of the frame that shares the
+cache.
+
+The cache is keyed on the frame object: a shallow copy made with DataFrame.copy() starts
+empty, hand the cache over with share_indicators(). A frame whose length or last bar
+changes in place drops its cache.
+"""
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from typing import Callable, Sequence
+from indicators.kdj import kdj
+from indicators.zxdkx import zxdkx
+from indicators.macd import macd
+from indicators.volume_ma import volume_ma
+from indicators.bbi import bbi
+from indicators.rsi import rsi
+from indicators.atr import atr
+
+KDJ = namedtuple('KDJ', ['k', 'd', 'j'])
+ZXDKX = namedtuple('ZXDKX', ['white', 'yellow'])
+MACD = namedtuple('MACD', ['dif', 'dea', 'bar'])
+
+# indicators with_columns() can add, by name
+COLUMN_INDICATORS = ('kdj', 'zxdkx', 'macd', 'bbi', 'rsi', 'volume_ma')
+
+def _read_only(values, index: pd.Index, name: str) -> pd.Series:
+    arr = np.array(values, copy=True)
+    arr.flags.writeable = False
+    return pd.Series(arr, index=index, name=name, copy=False)
+
+@pd.api.extensions.register_dataframe_accessor("ind")
+class IndicatorContext:
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+        self._cache = {}
+        self._stamp = self._stamp_of(df)
+
+    @staticmethod
+    def _stamp_of(df: pd.DataFrame) -> tuple:
+        if df.empty:
+            return (0,)
+        last_close = df['close'].iat[-1] if 'close' in df else None
+        return (len(df), df.index[-1], last_close)
+
+    def _get(self, key: tuple, compute: Callable):
+        stamp = self._stamp_of(self._df)
+        if stamp != self._stamp:
+            self._cache.clear()
+            self._stamp = stamp
+        value = self._cache.get(key)
+        if value is None:
+            value = compute()
+            self._cache[key] = value
+        return value
+
+    def _series(self, values: pd.Series, name: str) -> pd.Series:
+        return _read_only(values, self._df.index, name)
+
+    def kdj(self, period: int = 9, k_period: int = 3, d_period: int = 3) -> KDJ:
+        """KDJ of high/low/close, see indicators.kdj.kdj()."""
+        def compute():
+            df = self._df
+            values = kdj(df['high'], df['low'], df['close'], period=period, k_period=k_period, d_period=d_period)
+            return KDJ(*(self._series(values[col], col) for col in ('kdj_k', 'kdj_d', 'kdj_j')))
+        return self._get(('kdj', period, k_period, d_period), compute)
+
+    def zxdkx(self, m1: int = 14, m2: int = 28, m3: int = 57, m4: int = 114) -> ZXDKX:
+        """White and yellow lines of close, see indicators.zxdkx.zxdkx()."""
+        def compute():
+            values = zxdkx(self._df['close'], m1=m1, m2=m2, m3=m3, m4=m4)
+            return ZXDKX(*(self._series(values[col], col) for col in ('z_white', 'z_yellow')))
+        return self._get(('zxdkx', m1, m2, m3, m4), compute)
+
+    def macd(self, window_slow: int = 26, window_fast: int = 12, window_sign: int = 9) -> MACD:
+        """DIF, DEA and bar of close, see indicators.macd.macd()."""
+        def compute():
+            values = macd(self._df['close'], window_slow=window_slow, window_fast=window_fast, window_sign=window_sign)
+            return MACD(*(self._series(values[col], col) for col in ('macd_dif', 'macd_dea', 'macd_bar')))
+        return self._get(('macd', window_slow, window_fast, window_sign), compute)
+
+    def volume_ma(self, period: int) -> pd.Series:
+        """Moving average of volume over `period` days, see indicators.volume_ma.volume_ma()."""
+        def compute():
+            col = f'volume_ma_{period}'
+            return self._series(volume_ma(self._df['volume'], periods=[period])[col], col)
+        return self._get(('volume_ma', period), compute)
+
+    def bbi(self, periods: Sequence[int] = (3, 6, 12, 24)) -> pd.Series:
+        """BBI of close, see indicators.bbi.bbi()."""
+        periods = tuple(periods)
+        return self._get(('bbi', periods), lambda: self._series(bbi(self._df['close'], periods=periods), 'bbi'))
+
+    def rsi(self, window: int = 14) -> pd.Series:
+        """RSI of close, see indicators.rsi.rsi()."""
+        return self._get(('rsi', window), lambda: self._series(rsi(self._df['close'], window=window), 'rsi'))
+
+    def atr(self, period: int = 14) -> pd.Series:
+        """ATR of high/low/close, see indicators.atr.atr()."""
+        def compute():
+            df = self._df
+            return self._series(atr(df['high'], df['low'], df['close'], period=period), f'atr{period}')
+        return self._get(('atr', period), compute)
+
+    def with_columns(self, *names: str, volume_ma: Sequence[int] = (5, 10, 20)) -> pd.DataFrame:
+        """
+        A shallow copy of the frame with the classic indicator columns of `names` added
+        (kdj_k/d/j, z_white/z_yellow, macd_dif/dea/bar, bbi, rsi, volume_ma_{period}),
+        computed with default parameters through the cache. The copy shares this cache.
+
+        Args:
+            names: indicators out of COLUMN_INDICATORS
+            volume_ma: periods of the volume_ma columns
+        """
+        unknown = set(names) - set(COLUMN_INDICATORS)
+        if unknown:
+            raise ValueError(f"Unknown indicators {sorted(unknown)}, expected some of {COLUMN_INDICATORS}")
+        columns = []
+        for name in names:
+            if name == 'volume_ma':
+                columns += [self.volume_ma(period) for period in volume_ma]
+            elif name in ('bbi', 'rsi'):
+                columns.append(getattr(self, name)())
+            else:
+                columns += list(getattr(self, name)())
+
+        result = self._df.copy(deep=False)
+        for series in columns:
+            result[series.name] = series
+        share_indicators(self._df, result)
+        return result
+
+def share_indicators(src: pd.DataFrame, dst: pd.DataFrame) -> pd.DataFrame:
+    """
+    Let `dst`, a copy of `src` with the same bars, use the indicator cache of `src`.
+
+    Returns:
+        pd.DataFrame: dst
+    """
+    object.__setattr__(dst, 'ind', src.ind)
+    return dst
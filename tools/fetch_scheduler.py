@@ -0,0 +1,274 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Iterable, Optional
+from tqdm import tqdm
+from tools.log import get_fetch_logger
+
+logger = get_fetch_logger()
+
+# error messages that mean the data source is throttling or banning us
+BAN_PATTERNS = (
+    "访问频繁", "请稍后", "超过频率", "频繁访问",
+    "too many requests", "429",
+    "forbidden", "403",
+    "max retries exceeded"
+)
+
+# the data sources' own cooldown once a ban is tripped
+COOLDOWN_SECS = 600
+
+def looks_like_ban(exc: BaseException) -> bool:
+    msg = (str(exc) or "").lower()
+    return any(pat in msg for pat in BAN_PATTERNS)
+
+@dataclass
+class FetchJob:
+    """One blocking SDK call: fn(*args, **kwargs), counted against `endpoint`'s budget."""
+    key: Any
+    endpoint: str
+    fn: Callable
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+class EndpointBudget:
+    """
+    Sliding window budget: at most `max_calls` call starts per `period` seconds.
+
+    The window is plain state and carries over between runs; the asyncio lock is bound
+    to one event loop, reset() makes a new one at the start of every FetchScheduler run.
+    """
+    def __init__(self, max_calls: int, period: float = 60.0):
+        self.max_calls = max_calls
+        self.period = period
+        self._starts: deque[float] = deque()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def reset(self):
+        """Create the lock in the running event loop."""
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self._lock is None:
+            self.reset()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= self.period:
+                    self._starts.popleft()
+                if len(self._starts) < self.max_calls:
+                    self._starts.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._starts[0]))
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase / multiplicative decrease.
+
+    Every fast success adds 1/limit (about +1 per round of calls), a call slower than
+    `target_latency` scales the limit by 0.8 and a ban halves it. The limit carries over
+    between runs, the asyncio condition is made per run by reset().
+    """
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32, target_latency: float = 3.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def reset(self):
+        """Create the condition in the running event loop, no call of a previous run is in flight."""
+        self._cond = asyncio.Condition()
+        self.in_flight = 0
+
+    async def acquire(self):
+        if self._cond is None:
+            self.reset()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, ok: bool, banned: bool = False):
+        async with self._cond:
+            self.in_flight -= 1
+            if banned:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif ok and latency > self.target_latency:
+                self.limit = max(self.minimum, self.limit * 0.8)
+            elif ok:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+@dataclass
+class FetchStats:
+    started_at: float = field(default_factory=time.monotonic)
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    calls: int = 0
+    errors: int = 0
+    bans: int = 0
+    latency_ewma: float = 0.0
+    by_endpoint: dict = field(default_factory=dict)
+
+    def record(self, endpoint: str, latency: float, ok: bool, banned: bool):
+        self.calls += 1
+        self.errors += not ok
+        self.bans += banned
+        self.latency_ewma = latency if self.calls == 1 else 0.9 * self.latency_ewma + 0.1 * latency
+        ep = self.by_endpoint.setdefault(endpoint, {'calls': 0, 'errors': 0, 'bans': 0})
+        ep['calls'] += 1
+        ep['errors'] += not ok
+        ep['bans'] += banned
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            'done': self.done,
+            'failed': self.failed,
+            'total': self.total,
+            'calls_per_min': round(self.calls / elapsed * 60, 1),
+            'error_rate': round(self.errors / self.calls, 4) if self.calls else 0.0,
+            'bans': self.bans,
+            'latency_s': round(self.latency_ewma, 3),
+            'by_endpoint': {k: dict(v) for k, v in self.by_endpoint.items()},
+        }
+
+class FetchScheduler:
+    """
+    Run blocking data-source calls from asyncio with adaptive concurrency.
+
+    Calls run on a bounded thread pool. Concurrency follows an AIMD limit driven by call
+    latency and BAN_PATTERNS errors, every endpoint can have an EndpointBudget, and a ban
+    pauses all calls for a short, doubling backoff (capped at COOLDOWN_SECS) instead of a
+    fixed 10 minute sleep per worker. Failed calls are retried up to `max_attempts` times.
+
+    `on_result(key, result)` runs on the pool after each success (e.g. to hand frames to a
+    writer) and `status()` adds fields to the live progress line.
+
+    Usage:
+        scheduler = FetchScheduler(budgets={"akshare": EndpointBudget(120)})
+        results = scheduler.run(FetchJob(code, "akshare", fetch, (code,)) for code in codes)
+        scheduler.failures  # {key: last exception}
+    """
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        initial_concurrency: int = 4,
+        target_latency: float = 3.0,
+        budgets: Optional[dict[str, EndpointBudget]] = None,
+        max_attempts: int = 3,
+        ban_pause: float = 30.0,
+        report_every: float = 30.0,
+        on_result: Optional[Callable[[Any, Any], None]] = None,
+        status: Optional[Callable[[], dict]] = None,
+        desc: str = "fetch",
+    ):
+        self.max_concurrency = max_concurrency
+        self.limiter = AIMDLimiter(initial_concurrency, 1, max_concurrency, target_latency)
+        self.budgets = budgets or {}
+        self.max_attempts = max_attempts
+        self.ban_pause = ban_pause
+        self.report_every = report_every
+        self.on_result = on_result
+        self.status = status
+        self.desc = desc
+        self.stats = FetchStats()
+        self.failures: dict[Any, BaseException] = {}
+        self._paused_until = 0.0
+        self._consecutive_bans = 0
+
+    def run(self, jobs: Iterable[FetchJob]) -> dict[Any, Any]:
+        """Blocking entry point, returns {job.key: result} of the jobs that succeeded."""
+        return asyncio.run(self.arun(jobs))
+
+    async def arun(self, jobs: Iterable[FetchJob]) -> dict[Any, Any]:
+        jobs = list(jobs)
+        self.stats = FetchStats(total=len(jobs))
+        self.failures = {}
+        # asyncio primitives belong to the loop they were made in, every run may be a new one
+        self.limiter.reset()
+        for budget in self.budgets.values():
+            budget.reset()
+        results: dict[Any, Any] = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        progress = tqdm(total=len(jobs), desc=self.desc)
+        reporter = asyncio.create_task(self._report())
+        try:
+            pending = [asyncio.create_task(self._run_job(job, executor)) for job in jobs]
+            for next_done in asyncio.as_completed(pending):
+                key, ok, value = await next_done
+                if ok:
+                    self.stats.done += 1
+                    results[key] = value
+                else:
+                    self.stats.failed += 1
+                    self.failures[key] = value
+                progress.update(1)
+                progress.set_postfix(
+                    conc=int(self.limiter.limit),
+                    cpm=self.stats.snapshot()['calls_per_min'],
+                    err=self.stats.errors,
+                    ban=self.stats.bans,
+                    **(self.status() if self.status is not None else {}),
+                )
+        finally:
+            reporter.cancel()
+            progress.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info(f"📊 {self.desc}: {self.stats.snapshot()}")
+        return results
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            logger.info(f"📈 {self.desc}: concurrency={int(self.limiter.limit)} {self.stats.snapshot()}")
+
+    async def _wait_for_pause(self):
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def _pause_for_ban(self):
+        self._consecutive_bans += 1
+        pause = min(COOLDOWN_SECS, self.ban_pause * 2 ** (self._consecutive_bans - 1))
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        logger.warning(f"疑似被限流/封禁，暂停 {pause:.0f} 秒，并发降至 {int(self.limiter.limit)}")
+
+    async def _run_job(self, job: FetchJob, executor: ThreadPoolExecutor) -> tuple[Any, bool, Any]:
+        loop = asyncio.get_running_loop()
+        error: BaseException = RuntimeError("not attempted")
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_for_pause()
+            budget = self.budgets.get(job.endpoint)
+            if budget is not None:
+                await budget.acquire()
+            await self.limiter.acquire()
+
+            start = time.monotonic()
+            ok, banned = True, False
+            try:
+                result = await loop.run_in_executor(executor, partial(job.fn, *job.args, **job.kwargs))
+            except Exception as e:
+                ok, banned, error = False, looks_like_ban(e), e
+            latency = time.monotonic() - start
+            await self.limiter.release(latency, ok, banned)
+            self.stats.record(job.endpoint, latency, ok, banned)
+
+            if ok:
+                self._consecutive_bans = 0
+                if self.on_result is not None:
+                    await loop.run_in_executor(executor, self.on_result, job.key, result)
+                return job.key, True, result
+            if banned:
+                self._pause_for_ban()
+            elif attempt < self.max_attempts:
+                await asyncio.sleep(2 ** attempt)
+
+        logger.error(f"{job.key} failed after {self.max_attempts} attempts: {error}")
+        return job.key, False, error
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import zlib
+import pickle
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+from tools.log import get_fetch_logger
+
+logger = get_fetch_logger()
+
+CACHE_PATH = Path(__file__).parent.parent / "database" / "response_cache.db"
+
+# seconds a cached response stays fresh, by kind of data
+CACHE_TTLS = {
+    "bars": 4 * 3600,             # daily bars / adj factors, republished after the close
+    "calendar": 24 * 3600,        # trading calendar
+    "code_list": 24 * 3600,       # listed codes
+    "stock_info": 7 * 24 * 3600,  # company profiles
+    "index_cons": 7 * 24 * 3600,  # index constituents
+    "partial": 15 * 60,           # responses that may still grow, e.g. bars of a day not fully published
+}
+
+# "on": read and write the cache, "off": bypass it,
+# "offline": never touch the network, serve every stored response regardless of age
+CACHE_MODES = ("on", "off", "offline")
+
+class ResponseCacheMiss(LookupError):
+    """Raised in offline mode when a call has no stored response."""
+
+_mode = os.getenv("RESPONSE_CACHE_MODE", "on")
+_local = threading.local()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0}
+_stats_lock = threading.Lock()
+
+def set_cache_mode(mode: str):
+    """Switch the response cache mode for this process, see CACHE_MODES."""
+    global _mode
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unsupported cache mode: {mode}. Choose from {CACHE_MODES}.")
+    _mode = mode
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, -- sha256 of (source, endpoint, params)
+                source TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                params TEXT NOT NULL, -- canonical json, for inspection
+                kind TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data BLOB NOT NULL -- zlib compressed pickle
+            )
+            """
+        )
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def cache_key(source: str, endpoint: str, params: dict) -> tuple[str, str]:
+    canonical = json.dumps([source, endpoint, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), canonical
+
+def cached_call(
+    source: str,
+    endpoint: str,
+    fn: Callable[..., Any],
+    kind: str,
+    complete: Optional[Callable[[Any], bool]] = None,
+    **params
+) -> Any:
+    """
+    Call fn(**params) through the on-disk response cache.
+
+    Responses are keyed by (source, endpoint, params) and are fresh for CACHE_TTLS[kind]
+    seconds. Exceptions, None and empty frames are never stored, so retries of failed
+    calls always reach the network. A response that `complete` rejects is stored as
+    "partial" and refetched after that kind's short TTL.
+
+    Args:
+        source: data source name, e.g. "akshare", "tushare"
+        endpoint: SDK function name, e.g. "stock_zh_a_hist"
+        fn: the blocking SDK call; rate limiting belongs inside it so cache hits cost nothing
+        kind: key of CACHE_TTLS
+        complete: tells whether a response is final, e.g. holds the bars of the latest trading day
+        **params: keyword arguments of the call
+
+    Raises:
+        ResponseCacheMiss: in offline mode when nothing is stored for the call
+    """
+    if _mode == "off":
+        return fn(**params)
+
+    key, canonical = cache_key(source, endpoint, params)
+    row = _connection().execute("SELECT created_at, kind, data FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is not None and (_mode == "offline" or time.time() - row[0] < CACHE_TTLS.get(row[1], CACHE_TTLS[kind])):
+        _count('hits')
+        return pickle.loads(zlib.decompress(row[2]))
+
+    _count('misses')
+    if _mode == "offline":
+        raise ResponseCacheMiss(f"No cached response for {source}.{endpoint} {canonical}")
+
+    result = fn(**params)
+    if result is None or getattr(result, "empty", False):
+        return result
+    if complete is not None and not complete(result):
+        kind = "partial"
+
+    conn = _connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO responses (key, source, endpoint, params, kind, created_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (key, source, endpoint, canonical, kind, time.time(), zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)))
+    )
+    conn.commit()
+    _count('stores')
+    return result
+
+def purge_expired() -> int:
+    """Delete responses older than their kind's TTL, returns the number removed."""
+    conn = _connection()
+    removed = 0
+    now = time.time()
+    for kind, ttl in CACHE_TTLS.items():
+        removed += conn.execute("DELETE FROM responses WHERE kind = ? AND created_at < ?", (kind, now - ttl)).rowcount
+    conn.commit()
+    logger.info(f"Purged {removed} expired cached responses.")
+    return removed
+
+def response_cache_stats() -> dict:
+    """Hits, misses and stores of this process, plus mode and stored response count."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['mode'] = _mode
+    stats['stored'] = _connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    return stats
@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Optional
+import numpy as np
 import pandas as pd
 
 def ms_timestamp_to_date(timestamp) -> Optional[str]:
@@ -19,4 +20,27 @@ def format_date_input_to_yyyy_mm_dd(date_str: str) -> str:
     Format input date string to 'YYYY-MM-DD'.
     """
     dt = pd.to_datetime(date_str, errors='raise')
-    return dt.strftime("%Y-%m-%d")
\ No newline at end of file
+    return dt.strftime("%Y-%m-%d")
+
+def format_date_input_to_int(date_str) -> int:
+    """
+    Format input date (string, datetime or Timestamp) to an integer yyyymmdd, e.g. 20250102.
+    """
+    dt = pd.to_datetime(date_str, errors='raise')
+    return dt.year * 10000 + dt.month * 100 + dt.day
+
+def int_dates_to_datetime(values) -> np.ndarray:
+    """
+    Convert integer yyyymmdd dates to a datetime64[ns] array without string parsing.
+    """
+    v = np.asarray(values, dtype='int64')
+    months = (v // 10000 - 1970) * 12 + (v // 100 % 100 - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (v % 100 - 1)
+    return days.astype('datetime64[ns]')
+
+def datetime_to_int_dates(values) -> np.ndarray:
+    """
+    Convert datetime-like values to integer yyyymmdd dates.
+    """
+    dt = pd.DatetimeIndex(values)
+    return np.asarray(dt.year * 10000 + dt.month * 100 + dt.day, dtype='int64')
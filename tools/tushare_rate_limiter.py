@@ -1,65 +1,119 @@
 import time
+import heapq
 import threading
 import tushare as ts
+from typing import Optional
 from config import TUSHARE_TOKENS
 
-class TokenRateLimiter:
-    def __init__(self, max_calls: int, period: int):
+class TokenBucket:
+    """
+    Rate limit of one token as a GCRA token bucket: a burst of `burst` calls, then one call
+    every (period / (max_calls - burst)) seconds, so no `period` window ever sees more
+    than `max_calls` calls.
+
+    State is a single monotonic "theoretical arrival time", reserving a call is O(1).
+    """
+    def __init__(self, max_calls: int, period: float, burst: int = 3):
+        burst = max(1, min(burst, max_calls - 1))
+        self.interval = period / (max_calls - burst)
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = 0.0
         self.max_calls = max_calls
         self.period = period
-        self.lock = threading.Lock()
-        self.call_timestamps = []
-
-    def acquire(self):
-        while True:
-            with self.lock:
-                now = time.time()
-                self.call_timestamps = [
-                    ts for ts in self.call_timestamps if now - ts < self.period
-                ]
-
-                if len(self.call_timestamps) < self.max_calls:
-                    self.call_timestamps.append(now)
-                    return
-
-                sleep_time = self.period - (now - self.call_timestamps[0])
-
-            time.sleep(max(sleep_time, 1))
-
-
-_rate_limiters = {
-    token: TokenRateLimiter(max_calls=45, period=60)
-    for token in TUSHARE_TOKENS
-}
-
-_tokens = list(TUSHARE_TOKENS)
-_global_lock = threading.Lock()
-
+        # stats
+        self.calls = 0
+        self.waited = 0.0
+        self.first_call: Optional[float] = None
+
+    def available_at(self, now: float) -> float:
+        return max(self.tat, now) - self.tolerance
+
+    def reserve(self, now: float) -> float:
+        """Reserve the next call and return when it may start."""
+        start = max(self.available_at(now), now)
+        self.tat = max(self.tat, now) + self.interval
+        self.calls += 1
+        self.waited += start - now
+        if self.first_call is None:
+            self.first_call = now
+        return start
+
+class TokenPool:
+    """
+    Pool of rate-limited tokens handing out the token that is available earliest.
+
+    Tokens sit in a heap keyed by their next availability, so acquire() is O(log n) and
+    the lock is only held for the bookkeeping, never while waiting. Callers sleep for the
+    exact remaining time (sub-second) outside the lock.
+    """
+    def __init__(self, tokens: list[str], max_calls: int = 45, period: float = 60.0, burst: int = 3):
+        self.tokens = list(tokens)
+        self.buckets = {token: TokenBucket(max_calls, period, burst) for token in self.tokens}
+        self._heap = [(0.0, i) for i in range(len(self.tokens))]
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Reserve a call on the earliest available token and wait until it may start.
+
+        Args:
+            timeout: give up (returning None, nothing reserved) if the wait would be longer
+
+        Returns:
+            the token, or None on timeout
+        """
+        with self._lock:
+            now = time.monotonic()
+            _, i = self._heap[0]
+            token = self.tokens[i]
+            bucket = self.buckets[token]
+            if timeout is not None and bucket.available_at(now) - now > timeout:
+                return None
+            start = bucket.reserve(now)
+            heapq.heapreplace(self._heap, (bucket.available_at(now), i))
+
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return token
+
+    def stats(self) -> dict:
+        """
+        Per token: calls, total seconds callers waited, and utilization (calls made over
+        the calls the token's rate would have allowed since its first call).
+        """
+        now = time.monotonic()
+        stats = {}
+        with self._lock:
+            for token, bucket in self.buckets.items():
+                elapsed = now - bucket.first_call if bucket.first_call is not None else 0.0
+                allowed = bucket.max_calls * max(elapsed, bucket.period) / bucket.period
+                stats[token[:8]] = {
+                    'calls': bucket.calls,
+                    'waited_s': round(bucket.waited, 3),
+                    'utilization': round(bucket.calls / allowed, 4) if bucket.calls else 0.0,
+                }
+        return stats
+
+_pool = TokenPool(TUSHARE_TOKENS, max_calls=45, period=60)
+
+def tushare_token_pool() -> TokenPool:
+    return _pool
 
 def tushare_token_rate_limiter() -> str:
-    while True:
-        with _global_lock:
-            for token in _tokens:
-                limiter = _rate_limiters[token]
-
-                now = time.time()
-                recent_calls = [
-                    ts for ts in limiter.call_timestamps
-                    if now - ts < limiter.period
-                ]
-
-                if len(recent_calls) < limiter.max_calls:
-                    limiter.acquire()
-                    ts.set_token(token)
-                    return token
-                
-        time.sleep(1)
+    """
+    Wait for a tushare call slot and return the token to use (also set as ts's default token).
+    """
+    token = _pool.acquire()
+    ts.set_token(token)
+    return token
 
 
 def test_limiter():
     for i in range(500):
         token = tushare_token_rate_limiter()
         print(f"[{time.strftime('%X')}] Using token: {token}")
+    print(_pool.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+"""
+Before/after benchmark for the daily bar schema v2 migration.
+
+Copies the current database to a temp file, times the per-code queries used by
+datas/query_stock.py on the copy, migrates the copy to schema v2 and times the same
+queries again. The real database is never modified.
+
+Usage:
+    python workflow/bench_bar_schema.py --codes 500 --days 500
+"""
+import sys
+import os
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datas.create_database as create_database
+from datas.create_database import DAILY_BAR_TABLE, daily_bar_schema_version, migrate_daily_bar_table_v2
+from tools.times import int_dates_to_datetime
+
+def time_queries(db_path: Path, codes: list[str], days: int, to_date: str) -> dict:
+    with sqlite3.connect(db_path) as conn:
+        version = daily_bar_schema_version(conn)
+        to_param = int(to_date.replace('-', '')) if version == 2 else to_date
+
+        def read(query, params):
+            df = pd.read_sql_query(query, conn, params=params)
+            if version == 2:
+                df['date'] = int_dates_to_datetime(df['date'].to_numpy())
+            else:
+                df['date'] = pd.to_datetime(df['date'])
+            return df
+
+        timings = {}
+
+        start = time.perf_counter()
+        for code in codes:
+            read(f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ? ORDER BY date DESC LIMIT ?", (code, days))
+        timings['latest_bars'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for code in codes:
+            read(f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ? AND date <= ? ORDER BY date DESC LIMIT ?", (code, to_param, days))
+        timings['bars_by_days'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for code in codes:
+            conn.execute(f"SELECT MAX(date) FROM {DAILY_BAR_TABLE} WHERE code = ?", (code,)).fetchone()
+        timings['max_date'] = time.perf_counter() - start
+
+    return timings
+
+def report(title: str, db_path: Path, timings: dict, n: int):
+    size_mb = db_path.stat().st_size / 1024 / 1024
+    print(f"\n{title}  (file {size_mb:.1f} MB)")
+    for name, seconds in timings.items():
+        print(f"  {name:<14} {seconds:8.3f}s total  {seconds / n * 1000:8.3f} ms/code")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark daily bar schema v1 vs v2 on a copy of the database")
+    parser.add_argument("--codes", type=int, default=500, help="number of random codes to query")
+    parser.add_argument("--days", type=int, default=500, help="bars per query")
+    parser.add_argument("--to-date", default="2024-12-31", help="to_date used by the bars_by_days query (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = Path(tmp) / "bench.db"
+        print(f"Copying {create_database.DB_PATH} -> {copy_path} ...")
+        with sqlite3.connect(create_database.DB_PATH) as src, sqlite3.connect(copy_path) as dst:
+            src.backup(dst)
+
+        with sqlite3.connect(copy_path) as conn:
+            version = daily_bar_schema_version(conn)
+            all_codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE}")]
+        codes = random.sample(all_codes, min(args.codes, len(all_codes)))
+
+        before = time_queries(copy_path, codes, args.days, args.to_date)
+        report(f"schema v{version}", copy_path, before, len(codes))
+
+        if version != 1:
+            print("\nDatabase is not on schema v1, nothing to compare against.")
+            return
+
+        # point the migrator at the copy
+        create_database.DB_PATH = copy_path
+        start = time.perf_counter()
+        migrate_daily_bar_table_v2()
+        print(f"\nMigration took {time.perf_counter() - start:.2f}s")
+
+        after = time_queries(copy_path, codes, args.days, args.to_date)
+        report("schema v2", copy_path, after, len(codes))
+
+        print("\nspeedup")
+        for name in before:
+            print(f"  {name:<14} x{before[name] / after[name]:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Rows/sec benchmark for writing daily bars.
+
+Writes the same synthetic frames into a throw-away database three ways:
+  - baseline: the previous per-frame DataFrame.to_sql path with a dict per row
+  - batch:    save_daily_bars_batch, executemany on a prepared UPSERT
+  - staging:  save_daily_bars_batch(staging=True), TEMP table + one merge
+
+Each pass writes every frame twice (insert, then update) like a refresh overlapping
+already stored days.
+
+Usage:
+    python workflow/bench_bar_upsert.py --codes 1000 --rows 30 --batch 200
+"""
+import sys
+import os
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datas.create_database as create_database
+from datas.create_database import DAILY_BAR_TABLE, create_daily_bar_table
+from datas.fetch_stock_bars import save_daily_bars_batch
+from tools.times import datetime_to_int_dates
+
+def make_frames(n_codes: int, n_rows: int) -> list[pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_rows)
+    frames = []
+    for i in range(n_codes):
+        close = 10 + rng.standard_normal(n_rows).cumsum() * 0.1
+        frames.append(pd.DataFrame({
+            'code': f"{i:06d}",
+            'date': dates,
+            'open': close.round(2),
+            'close': close.round(2),
+            'high': (close + 0.2).round(2),
+            'low': (close - 0.2).round(2),
+            'volume': rng.integers(1_000, 1_000_000, n_rows) * 100,
+            'amount': (close * 1e6).round(2),
+            'change_pct': rng.standard_normal(n_rows).round(2),
+            'price_change': rng.standard_normal(n_rows).round(2),
+        }))
+    return frames
+
+def baseline_save(conn: sqlite3.Connection, df: pd.DataFrame):
+    """The previous save_daily_bars_to_database: to_sql with a dict per row, one commit per frame."""
+    write_df = df.copy()
+    write_df['date'] = datetime_to_int_dates(write_df['date'])
+
+    def upsert_method(table, cursor, keys, data_iter):
+        assignments = ", ".join(f"{col} = excluded.{col}" for col in keys if col not in ('code', 'date'))
+        sql = f"""
+            INSERT INTO {table.name} ({", ".join(keys)})
+            VALUES ({", ".join(f":{key}" for key in keys)})
+            ON CONFLICT (code, date) DO UPDATE SET {assignments};
+        """
+        cursor.executemany(sql, ({k: v for k, v in zip(keys, row)} for row in data_iter))
+
+    write_df.to_sql(name=DAILY_BAR_TABLE, con=conn, if_exists='append', index=False, method=upsert_method, chunksize=5000)
+    conn.commit()
+
+def run(name: str, db_path: Path, frames: list[pd.DataFrame], batch: int) -> float:
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"DELETE FROM {DAILY_BAR_TABLE}")
+        conn.commit()
+        conn.execute('PRAGMA synchronous=NORMAL;')
+
+        start = time.perf_counter()
+        for _ in range(2):
+            if name == "baseline":
+                for df in frames:
+                    baseline_save(conn, df)
+            else:
+                for i in range(0, len(frames), batch):
+                    save_daily_bars_batch(frames[i:i + batch], conn=conn, staging=(name == "staging"))
+        elapsed = time.perf_counter() - start
+    conn.close()
+
+    rows = 2 * sum(len(df) for df in frames)
+    print(f"  {name:<9} {elapsed:8.3f}s  {rows / elapsed:12,.0f} rows/s")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark daily bar upsert throughput")
+    parser.add_argument("--codes", type=int, default=1000, help="number of frames (one per code)")
+    parser.add_argument("--rows", type=int, default=30, help="bars per frame")
+    parser.add_argument("--batch", type=int, default=200, help="frames per save_daily_bars_batch call")
+    args = parser.parse_args()
+
+    frames = make_frames(args.codes, args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # keep the real database and bar store out of it
+        create_database.DB_PATH = Path(tmp) / "bench.db"
+        create_database.BAR_STORE_DIR = Path(tmp) / "bar_store"
+        create_daily_bar_table()
+        with sqlite3.connect(create_database.DB_PATH) as conn:
+            conn.execute('PRAGMA journal_mode=WAL;')
+
+        print(f"{args.codes} frames x {args.rows} rows, written twice, batch={args.batch}")
+        baseline = run("baseline", create_database.DB_PATH, frames, args.batch)
+        batch = run("batch", create_database.DB_PATH, frames, args.batch)
+        staging = run("staging", create_database.DB_PATH, frames, args.batch)
+
+    print(f"\nspeedup: batch x{baseline / batch:.2f}, staging x{baseline / staging:.2f}")
+
+if __name__ == "__main__":
+    main()
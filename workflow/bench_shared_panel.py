@@ -0,0 +1,121 @@
+"""
+Benchmark a multi-process scan reading bars from a shared memory panel against workers
+that each read their codes from SQLite.
+
+Both variants run the same pandas scan per code on a process pool. The SQLite variant
+gives every worker its own connection and reads each code with one range query; the
+panel variant loads the universe once into a SharedMarketPanel and the workers attach to
+it. With --synthetic a temp database of random bars is used, so the 5,000 x 500 case can
+be run without a full market database.
+
+Usage:
+    python workflow/bench_shared_panel.py --synthetic --codes 5000 --days 500 --workers 8
+"""
+import sys
+import os
+import argparse
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datas.create_database as create_database
+import datas.bar_store as bar_store
+from datas.create_database import DAILY_BAR_TABLE, create_daily_bar_table
+from datas.shared_panel import SharedMarketPanel, attach_worker_panel, worker_panel
+from tools.times import int_dates_to_datetime
+
+def scan(df: pd.DataFrame) -> bool:
+    """A typical screen: close above a rising MA20 on above-average volume."""
+    close = df['close']
+    ma20 = close.rolling(20).mean()
+    vol_ratio = df['volume'] / df['volume'].rolling(20).mean()
+    return bool(close.iloc[-1] > ma20.iloc[-1] > ma20.iloc[-5] and vol_ratio.iloc[-1] > 1.5)
+
+_conn = None
+
+def _open_worker_connection():
+    global _conn
+    _conn = sqlite3.connect(create_database.DB_PATH)
+
+def scan_sqlite(codes: list[str], days: int) -> int:
+    hits = 0
+    for code in codes:
+        df = pd.read_sql_query(
+            f"SELECT * FROM {DAILY_BAR_TABLE} WHERE code = ? ORDER BY date DESC LIMIT ?", _conn, params=(code, days)
+        ).iloc[::-1].reset_index(drop=True)
+        df['date'] = int_dates_to_datetime(df['date'].to_numpy())
+        hits += scan(df)
+    return hits
+
+def scan_panel(codes: list[str], days: int) -> int:
+    panel = worker_panel()
+    return sum(scan(panel.frame(code)) for code in codes)
+
+def run_pool(fn, codes: list[str], days: int, workers: int, initializer, initargs=()) -> tuple[int, float]:
+    chunk = max(1, len(codes) // (workers * 4))
+    chunks = [codes[i:i + chunk] for i in range(0, len(codes), chunk)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        hits = sum(executor.map(fn, chunks, [days] * len(chunks)))
+    return hits, time.perf_counter() - start
+
+def make_synthetic_db(path: Path, n_codes: int, days: int) -> list[str]:
+    create_database.DB_PATH = path
+    create_daily_bar_table()
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end="2024-12-31", periods=days).strftime("%Y%m%d").astype(int).tolist()
+    codes = [f"{600000 + i:06d}" for i in range(n_codes)]
+    with sqlite3.connect(path) as conn:
+        for code in codes:
+            close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+            volume = rng.integers(100_000, 10_000_000, days)
+            conn.executemany(
+                f"INSERT INTO {DAILY_BAR_TABLE} (code, date, open, close, high, low, volume, amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (code, d, round(c, 2), round(c, 2), round(c * 1.01, 2), round(c * 0.99, 2), int(v), float(v * c))
+                    for d, c, v in zip(dates, close, volume)
+                ]
+            )
+        conn.commit()
+    return codes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a shared memory panel against per-worker SQLite reads")
+    parser.add_argument("--codes", type=int, default=5000, help="number of codes to scan")
+    parser.add_argument("--days", type=int, default=500, help="bars per code")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--synthetic", action="store_true", help="scan a temp database of random bars")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # read SQLite in both variants, never the columnar store
+        bar_store.BAR_STORE_DIR = Path(tmp) / "no_store"
+        if args.synthetic:
+            print(f"Writing {args.codes} x {args.days} synthetic bars ...")
+            codes = make_synthetic_db(Path(tmp) / "bench.db", args.codes, args.days)
+        else:
+            with sqlite3.connect(create_database.DB_PATH) as conn:
+                codes = [row[0] for row in conn.execute(f"SELECT DISTINCT code FROM {DAILY_BAR_TABLE} ORDER BY code")][:args.codes]
+
+        print(f"\nScanning {len(codes)} codes x {args.days} bars with {args.workers} workers")
+        hits, sqlite_secs = run_pool(scan_sqlite, codes, args.days, args.workers, _open_worker_connection)
+        print(f"  sqlite per worker   {sqlite_secs:8.3f}s  ({hits} hits)")
+
+        start = time.perf_counter()
+        with SharedMarketPanel.create(codes, days=args.days) as panel:
+            load_secs = time.perf_counter() - start
+            hits, panel_secs = run_pool(scan_panel, codes, args.days, args.workers, attach_worker_panel, (panel.spec,))
+        print(f"  panel load          {load_secs:8.3f}s")
+        print(f"  panel scan          {panel_secs:8.3f}s  ({hits} hits)")
+        print(f"\nscan speedup x{sqlite_secs / panel_secs:.2f}, including the load x{sqlite_secs / (load_secs + panel_secs):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
 from datas.fetch_stock_info import fetch_stock_infos
 
-fetch_stock_infos(rebuild=True)
\ No newline at end of file
+fetch_stock_infos()
\ No newline at end of file
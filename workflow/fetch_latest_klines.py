@@ -2,17 +2,25 @@ import time
 from datetime import timedelta
 from tools.log import get_fetch_logger
 from datas.query_stock import query_all_stock_code_list
-from datas.fetch_all_market import fetch_stock_bars_parallel
+from datas.fetch_all_market import fetch_stock_bars_parallel, refresh_daily_bars_incremental
+from datas.create_database import build_bar_store
+from datas.bar_quality import scan_bar_quality
 
 logger = get_fetch_logger()
 start_time = time.time()
 
-# round 1
-fetch_stock_bars_parallel(query_all_stock_code_list(), source="tushare")
+# round 1: one cross-section per missing trading day, per-code backfill for ex-rights codes
+refresh_daily_bars_incremental()
 
-# round 2
+# round 2: per code, for anything still behind
 fetch_stock_bars_parallel(query_all_stock_code_list(), source="tushare")
 
+# refresh the columnar snapshot used by scans
+build_bar_store()
+
+# flag broken ranges, the next run's refresh plan re-fetches them
+scan_bar_quality()
+
 end_time = time.time()
 total_seconds = end_time - start_time
 logger.info(f"📊 used: {total_seconds:.2f} seconds ({timedelta(seconds=total_seconds)})") 
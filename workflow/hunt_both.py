@@ -13,11 +13,14 @@ from datas.query_stock import get_stock_info_by_codes
 def main():
     hunter = HuntMachine(max_workers=20)
     
-    # Run the hunt
-    results1: list[HuntResult] = hunter.hunt(analyze_breakout_pullback, min_bars=365)
-    results2: list[HuntResult] = hunter.hunt(wyckoff_analyze, min_bars=365)
-    
-    results = HuntResult.intersection(results1, results2)
+    # Run both analyzers in one pass, every stock's bars are loaded once
+    hunted = hunter.hunt_many(
+        {"breakout_pullback": analyze_breakout_pullback, "wyckoff": wyckoff_analyze},
+        combine="all",
+        min_bars=365,
+        incremental=True,  # only stocks whose bars changed since the last run are analyzed
+    )
+    results: list[HuntResult] = hunted.combined
     if not results:
         print("No stocks found matching the criteria.")
         return
@@ -16,7 +16,7 @@ def main():
     hunter = HuntMachine(max_workers=8)
     
     # Run the hunt
-    results: list[HuntResult] = hunter.hunt(analyze_breakout_pullback, min_bars=365)
+    results: list[HuntResult] = hunter.hunt(analyze_breakout_pullback, min_bars=365, incremental=True)
     
     if not results:
         print("No stocks found matching the criteria.")
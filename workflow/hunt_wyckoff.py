@@ -16,7 +16,7 @@ def main():
     hunter = HuntMachine(max_workers=20)
     
     # Run the hunt
-    results = hunter.hunt(wyckoff_analyze, min_bars=180)
+    results = hunter.hunt(wyckoff_analyze, min_bars=180, incremental=True)
     
     if not results:
         print("No stocks found matching the criteria.")
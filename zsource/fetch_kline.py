@@ -2,19 +2,18 @@ from __future__ import annotations
 
 import argparse
 import datetime as dt
+import json
 import logging
 import random
 import sys
 import time
 import warnings
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Optional
 import os
 
 import pandas as pd
 import tushare as ts
-from tqdm import tqdm
 
 warnings.filterwarnings("ignore")
 
@@ -31,13 +30,9 @@ logging.basicConfig(
 logger = logging.getLogger("fetch_from_stocklist")
 
 # --------------------------- 限流/封禁处理配置 --------------------------- #
-COOLDOWN_SECS = 600
-BAN_PATTERNS = (
-    "访问频繁", "请稍后", "超过频率", "频繁访问",
-    "too many requests", "429",
-    "forbidden", "403",
-    "max retries exceeded"
-)
+# 与 tools.fetch_scheduler 共用封禁特征与冷却时长
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from tools.fetch_scheduler import BAN_PATTERNS, COOLDOWN_SECS
 
 def _looks_like_ip_ban(exc: Exception) -> bool:
     msg = (str(exc) or "").lower()
@@ -169,6 +164,15 @@ def fetch_one(
     else:
         logger.error("%s 三次抓取均失败，已跳过！", code)
 
+def _fetch_and_save_once(code: str, start: str, end: str, out_dir: Path) -> None:
+    """单次抓取并覆盖保存；异常（含 RateLimitError）交给调度器重试/退避。"""
+    new_df = _get_kline_tushare(code, start, end)
+    if new_df.empty:
+        logger.debug("%s 无数据，生成空表。", code)
+        new_df = pd.DataFrame(columns=["date", "open", "close", "high", "low", "volume"])
+    new_df = validate(new_df)
+    new_df.to_csv(out_dir / f"{code}.csv", index=False)
+
 # --------------------------- 主入口 --------------------------- #
 def main():
     parser = argparse.ArgumentParser(description="从 stocklist.csv 读取股票池并用 Tushare 抓取日线K线（固定qfq，全量覆盖）")
@@ -186,7 +190,9 @@ def main():
     )
     # 其它
     parser.add_argument("--out", default="./data", help="输出目录")
-    parser.add_argument("--workers", type=int, default=6, help="并发线程数")
+    parser.add_argument("--workers", type=int, default=6, help="最大并发数（调度器在此之下自适应调整）")
+    parser.add_argument("--max-per-minute", type=int, default=400, help="pro_bar 每分钟最多调用次数")
+    parser.add_argument("--restart", action="store_true", help="丢弃上次未完成的任务队列，重新抓取全部股票")
     args = parser.parse_args()
 
     # ---------- Tushare Token ---------- #
@@ -206,33 +212,61 @@ def main():
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    # ---------- 从 stocklist.csv 读取股票池 ---------- #
+    # ---------- 持久化任务队列（可断点续抓，多进程共享） ---------- #
+    from tools.fetch_scheduler import FetchScheduler, FetchJob, EndpointBudget
+    from datas.fetch_jobs import FetchJobQueue, run_fetch_queue
+
     exclude_boards = set(args.exclude_boards or [])
-    codes = load_codes_from_stocklist(args.stocklist, exclude_boards)
+    # 决定股票池和日期的原始参数，续抓时必须与上次一致（today 按原样比较，续抓沿用上次解析出的日期）
+    run_args = {
+        "start": str(args.start),
+        "end": str(args.end),
+        "stocklist": str(args.stocklist.resolve()),
+        "exclude_boards": sorted(exclude_boards),
+    }
+
+    jobs = FetchJobQueue(f"kline_csv:{out_dir.resolve()}")
+    if args.restart:
+        jobs.clear()
+    if jobs.has_unfinished():
+        stored_args = {json.dumps(payload.get("args"), sort_keys=True) for payload in jobs.payloads().values()}
+        if stored_args != {json.dumps(run_args, sort_keys=True)}:
+            logger.error(
+                "上次未完成的任务参数与本次不同：%s → %s，请加 --restart 丢弃旧任务后重新抓取。",
+                " | ".join(sorted(stored_args)), json.dumps(run_args, sort_keys=True),
+            )
+            sys.exit(1)
+        logger.info("继续上次未完成的任务：%s（--restart 可重新开始）", jobs.counts())
+    else:
+        # ---------- 从 stocklist.csv 读取股票池 ---------- #
+        codes = load_codes_from_stocklist(args.stocklist, exclude_boards)
 
-    if not codes:
-        logger.error("stocklist 为空或被过滤后无代码，请检查。")
-        sys.exit(1)
+        if not codes:
+            logger.error("stocklist 为空或被过滤后无代码，请检查。")
+            sys.exit(1)
 
-    logger.info(
-        "开始抓取 %d 支股票 | 数据源:Tushare(日线,qfq) | 日期:%s → %s | 排除:%s",
-        len(codes), start, end, ",".join(sorted(exclude_boards)) or "无",
+        logger.info(
+            "开始抓取 %d 支股票 | 数据源:Tushare(日线,qfq) | 日期:%s → %s | 排除:%s",
+            len(codes), start, end, ",".join(sorted(exclude_boards)) or "无",
+        )
+        jobs.enqueue({code: {"start": start, "end": end, "args": run_args} for code in codes})
+
+    # ---------- 异步调度抓取（全量覆盖，AIMD 自适应并发，失败按股票退避重试） ---------- #
+    scheduler = FetchScheduler(
+        max_concurrency=args.workers,
+        initial_concurrency=min(2, args.workers),
+        budgets={"pro_bar": EndpointBudget(max_calls=args.max_per_minute, period=60)},
+        max_attempts=1,
+        desc="下载进度",
     )
-
-    # ---------- 多线程抓取（全量覆盖） ---------- #
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        futures = [
-            executor.submit(
-                fetch_one,
-                code,
-                start,
-                end,
-                out_dir,
-            )
-            for code in codes
-        ]
-        for _ in tqdm(as_completed(futures), total=len(futures), desc="下载进度"):
-            pass
+    counts = run_fetch_queue(
+        jobs,
+        scheduler,
+        lambda job: FetchJob(job.code, "pro_bar", _fetch_and_save_once, (job.code, job.payload["start"], job.payload["end"], out_dir)),
+    )
+    if counts["failed"]:
+        failed = jobs.failed_jobs()
+        logger.error("%d 支股票多次抓取失败，已跳过：%s", len(failed), ",".join(list(failed)[:50]))
 
     logger.info("全部任务完成，数据已保存至 %s", out_dir.resolve())
 
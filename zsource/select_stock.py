@@ -6,7 +6,7 @@ import json
 import logging
 import sys
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Optional
 
 import pandas as pd
 
@@ -37,6 +37,25 @@ def load_data(data_dir: Path, codes: Iterable[str]) -> Dict[str, pd.DataFrame]:
     return frames
 
 
+def load_data_parquet(parquet_dir: Path, codes: Optional[Iterable[str]]) -> Dict[str, pd.DataFrame]:
+    """从 datas.parquet_store 导出的 Parquet 数据集一次性读取行情，按代码拆分"""
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from datas.parquet_store import read_daily_bars_parquet
+
+    df = read_daily_bars_parquet(
+        codes=list(codes) if codes is not None else None,
+        columns=["open", "close", "high", "low", "volume"],
+        data_dir=parquet_dir,
+        arrow_dtypes=False,
+    )
+    if df.empty:
+        return {}
+    return {
+        code: frame.drop(columns="code").reset_index(drop=True)
+        for code, frame in df.groupby("code", sort=False)
+    }
+
+
 def load_config(cfg_path: Path) -> List[Dict[str, Any]]:
     if not cfg_path.exists():
         logger.error("配置文件 %s 不存在", cfg_path)
@@ -80,27 +99,40 @@ def instantiate_selector(cfg: Dict[str, Any]):
 def main():
     p = argparse.ArgumentParser(description="Run selectors defined in configs.json")
     p.add_argument("--data-dir", default="./data", help="CSV 行情目录")
+    p.add_argument("--parquet-dir", help="Parquet 行情数据集目录（datas.parquet_store 导出）；指定后忽略 --data-dir")
     p.add_argument("--config", default="./configs.json", help="Selector 配置文件")
     p.add_argument("--date", help="交易日 YYYY-MM-DD；缺省=数据最新日期")
     p.add_argument("--tickers", default="all", help="'all' 或逗号分隔股票代码列表")
     args = p.parse_args()
 
     # --- 加载行情 ---
-    data_dir = Path(args.data_dir)
-    if not data_dir.exists():
-        logger.error("数据目录 %s 不存在", data_dir)
-        sys.exit(1)
-
-    codes = (
-        [f.stem for f in data_dir.glob("*.csv")]
-        if args.tickers.lower() == "all"
-        else [c.strip() for c in args.tickers.split(",") if c.strip()]
-    )
-    if not codes:
-        logger.error("股票池为空！")
-        sys.exit(1)
-
-    data = load_data(data_dir, codes)
+    if args.parquet_dir:
+        parquet_dir = Path(args.parquet_dir)
+        if not parquet_dir.exists():
+            logger.error("数据目录 %s 不存在", parquet_dir)
+            sys.exit(1)
+        codes = (
+            None
+            if args.tickers.lower() == "all"
+            else [c.strip() for c in args.tickers.split(",") if c.strip()]
+        )
+        data = load_data_parquet(parquet_dir, codes)
+    else:
+        data_dir = Path(args.data_dir)
+        if not data_dir.exists():
+            logger.error("数据目录 %s 不存在", data_dir)
+            sys.exit(1)
+
+        codes = (
+            [f.stem for f in data_dir.glob("*.csv")]
+            if args.tickers.lower() == "all"
+            else [c.strip() for c in args.tickers.split(",") if c.strip()]
+        )
+        if not codes:
+            logger.error("股票池为空！")
+            sys.exit(1)
+
+        data = load_data(data_dir, codes)
     if not data:
         logger.error("未能加载任何行情数据")
         sys.exit(1)